@@ -0,0 +1,206 @@
+"""Benchmarks of the main analysis and plotting paths on synthetic experiments of several sizes.
+
+Run them with asv from the repository root, e.g. ``asv run`` to benchmark the history or ``asv run --python=same
+--quick`` to benchmark the working tree in the current environment. The experiment files are generated once per run by
+twaxs.synthetic in the layout of the ESRF ID31 files.
+"""
+
+import os
+import sys
+import tempfile
+import subprocess
+import matplotlib
+import numpy as np
+
+matplotlib.use("Agg")
+
+import matplotlib.pyplot as plt
+from twaxs import auxiliary as aux
+from twaxs import faradaic
+from twaxs import fitting
+from twaxs import metadata
+from twaxs import phases
+from twaxs import plot
+from twaxs import references
+from twaxs import registry
+from twaxs.dataset import LoadData
+from twaxs.synthetic import write_synthetic_experiment
+
+# (number of scans, number of positions, number of q bins)
+SIZES = {
+    "small": (40, 10, 500),
+    "medium": (200, 20, 1000),
+    "large": (800, 30, 2000),
+}
+Q_WINDOW = (1.9, 2.1)
+
+
+def _make_experiments():
+    directory = tempfile.mkdtemp(prefix="twaxs-bench-")
+    experiments = {}
+    for name, (n_scans, n_positions, n_q) in SIZES.items():
+        experiments[name] = write_synthetic_experiment(
+            os.path.join(directory, name),
+            n_scans=n_scans,
+            n_positions=n_positions,
+            n_q=n_q,
+            ragged=True,
+        )
+    return experiments
+
+
+def _cold_dataset(paths):
+    """Create a LoadData object with no handles, sheets, scan index or cube cached from a previous repetition."""
+    aux.close_files()
+    metadata._INDEX_CACHE.clear()
+    registry._REGISTRY_CACHE.clear()
+    faradaic._FE_CACHE.clear()
+    return LoadData(1, 0, paths["data_info"])
+
+
+# Modules that the non-interactive core (dataset, auxiliary, metadata) must not import
+GUI_MODULES = ("plotly", "ipywidgets", "IPython", "scipy.signal", "matplotlib")
+
+
+class ImportSuite:
+    """Import time of the package in a fresh interpreter, to keep headless job starts fast."""
+
+    def timeraw_import_dataset(self):
+        return "import twaxs.dataset"
+
+    def timeraw_import_plot(self):
+        return "import twaxs.plot"
+
+    def track_gui_modules_imported_by_core(self):
+        code = (
+            "import sys, twaxs.dataset, twaxs.auxiliary, twaxs.metadata; "
+            f"print(sum(m in sys.modules for m in {GUI_MODULES!r}))"
+        )
+        return int(subprocess.check_output([sys.executable, "-c", code]))
+
+    track_gui_modules_imported_by_core.unit = "modules"
+
+
+class LoadDataSuite:
+    params = list(SIZES)
+    param_names = ["size"]
+    timeout = 600
+
+    def setup_cache(self):
+        return _make_experiments()
+
+    def setup(self, experiments, size):
+        self.paths = experiments[size]
+
+    def time_construct(self, experiments, size):
+        _cold_dataset(self.paths)
+
+    def time_construct_shared_registry(self, experiments, size):
+        sheet = registry.get_registry(self.paths["data_info"])
+        for height_group in range(4):
+            LoadData(1, height_group, sheet)
+
+    def time_height_group_frame(self, experiments, size):
+        _cold_dataset(self.paths).height_group_frame
+
+    def time_intensity_cube(self, experiments, size):
+        _cold_dataset(self.paths).get_intensity_cube()
+
+
+class MetadataSuite:
+    params = [100, 10000]
+    param_names = ["n_scans"]
+
+    def setup(self, n_scans):
+        self.timestamps = [
+            f"2023-09-14T{10 + i // 3600 % 12:02d}:{i // 60 % 60:02d}:{i % 60:02d}.{i:06d}+02:00"
+            for i in range(n_scans)
+        ]
+
+    def time_parse_start_times(self, n_scans):
+        metadata._parse_start_times(self.timestamps)
+
+
+class FittingSuite:
+    params = list(SIZES)
+    param_names = ["size"]
+    timeout = 600
+
+    def setup_cache(self):
+        return _make_experiments()
+
+    def setup(self, experiments, size):
+        dataset = _cold_dataset(experiments[size])
+        self.q, self.cube = dataset.get_window_cube(*Q_WINDOW)
+
+    def time_fit_peaks(self, experiments, size):
+        fitting.fit_peaks(self.q, self.cube, "pseudo_voigt", positions=[2, 3, 4, 5])
+
+
+class PhaseSuite:
+    params = list(SIZES)
+    param_names = ["size"]
+    timeout = 600
+
+    def setup_cache(self):
+        return _make_experiments()
+
+    def setup(self, experiments, size):
+        dataset = _cold_dataset(experiments[size])
+        self.q, self.cube = dataset.get_window_cube(None, None)
+        # 300 random patterns of 5 to 30 peaks, in place of a folder of reference files
+        rng = np.random.default_rng(0)
+        n_peaks = rng.integers(5, 31, 300)
+        offsets = np.concatenate([[0], np.cumsum(n_peaks)])
+        self.library = references.ReferenceLibrary(
+            [f"pattern{i}" for i in range(len(n_peaks))],
+            offsets,
+            rng.uniform(10, 120, offsets[-1]),
+            rng.uniform(0, 100, offsets[-1]),
+        )
+
+    def time_match_phases(self, experiments, size):
+        phases.match_phases(self.q, self.cube, self.library)
+
+
+class PlotSuite:
+    params = list(SIZES)
+    param_names = ["size"]
+    timeout = 600
+
+    def setup_cache(self):
+        return _make_experiments()
+
+    def setup(self, experiments, size):
+        self.paths = experiments[size]
+        self.dataset = _cold_dataset(self.paths)
+        self.scans = self.dataset.height_group_frame[:5]
+
+    def teardown(self, experiments, size):
+        plt.close("all")
+
+    def time_heatmap(self, experiments, size):
+        plot.heatmap(_cold_dataset(self.paths), *Q_WINDOW, display_rxn_time=True)
+
+    def time_heatmap_replot(self, experiments, size):
+        # The first call builds the intensity cube of the dataset, the second one only takes another q window from it
+        plot.heatmap(self.dataset, *Q_WINDOW)
+        plot.heatmap(self.dataset, 2.8, 3.0)
+
+    def time_compare_peak_fe(self, experiments, size):
+        plot.compare_peak_fe(
+            _cold_dataset(self.paths),
+            *Q_WINDOW,
+            [2, 5],
+            self.paths["gc"],
+            smoothing_window=7,
+        )
+
+    def time_waterfall(self, experiments, size):
+        plot.waterfall(_cold_dataset(self.paths), [2, 5], display_rxn_time=True)
+
+    def time_vertical_compare(self, experiments, size):
+        plot.vertical_compare(self.dataset, *Q_WINDOW, self.scans)
+
+    def time_peak_span(self, experiments, size):
+        plot.peak_span(self.dataset, *Q_WINDOW, position=3, n_plot=5)
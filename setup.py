@@ -21,4 +21,7 @@ setup(
     'ipykernel',
     'pathlib'
     ],
+    entry_points={
+        'console_scripts': ['twaxs=twaxs.cli:main'],
+    },
 )
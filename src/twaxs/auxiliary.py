@@ -5,26 +5,324 @@ import h5py
 import numpy as np
 import pandas as pd
 import os
-import math
-from dateutil.parser import parse
-from scipy.signal import savgol_filter
-from typing import List, Union, Optional, Any
+import atexit
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, Union, Optional, Any, Callable, Iterator, Dict, Sequence, Tuple
+from . import profiling
+
+
+class H5FilePool:
+    """
+    A bounded pool of read-only hdf5 file handles with least-recently-used eviction.
+
+    Opening an hdf5 file re-parses its superblock and root group, which dominates the cost of reading a small dataset
+    from a multi-GB file. The pool keeps up to max_open handles alive between reads and closes the least recently used
+    one when the limit is exceeded. Access is serialized with a lock so the pool can be shared between threads, and a
+    forked child process starts with an empty pool instead of reusing the handles inherited from its parent.
+
+    A handle is re-opened when the modification time or size of its file changed since it was opened, so data appended
+    to a file that is still being written (e.g. during a beamtime) becomes visible. Additional keyword arguments are
+    passed to h5py.File, e.g. swmr=True or locking=False for files that are open for writing by another process.
+
+    The pool can be used as a context manager, in which case every handle is closed on exit.
+    """
+
+    _instances: "weakref.WeakSet[H5FilePool]" = weakref.WeakSet()
+
+    def __init__(self, max_open: int = 8, **open_kwargs: Any):
+        if max_open < 1:
+            raise ValueError("max_open must be a positive integer.")
+        self.max_open = max_open
+        self.open_kwargs = open_kwargs
+        self._handles: "OrderedDict[str, Tuple[h5py.File, Tuple[int, int]]]" = (
+            OrderedDict()
+        )
+        self._lock = threading.RLock()
+        self._pid = os.getpid()
+        H5FilePool._instances.add(self)
+
+    def _reset_after_fork(self) -> None:
+        """Forget the handles inherited from the parent process without closing them."""
+        self._handles = OrderedDict()
+        self._lock = threading.RLock()
+        self._pid = os.getpid()
+
+    def _acquire(self, fl: str) -> h5py.File:
+        """Return an open handle for fl; the caller must hold the pool lock."""
+        key = os.path.abspath(os.fspath(fl))
+        signature = file_signature(key)
+        entry = self._handles.pop(key, None)
+        if entry is not None:
+            f, opened_signature = entry
+            if f.id.valid and opened_signature == signature:
+                self._handles[key] = entry
+                return f
+            if f.id.valid:
+                f.close()
+        with profiling.stage("h5.open"):
+            f = h5py.File(key, "r", **self.open_kwargs)
+        profiling.record_open(key)
+        self._handles[key] = (f, signature)
+        while len(self._handles) > self.max_open:
+            _, (oldest, _) = self._handles.popitem(last=False)
+            oldest.close()
+        return f
+
+    @contextmanager
+    def file(self, fl: str) -> Iterator[h5py.File]:
+        """
+        Yield a pooled handle for fl while holding the pool lock.
+
+        The handle stays valid for the duration of the with-block and must not be closed or kept by the caller.
+        """
+        if self._pid != os.getpid():
+            self._reset_after_fork()
+        with self._lock:
+            yield self._acquire(fl)
+
+    def read(self, fl: str, dataset_path: str, selection: Any = None) -> Any:
+        """Read a dataset, or the selection of it if one is given, from fl through a pooled handle."""
+        with self.file(fl) as f, profiling.stage("h5.read"):
+            dataset = f[dataset_path]
+            data = dataset[()] if selection is None else dataset[selection]
+        profiling.record_read(dataset_path, getattr(data, "nbytes", 0))
+        return data
+
+    def shape(self, fl: str, dataset_path: str) -> Tuple[int, ...]:
+        """Get the shape of a dataset in fl without reading its data."""
+        with self.file(fl) as f:
+            return f[dataset_path].shape
+
+    def close(self, fl: Optional[str] = None) -> None:
+        """Close the handle of fl, or every handle in the pool if fl is not given."""
+        if self._pid != os.getpid():
+            self._reset_after_fork()
+            return
+        with self._lock:
+            if fl is None:
+                keys = list(self._handles)
+            else:
+                keys = [os.path.abspath(os.fspath(fl))]
+            for key in keys:
+                entry = self._handles.pop(key, None)
+                if entry is not None and entry[0].id.valid:
+                    entry[0].close()
+
+    def __len__(self) -> int:
+        return len(self._handles)
+
+    def __enter__(self) -> "H5FilePool":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+def _reset_pools_after_fork() -> None:
+    for pool in list(H5FilePool._instances):
+        pool._reset_after_fork()
+
 
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_pools_after_fork)
 
-def get_data(fl: str, dataset_path: str) -> Any:
+_FILE_POOL = H5FilePool()
+atexit.register(_FILE_POOL.close)
+
+
+def get_file_pool() -> H5FilePool:
+    """Return the process-wide pool of hdf5 file handles used by get_data."""
+    return _FILE_POOL
+
+
+def close_files(fl: Optional[str] = None) -> None:
+    """
+    Close pooled hdf5 file handles.
+
+    Parameters:
+    fl (str, optional): Close only the handle of this file. If not given, every pooled handle is closed.
+    """
+    _FILE_POOL.close(fl)
+
+
+def get_data(fl: str, dataset_path: str, selection: Any = None) -> Any:
     """
     Extract data from a specified hdf5 file and dataset path.
 
+    The file is opened through the process-wide handle pool, so repeated reads from the same file do not re-open it.
+    If a selection is given, only that part of the dataset is read from the file (an hdf5 hyperslab), e.g.
+    get_data(fl, path, 3) reads one row and get_data(fl, path, np.s_[2:5, 100:200]) a block of positions and q bins.
+
     Parameters:
     fl (str): The file path for the hdf5 file.
     dataset_path (str): The specific dataset path within the hdf5 file.
+    selection (optional): An index, slice or tuple of them selecting the part of the dataset to read.
 
     Returns:
     Any: The data found at the specified dataset path within the file.
     """
-    with h5py.File(fl, "r") as f:
-        data = f[dataset_path][()]
-    return data
+    return _FILE_POOL.read(fl, dataset_path, selection)
+
+
+def get_shape(fl: str, dataset_path: str) -> Tuple[int, ...]:
+    """
+    Get the shape of a dataset in a hdf5 file from its metadata, without reading the data.
+
+    Parameters:
+    fl (str): The file path for the hdf5 file.
+    dataset_path (str): The specific dataset path within the hdf5 file.
+
+    Returns:
+    Tuple[int, ...]: The shape of the dataset.
+    """
+    return _FILE_POOL.shape(fl, dataset_path)
+
+
+def get_q_window(
+    q: np.ndarray, x_min: Optional[float], x_max: Optional[float], margin: int = 0
+) -> slice:
+    """
+    Get the slice of a sorted q axis that lies within [x_min, x_max], to read only that part of a spectrum.
+
+    Parameters:
+    q (numpy array): The sorted q axis.
+    x_min (float, optional): The minimum q value (inclusive). No lower bound if None.
+    x_max (float, optional): The maximum q value (inclusive). No upper bound if None.
+    margin (int): Number of extra points to include on both sides, e.g. half the window of a smoothing filter.
+
+    Returns:
+    slice: The index range, clipped to the length of q.
+    """
+    lo = 0 if x_min is None else int(np.searchsorted(q, x_min, side="left"))
+    hi = len(q) if x_max is None else int(np.searchsorted(q, x_max, side="right"))
+    hi = max(hi, lo)
+    return slice(max(lo - margin, 0), min(hi + margin, len(q)))
+
+
+def file_signature(fl: str) -> Tuple[int, int]:
+    """Return the modification time (ns) and size of a file, which change whenever the file is written."""
+    stat = os.stat(fl)
+    return stat.st_mtime_ns, stat.st_size
+
+
+class FileCache:
+    """
+    Values derived from files, such as parsed sheets or indexes, kept for the lifetime of the process.
+
+    A value is keyed by the absolute path of its file and derived again when the file_signature of the file changes.
+    Access is serialized with a lock, but a value is derived outside of it.
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, Tuple[Tuple[int, int], Any]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, fl: str, load: Callable[[str], Any]) -> Any:
+        """Return the value of fl, calling load with the absolute path of fl if it is not cached or the file changed."""
+        key = os.path.abspath(fl)
+        signature = file_signature(key)
+        with self._lock:
+            cached = self._entries.get(key)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        value = load(key)
+        with self._lock:
+            self._entries[key] = (signature, value)
+        return value
+
+    def previous(self, fl: str) -> Any:
+        """Return the value of fl, even if the file changed since, or None if there is none."""
+        with self._lock:
+            cached = self._entries.get(os.path.abspath(fl))
+        return None if cached is None else cached[1]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+def cache_path(cache_dir: str, fl: str, suffix: str, *key_parts: Any) -> Path:
+    """
+    Return a path in cache_dir for data derived from the file fl.
+
+    The file name contains a digest of the path, modification time and size of fl together with key_parts, so a
+    changed source file or different parameters never hit a stale cache entry.
+
+    Parameters:
+    cache_dir (str): The cache directory.
+    fl (str): The source file the cached data is derived from.
+    suffix (str): The suffix of the cache file, e.g. ".npy".
+    key_parts: Additional values (with a stable repr) that the cached data depends on.
+
+    Returns:
+    Path: The path of the cache file. The file itself may not exist yet.
+    """
+    key = repr((os.path.abspath(fl),) + file_signature(fl) + key_parts)
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+    return Path(cache_dir) / f"{Path(fl).stem}_{digest}{suffix}"
+
+
+class AppendableArray:
+    """
+    An array that grows along its first axis with amortized constant cost per appended row.
+
+    Rows are stored in a buffer whose capacity doubles when it is full. Blocks whose trailing dimensions are larger
+    than the ones of the rows appended before widen the array; cells that were never written are NaN.
+    """
+
+    def __init__(self, initial: Optional[np.ndarray] = None):
+        self._buffer: Optional[np.ndarray] = None
+        self._length = 0
+        if initial is not None:
+            self.append(initial)
+
+    def __len__(self) -> int:
+        return self._length
+
+    @property
+    def view(self) -> np.ndarray:
+        """The appended rows, as a view into the buffer."""
+        if self._buffer is None:
+            return np.empty((0,))
+        return self._buffer[: self._length]
+
+    def append(self, block: np.ndarray) -> None:
+        """Append the rows of block (an array with at least one dimension)."""
+        block = np.asarray(block)
+        n_new = len(block)
+        if self._buffer is None:
+            shape = block.shape[1:]
+            dtype = np.result_type(block.dtype, np.float32)
+        else:
+            shape = tuple(
+                max(a, b) for a, b in zip(self._buffer.shape[1:], block.shape[1:])
+            )
+            dtype = self._buffer.dtype
+        if (
+            self._buffer is None
+            or self._length + n_new > len(self._buffer)
+            or shape != self._buffer.shape[1:]
+        ):
+            capacity = max(2 * self._length, self._length + n_new, 16)
+            buffer = np.full((capacity,) + shape, np.nan, dtype=dtype)
+            if self._buffer is not None:
+                old = self.view
+                buffer[self._region(0, old)] = old
+            self._buffer = buffer
+        self._buffer[self._region(self._length, block)] = block
+        self._length += n_new
+
+    @staticmethod
+    def _region(start: int, block: np.ndarray) -> Tuple[slice, ...]:
+        """Return the index of the region of the buffer that block occupies when written at row start."""
+        rows = slice(start, start + len(block))
+        return (rows,) + tuple(slice(0, n) for n in block.shape[1:])
 
 
 def find_peak_height(
@@ -46,8 +344,8 @@ def find_peak_height(
     float: The peak height in the given range, or None if the range is invalid
     """
     # Converting X and Y to numpy arrays if they are not already
-    X = np.array(X)
-    Y = np.array(Y)
+    X = np.asarray(X)
+    Y = np.asarray(Y)
 
     # Finding the indices of X values within the range [x_min, x_max]
     valid_indices = np.where((X >= x_min) & (X <= x_max))
@@ -61,6 +359,185 @@ def find_peak_height(
     return peak_height
 
 
+PEAK_STATS = ("max", "argmax_q", "area", "centroid")
+
+_trapezoid = getattr(np, "trapezoid", None) or np.trapz
+
+
+@profiling.timed("peak_finding")
+def find_peak_stats(
+    X: Union[List[float], np.ndarray],
+    Y: np.ndarray,
+    windows: Union[Tuple[float, float], Sequence[Tuple[float, float]]],
+    stats: Sequence[str] = PEAK_STATS,
+) -> Dict[str, np.ndarray]:
+    """
+    Compute peak statistics of many spectra over one or several x windows at once.
+
+    All spectra share the x axis X, which must be sorted. The index bounds of every window are found once with
+    np.searchsorted and each statistic is then a single reduction over the last axis of Y, so a full (scan x position)
+    map does not need a Python loop over spectra.
+
+    Parameters:
+    X (list or numpy array): The sorted array of x values (q) shared by all spectra.
+    Y (numpy array): Intensities of shape (..., len(X)), e.g. (position, q) or (scan, position, q).
+    windows (tuple or list of tuples): A single (x_min, x_max) window, or a sequence of them. Both bounds are
+    inclusive, as in find_peak_height.
+    stats (sequence of str): The statistics to compute, any of "max", "argmax_q" (x value at the maximum), "area"
+    (trapezoidal integral) and "centroid" (intensity-weighted mean x).
+
+    Returns:
+    Dict[str, np.ndarray]: An array of shape Y.shape[:-1] + (n_windows,) for each requested statistic. The window
+    axis is dropped if a single window was given. Windows without any data point and spectra that are NaN (padded
+    positions) give NaN.
+    """
+    unknown = set(stats) - set(PEAK_STATS)
+    if unknown:
+        raise ValueError(f"Unknown peak statistics: {sorted(unknown)}")
+    X = np.asarray(X)
+    Y = np.asarray(Y)
+    if len(X) > 1 and X[0] > X[-1]:
+        X = X[::-1]
+        Y = Y[..., ::-1]
+    single_window = np.ndim(windows) == 1
+    bounds = np.atleast_2d(np.asarray(windows, dtype=float))
+    idx_lo = np.searchsorted(X, bounds[:, 0], side="left")
+    idx_hi = np.searchsorted(X, bounds[:, 1], side="right")
+
+    out_dtype = np.result_type(Y.dtype, np.float32)
+    results = {
+        name: np.full(Y.shape[:-1] + (len(bounds),), np.nan, dtype=out_dtype)
+        for name in stats
+    }
+    for k, (lo, hi) in enumerate(zip(idx_lo, idx_hi)):
+        if hi <= lo:
+            continue
+        x_win = X[lo:hi]
+        y_win = Y[..., lo:hi]
+        if "max" in results or "argmax_q" in results:
+            peak = np.max(y_win, axis=-1)
+            if "max" in results:
+                results["max"][..., k] = peak
+            if "argmax_q" in results:
+                argmax_q = x_win[np.argmax(y_win, axis=-1)]
+                results["argmax_q"][..., k] = np.where(np.isnan(peak), np.nan, argmax_q)
+        if "area" in results:
+            results["area"][..., k] = _trapezoid(y_win, x_win, axis=-1)
+        if "centroid" in results:
+            with np.errstate(invalid="ignore", divide="ignore"):
+                results["centroid"][..., k] = np.sum(y_win * x_win, axis=-1) / np.sum(
+                    y_win, axis=-1
+                )
+
+    if single_window:
+        results = {name: value[..., 0] for name, value in results.items()}
+    return results
+
+
+def minmax_decimate(
+    coords: np.ndarray, values: np.ndarray, max_points: int, axis: int = -1
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Reduce an array along an axis to at most max_points samples, keeping the minimum and maximum of every bin.
+
+    The axis is split into max_points // 2 bins of (almost) equal size, and every bin is replaced by two samples: its
+    minimum, placed at the coordinate of the start of the bin, and its maximum, placed at the coordinate of its middle.
+    Unlike plain subsampling, narrow peaks and dips stay visible. NaN values are ignored unless a bin holds nothing else.
+
+    Parameters:
+    coords (numpy array): The increasing coordinates of the samples along the axis.
+    values (numpy array): The array to reduce.
+    max_points (int): The maximum number of samples to keep along the axis, e.g. the number of pixels of the plot.
+    axis (int): The axis to reduce.
+
+    Returns:
+    Tuple[np.ndarray, np.ndarray]: The coordinates and values of the kept samples. The input is returned unchanged if
+    it has no more than max_points samples along the axis.
+    """
+    if max_points < 2:
+        raise ValueError("max_points must be at least 2.")
+    coords = np.asarray(coords)
+    values = np.asarray(values)
+    n = values.shape[axis]
+    if n <= max_points:
+        return coords, values
+    n_bins = max(max_points // 2, 1)
+    edges = np.linspace(0, n, n_bins + 1).astype(int)
+    starts = edges[:-1]
+    middles = (edges[:-1] + edges[1:]) // 2
+
+    moved = np.moveaxis(values, axis, -1)
+    reduced = np.empty(moved.shape[:-1] + (2 * n_bins,), dtype=moved.dtype)
+    reduced[..., 0::2] = np.fmin.reduceat(moved, starts, axis=-1)
+    reduced[..., 1::2] = np.fmax.reduceat(moved, starts, axis=-1)
+    reduced_coords = np.empty(2 * n_bins, dtype=np.result_type(coords, np.float64))
+    reduced_coords[0::2] = coords[starts]
+    reduced_coords[1::2] = coords[middles]
+    return reduced_coords, np.moveaxis(reduced, -1, axis)
+
+
+def lttb_decimate(
+    x: np.ndarray, y: np.ndarray, max_points: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Reduce a line to at most max_points points with the Largest-Triangle-Three-Buckets algorithm.
+
+    The first and last points are kept, and the points in between are split into max_points - 2 buckets. From every
+    bucket, the point that forms the largest triangle with the point kept from the previous bucket and the mean of the
+    next bucket is kept, which preserves the visual shape of the line, including narrow peaks.
+
+    Parameters:
+    x (numpy array): The increasing x values.
+    y (numpy array): The y values.
+    max_points (int): The maximum number of points to keep, e.g. the width of the plot in pixels.
+
+    Returns:
+    Tuple[np.ndarray, np.ndarray]: The kept x and y values. The input is returned unchanged if it has no more than
+    max_points points.
+    """
+    if max_points < 3:
+        raise ValueError("max_points must be at least 3.")
+    x = np.asarray(x)
+    y = np.asarray(y)
+    n = len(x)
+    if n <= max_points:
+        return x, y
+    every = (n - 2) / (max_points - 2)
+    edges = np.append((np.arange(max_points - 1) * every).astype(int) + 1, n)
+    kept = np.empty(max_points, dtype=int)
+    kept[0] = 0
+    kept[-1] = n - 1
+    a = 0
+    for i in range(max_points - 2):
+        start, end = edges[i], edges[i + 1]
+        next_x = x[end : edges[i + 2]].mean()
+        next_y = y[end : edges[i + 2]].mean()
+        area = np.abs(
+            (x[a] - next_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (next_y - y[a])
+        )
+        a = start + int(np.argmax(np.nan_to_num(area, nan=-1.0)))
+        kept[i + 1] = a
+    return x[kept], y[kept]
+
+
+def _peak_window(
+    q: np.ndarray, x_min: float, x_max: float, smoothing_window: Union[None, int]
+) -> slice:
+    """
+    Get the slice of q to read for a peak in [x_min, x_max].
+
+    With smoothing, half the (odd) filter window is added on both sides, so that the smoothed values inside [x_min,
+    x_max] are the same as when the whole spectrum is smoothed.
+    """
+    if not smoothing_window:
+        return get_q_window(q, x_min, x_max)
+    window = get_q_window(q, x_min, x_max, margin=smoothing_window // 2)
+    if window.stop - window.start < smoothing_window:
+        return slice(0, len(q))
+    return window
+
+
 def get_peak_height_time(
     dataset: "LoadData",
     x_min: float,
@@ -68,156 +545,420 @@ def get_peak_height_time(
     position: int,
     smoothing_window: Union[None, int] = None,
     n_pol: int = 2,
-) -> pd.DataFrame:
+    return_arrays: bool = False,
+    background: Any = None,
+) -> Union[pd.DataFrame, Tuple[np.ndarray, np.ndarray]]:
     """This function returns a maximum peak height in the speciifc area at the given position as a function of time
-    stamp."""
-    df_hight_time = pd.DataFrame(columns=["time", "peak height"])
-    raw_data = dataset.fl_raw
-    frame = dataset.height_group_frame
+    stamp.
+
+    The spectra of all scans are collected into one preallocated (scan x q) array, smoothed together with a single
+    Savitzky-Golay filter call and reduced to peak heights with find_peak_stats. If return_arrays is True, the time
+    stamps and peak heights are returned as two numpy arrays instead of a DataFrame. If background is given, the
+    background reference of that kind (see LoadData.get_background) is subtracted from every spectrum first.
+    """
+    from scipy.signal import savgol_filter
+
+    bg_rows = _background_rows(dataset, background, [position])
+    analysis = dataset.analysis
+    if analysis is not None:
+        time, peak_height = _analysis_peak_heights(
+            analysis, x_min, x_max, [position], smoothing_window, n_pol, bg_rows
+        )
+        peak_height = peak_height[:, 0]
+        if return_arrays:
+            return time, peak_height
+        return pd.DataFrame({"time": time, "peak height": peak_height})
+
+    frames = list(dataset.height_group_frame)
     integrated_data = dataset.fl_integrated
-    for n in frame:
-        time = get_scan_time(raw_data, scan_num=n)
-        intensity_data = get_data(
-            fl=integrated_data, dataset_path=f"{n}.1/p3_integrate/integrated/intensity"
-        )[position]
+    time = dataset.get_scan_times()
+    # Ensure the window size is odd
+    if smoothing_window and smoothing_window % 2 == 0:
+        smoothing_window += 1
+
+    # Only the q window of the peak (plus the margin needed by the smoothing filter) is read from the file
+    q = None
+    spectra = None
+    irregular = {}
+    for i, n in enumerate(frames):
+        q_n = get_data(
+            fl=integrated_data, dataset_path=f"{n}.1/p3_integrate/integrated/q"
+        )
+        if q is None:
+            q = q_n
+            window = _peak_window(q, x_min, x_max, smoothing_window)
+        intensity_path = f"{n}.1/p3_integrate/integrated/intensity"
+        if q_n.shape == q.shape and np.array_equal(q_n, q):
+            intensity_data = get_data(
+                fl=integrated_data,
+                dataset_path=intensity_path,
+                selection=(position, window),
+            )
+            if spectra is None:
+                dtype = np.result_type(intensity_data.dtype, np.float32)
+                spectra = np.full((len(frames), len(intensity_data)), np.nan, dtype)
+            spectra[i] = intensity_data
+        else:
+            # Scans with a different q axis are handled one by one
+            window_n = _peak_window(q_n, x_min, x_max, smoothing_window)
+            intensity_data = get_data(
+                fl=integrated_data,
+                dataset_path=intensity_path,
+                selection=(position, window_n),
+            )
+            if bg_rows is not None:
+                intensity_data = intensity_data - np.interp(
+                    q_n[window_n], bg_rows[0], bg_rows[1][0]
+                )
+            irregular[i] = (q_n[window_n], intensity_data)
+
+    peak_height = np.full(len(frames), np.nan)
+    if spectra is not None:
+        if bg_rows is not None:
+            spectra -= bg_rows[1][0, window]
+        # If smoothing is desired, apply the Savitzky-Golay filter to all scans at once
+        if smoothing_window:
+            regular = np.setdiff1d(np.arange(len(frames)), list(irregular))
+            with profiling.stage("smoothing"):
+                spectra[regular] = savgol_filter(
+                    spectra[regular], smoothing_window, n_pol, axis=-1
+                )
+            for i, (q_n, intensity_data) in irregular.items():
+                irregular[i] = (
+                    q_n,
+                    savgol_filter(intensity_data, smoothing_window, n_pol),
+                )
+        window_bounds = (x_min, x_max)
+        peak_height[:] = find_peak_stats(
+            q[window], spectra, window_bounds, stats=("max",)
+        )["max"]
+        for i, (q_n, intensity_data) in irregular.items():
+            peak_height[i] = find_peak_stats(
+                q_n, intensity_data, window_bounds, stats=("max",)
+            )["max"]
+
+    if return_arrays:
+        return time, peak_height
+    return pd.DataFrame({"time": time, "peak height": peak_height})
+
+
+def _background_rows(
+    dataset: "LoadData", background: Any, positions: List[int]
+) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """Return the q axis and the (position x q) background spectra of the given positions, or None without background."""
+    if background is None:
+        return None
+    q, spectra = dataset.get_background(background)
+    rows = np.full((len(positions), spectra.shape[1]), np.nan)
+    positions = np.asarray(positions)
+    exists = positions < len(spectra)
+    rows[exists] = spectra[positions[exists]]
+    return q, rows
+
+
+def _scan_peak_heights(
+    fl_integrated: str,
+    scan_num: int,
+    positions: List[int],
+    x_min: float,
+    x_max: float,
+    smoothing_window: Union[None, int],
+    n_pol: int,
+    bg_rows: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+) -> np.ndarray:
+    """
+    Read the spectra of one scan once and return the peak heights at the given positions (NaN if missing).
 
-        # If smoothing is desired, apply the Savitzky-Golay filter
+    bg_rows is the q axis and the background spectra of the positions (see _background_rows) to subtract.
+    """
+    from scipy.signal import savgol_filter
+
+    q = get_data(
+        fl=fl_integrated, dataset_path=f"{scan_num}.1/p3_integrate/integrated/q"
+    )
+    intensity_path = f"{scan_num}.1/p3_integrate/integrated/intensity"
+    n_positions = get_shape(fl=fl_integrated, dataset_path=intensity_path)[0]
+    positions = np.asarray(positions)
+    exists = positions < n_positions
+    present = positions[exists]
+
+    # Ensure the window size is odd
+    if smoothing_window and smoothing_window % 2 == 0:
+        smoothing_window += 1
+    # Only the block of the requested positions and the q window of the peak is read from the file
+    window = _peak_window(q, x_min, x_max, smoothing_window)
+    spectra = np.full((len(positions), len(q[window])), np.nan)
+    if len(present):
+        first = present.min()
+        block = get_data(
+            fl=fl_integrated,
+            dataset_path=intensity_path,
+            selection=(slice(first, present.max() + 1), window),
+        )
+        selected = block[present - first]
+        if bg_rows is not None:
+            q_bg, background = bg_rows[0], bg_rows[1][exists]
+            if q_bg.shape != q.shape or not np.array_equal(q_bg, q):
+                background = np.array([np.interp(q, q_bg, row) for row in background])
+            selected = selected - background[:, window]
         if smoothing_window:
-            # Ensure the window size is odd
-            if smoothing_window % 2 == 0:
-                smoothing_window += 1
-            intensity_data = savgol_filter(intensity_data, smoothing_window, n_pol)
-
-        peak_height = find_peak_height(
-            X=get_data(
-                fl=integrated_data, dataset_path=f"{n}.1/p3_integrate/integrated/q"
-            ),
-            Y=intensity_data,
-            x_min=x_min,
-            x_max=x_max,
+            with profiling.stage("smoothing"):
+                selected = savgol_filter(selected, smoothing_window, n_pol, axis=-1)
+        spectra = spectra.astype(selected.dtype)
+        spectra[exists] = selected
+    return find_peak_stats(q[window], spectra, (x_min, x_max), stats=("max",))["max"]
+
+
+def _analysis_peak_heights(
+    analysis: Tuple[str, str],
+    x_min: float,
+    x_max: float,
+    positions: List[int],
+    smoothing_window: Union[None, int],
+    n_pol: int,
+    bg_rows: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Get the start times and the (scan x position) peak heights of a height group from its analysis file.
+
+    All scans are read at once, and only the block of the requested positions and the q window of the peak. bg_rows is
+    the q axis and the background spectra of the positions (see _background_rows) to subtract.
+    """
+    from scipy.signal import savgol_filter
+
+    fl_analysis, group = analysis
+    q = get_data(fl=fl_analysis, dataset_path=f"{group}/q")
+    n_positions = get_shape(fl=fl_analysis, dataset_path=f"{group}/intensity")[1]
+    time = get_data(fl=fl_analysis, dataset_path=f"{group}/time")
+    positions = np.asarray(positions)
+    exists = positions < n_positions
+    present = positions[exists]
+
+    # Ensure the window size is odd
+    if smoothing_window and smoothing_window % 2 == 0:
+        smoothing_window += 1
+    window = _peak_window(q, x_min, x_max, smoothing_window)
+    peak_heights = np.full((len(time), len(positions)), np.nan)
+    if len(present):
+        first = present.min()
+        block = get_data(
+            fl=fl_analysis,
+            dataset_path=f"{group}/intensity",
+            selection=(slice(None), slice(first, present.max() + 1), window),
         )
-        df_hight_time.loc[len(df_hight_time)] = [time, peak_height]
+        spectra = block[:, present - first]
+        if bg_rows is not None:
+            spectra = spectra - bg_rows[1][exists][:, window]
+        if smoothing_window:
+            # Positions that do not exist in a scan are NaN and are left out of the filter
+            spectra = spectra.astype(np.float64)
+            finite = np.isfinite(spectra).all(axis=-1)
+            with profiling.stage("smoothing"):
+                spectra[finite] = savgol_filter(
+                    spectra[finite], smoothing_window, n_pol, axis=-1
+                )
+        peak_heights[:, exists] = find_peak_stats(
+            q[window], spectra, (x_min, x_max), stats=("max",)
+        )["max"]
+    return time, peak_heights
+
+
+def get_peak_height_time_multi(
+    dataset: "LoadData",
+    x_min: float,
+    x_max: float,
+    positions: List[int],
+    smoothing_window: Union[None, int] = None,
+    n_pol: int = 2,
+    n_workers: Optional[int] = None,
+    executor: str = "thread",
+    background: Any = None,
+) -> pd.DataFrame:
+    """
+    Get the maximum peak height in a q range at several positions as a function of time stamp, in a single pass.
 
-    return df_hight_time
+    The intensity of every scan is read once and the peak heights of all requested positions are taken from it, instead
+    of reading the whole height group once per position as repeated calls of get_peak_height_time do. If the dataset
+    has an analysis file (see the repack module), all scans are read from it at once instead.
+
+    Parameters:
+    dataset: dataset object of the associated experiment.
+    x_min (float): The minimum q value of the range to consider.
+    x_max (float): The maximum q value of the range to consider.
+    positions (list of int): The positions to extract.
+    smoothing_window (int, optional): Window length of the Savitzky-Golay filter applied to every spectrum.
+    n_pol (int): Polynomial order of the Savitzky-Golay filter.
+    n_workers (int, optional): Number of workers to spread the scans over. By default the scans are processed in the
+    calling thread.
+    executor (str): "thread" or "process", the kind of worker pool used if n_workers is given.
+    background (optional): A background reference (see LoadData.get_background) to subtract from every spectrum.
+
+    Returns:
+    pd.DataFrame: A "time" column followed by one column of peak heights per position, named by the position. A
+    position that does not exist in a scan gives NaN.
+    """
+    if executor not in ("thread", "process"):
+        raise ValueError(f"Unknown executor: {executor}")
+    positions = [int(pos) for pos in positions]
+    bg_rows = _background_rows(dataset, background, positions)
+    analysis = dataset.analysis
+    if analysis is not None:
+        time, peak_heights = _analysis_peak_heights(
+            analysis, x_min, x_max, positions, smoothing_window, n_pol, bg_rows
+        )
+        df_peak_time = pd.DataFrame(peak_heights, columns=positions)
+        df_peak_time.insert(0, "time", time)
+        return df_peak_time
+
+    frames = list(dataset.height_group_frame)
+    args = (positions, x_min, x_max, smoothing_window, n_pol, bg_rows)
+
+    if n_workers is None or n_workers <= 1:
+        rows = [_scan_peak_heights(dataset.fl_integrated, n, *args) for n in frames]
+    else:
+        pool_class = ThreadPoolExecutor if executor == "thread" else ProcessPoolExecutor
+        chunksize = 1
+        if executor == "process":
+            chunksize = max(1, len(frames) // (4 * n_workers))
+        with pool_class(max_workers=n_workers) as pool:
+            rows = list(
+                pool.map(
+                    _scan_peak_heights,
+                    [dataset.fl_integrated] * len(frames),
+                    frames,
+                    *[[arg] * len(frames) for arg in args],
+                    chunksize=chunksize,
+                )
+            )
+
+    peak_heights = np.array(rows).reshape(len(frames), len(positions))
+    df_peak_time = pd.DataFrame(peak_heights, columns=positions)
+    df_peak_time.insert(0, "time", dataset.get_scan_times())
+    return df_peak_time
 
 
 def get_scan_time(fl: str, scan_num: int) -> float:
     """Get the time stamp of the scan in utx."""
-    exp_timestamp = get_data(fl=fl, dataset_path=f"{scan_num}.1/start_time").decode(
-        "utf-8"
-    )
-    exp_timestamp_epoc = float(parse(exp_timestamp).timestamp())
-    return exp_timestamp_epoc
+    return float(get_scan_times(fl, [scan_num])[0])
+
+
+def get_scan_times(fl: str, scan_nums: Sequence[int]) -> np.ndarray:
+    """
+    Get the time stamps (epoch seconds) of several scans of a raw file at once.
+
+    The start times of all scans are read and parsed in one pass when the scan index of the file is built, and are
+    kept with the index until the file changes.
+    """
+    from . import metadata
+
+    return metadata.get_scan_index(fl).get("start_time", scan_nums)
 
 
 def get_fe(path_gc_excel: str) -> pd.DataFrame:
     """This function take the excel fe path (path)gc_excel) and return an array of a dataframe containing utx time stamp
-    and the Faradaic efficiency of different gas product."""
-    input_df = pd.read_excel(path_gc_excel)
+    and the Faradaic efficiency of different gas product.
 
-    # Helper function get_col
-    def get_col(input_df: pd.DataFrame, start_row: int = 2) -> List:
-        """
-        Extracts a column from input_df starting from start_row.
+    The file is parsed once and kept until it changes, and may also be a CSV or Parquet file, see faradaic.load_fe.
+    """
+    from . import faradaic
 
-        :param input_df: The dataframe to process.
-        :param start_row: The row index to start the extraction from.
-        :return: A list representing the extracted column.
-        """
-        trans_col = []
-        for idx in range(start_row, len(input_df)):
-            trans_col.append(input_df[idx])
-        return trans_col
-
-    for idx_col, col_name in enumerate(input_df.columns):
-        if col_name == "fe":
-            idx_fe = idx_col
-    for idx_col_findFeEnding in range(idx_fe + 1, len(input_df.columns)):
-        col_name = input_df.columns[idx_col_findFeEnding]
-        if col_name.split(":")[0] != "Unnamed":
-            fe_endRange = idx_col_findFeEnding
-            break
-    df_feGC = pd.DataFrame()
-    for idx_col_findChemicalName in range(idx_fe, fe_endRange):
-        col_name = input_df.iloc[0, idx_col_findChemicalName]
-        col_data = get_col(input_df.iloc[:, idx_col_findChemicalName])
-        df_feGC.insert(len(df_feGC.columns), col_name, col_data)
-    df_feGC.insert(len(df_feGC.columns), "Overall", df_feGC.sum(axis=1))
-    df_feGC.insert(0, "time", get_col(input_df["Unnamed: 0"]))
-
-    return df_feGC
+    return faradaic.load_fe(path_gc_excel)
 
 
 def export_spectrum(
-    data: "LoadData", scan_num: int, position: int, export_dir: Union[bool, str] = False
+    data: "LoadData",
+    scan_num: int,
+    position: int,
+    export_dir: Union[bool, str] = False,
+    x_min: Optional[float] = None,
+    x_max: Optional[float] = None,
 ) -> pd.DataFrame:
-    """This function print the q and count value of the spectrum of a specific scan number and position."""
+    """This function print the q and count value of the spectrum of a specific scan number and position.
+
+    If x_min or x_max is given, only the part of the spectrum with x_min <= q <= x_max is read; the index of the
+    returned DataFrame then still gives the q bin numbers of the full spectrum. If export_dir is a path, the spectrum is
+    written to it in the format of its extension (see the export module)."""
     from . import dataset
 
     q = get_data(
         fl=data.fl_integrated, dataset_path=f"{scan_num}.1/p3_integrate/integrated/q"
     )
+    window = get_q_window(q, x_min, x_max)
     count = get_data(
         fl=data.fl_integrated,
         dataset_path=f"{scan_num}.1/p3_integrate/integrated/intensity",
-    )[position]
-    df_export = pd.DataFrame({"q": q, "count": count})
+        selection=(position, window),
+    )
+    df_export = pd.DataFrame(
+        {"q": q[window], "count": count}, index=range(window.start, window.stop)
+    )
     if export_dir is not False:
-        df_export.to_excel(export_dir, index=False)
+        from . import export
+
+        export.write_table(df_export, export_dir)
     return df_export
 
 
-def twotheta2q(angle: float, wavelength: float = 1.5406) -> float:
+def twotheta2q(
+    angle: Union[float, np.ndarray], wavelength: Union[float, np.ndarray] = 1.5406
+) -> Union[float, np.ndarray]:
     """
     This function take the 2theta as in input and convert them to a respective q vector.
 
     Args:
-        angle (float): 2 Theta angle from an xray diffraction pattern.
-        wavelength (float, optional): wavelength of the xray source of the input spectrum. The default is set to 1.5406
-        which is the xray wavelength of an Cu k alpha.
+        angle (float or numpy array): 2 Theta angle from an xray diffraction pattern, or an array of angles.
+        wavelength (float or numpy array, optional): wavelength of the xray source of the input spectrum, or one
+        wavelength per angle. The default is set to 1.5406 which is the xray wavelength of an Cu k alpha.
 
     Returns:
-        float: converted q vector value.
+        float or numpy array: converted q vector value, an array if an array of angles is given.
     """
-    theta = math.radians(angle / 2)
-    q = (4 * math.pi * math.sin(theta)) / wavelength
+    q = 4 * np.pi * np.sin(np.radians(np.asarray(angle, dtype=float) / 2)) / wavelength
+    if np.ndim(q) == 0:
+        return float(q)
     return q
 
 
 def get_ref_xray(excel_xray_fl: str, threshold: int = 10) -> List[float]:
     """Exract the diffraction pattern with intensity higher than the set treshold from a standard diffraction
     pattern."""
-    df_xray = pd.read_excel(excel_xray_fl)
-    xray_array = []
-    for idx in range(0, len(df_xray)):
-        if df_xray["I [%]"][idx] >= threshold:
-            xray_array.append(twotheta2q(df_xray["2θ [°]"][idx]))
-    return xray_array
+    from .references import read_reference_file
+
+    two_theta, intensity = read_reference_file(excel_xray_fl)
+    return twotheta2q(two_theta[intensity >= threshold]).tolist()
 
 
 def load_xray_ref_folder(
-    xray_ref_folder: str, threshold: int = 10
+    xray_ref_folder: str,
+    threshold: int = 10,
+    wavelength: Optional[float] = None,
+    cache_dir: Optional[str] = None,
 ) -> List[List[float]]:
     """
     Load X-ray reference files from a specified folder and convert them into a list of X-ray patterns.
 
-    This function reads all files in the given folder path, converts the X-ray reference data in each file
-    into a list of X-ray patterns using the get_ref_xray function, and aggregates them into a list.
+    The files are read into the reference library of the folder (see references.get_reference_library), which is kept
+    for the lifetime of the process and, with cache_dir, stored in a single file, so calling this function again with
+    another threshold or wavelength does not read the files again.
 
     Args:
     xray_ref_folder (str): Path to the folder containing the X-ray reference files.
     threshold (int, optional): A cutoff intensity percentage; patterns with intensity below this threshold
     will be excluded. Defaults to 10.
+    wavelength (float, optional): The wavelength the 2θ angles of the references refer to. Defaults to 1.5406 (Cu k
+    alpha).
+    cache_dir (str, optional): A directory to store the reference library in.
 
     Returns:
     List[List[float]]: A list containing lists of X-ray patterns from each file.
     """
-    xray_ref_list = []
-    for file in sorted(os.listdir(xray_ref_folder)):
-        if file.endswith(".xlsx"):  # assuming the files are .xlsx, adjust if different
-            full_file_path = os.path.join(xray_ref_folder, file)
-            xray_ref_list.append(get_ref_xray(full_file_path, threshold=threshold))
-    return xray_ref_list
+    from .references import get_reference_library
+
+    library = get_reference_library(xray_ref_folder, cache_dir=cache_dir)
+    return [
+        pattern.tolist()
+        for pattern in library.patterns(threshold=threshold, wavelength=wavelength)
+    ]
 
 
 def get_height_diff(dataset: "LoadData") -> float:
@@ -230,11 +971,13 @@ def get_height_diff(dataset: "LoadData") -> float:
     Returns:
     float: Average height difference.
     """
-    arr_position = get_data(
-        fl=dataset.fl_raw,
-        dataset_path=f"{dataset.fl_start_macro}.1/instrument/positioners/{dataset.pos_scan_motor}",
-    )
-    pos_last = arr_position[-1]
-    post_first = arr_position[0]
-    diff = abs(pos_last - post_first) * 1000 / len(arr_position)
+    from . import metadata
+
+    index = metadata.get_scan_index(dataset.fl_raw)
+    scans = [dataset.fl_start_macro]
+    motor = dataset.pos_scan_motor
+    pos_last = index.get(f"{motor}.last", scans)[0]
+    post_first = index.get(f"{motor}.first", scans)[0]
+    n_position = index.get(f"{motor}.length", scans)[0]
+    diff = abs(pos_last - post_first) * 1000 / n_position
     return diff
@@ -0,0 +1,376 @@
+"""This module contains the twaxs command line interface for headless batch processing.
+
+    twaxs run experiment_info.xlsx output --x-min 1.9 --x-max 2.1 --positions 2 5 --gc "gc/exp{fl_num}.xlsx"
+    twaxs repack experiment_info.xlsx 1
+
+The run command fans the experiments of the experiment information sheet and their height groups out over a process
+pool and writes the heatmap, compare_peak_fe and vertical_compare tables and figures of every (experiment, height
+group) job into output/exp<fl_num>/height_group<g>. Every worker process is replaced after max_tasks_per_child jobs,
+which bounds the memory a long run can accumulate. A finished job leaves a done.json file with its options and timings;
+jobs with such a file and the same options are skipped when the command is run again, so an interrupted run resumes
+where it stopped. The record of every job is collected in output/summary.json.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+import pandas as pd
+from .export import FORMATS
+from .registry import get_registry
+
+DONE_FILE = "done.json"
+SUMMARY_FILE = "summary.json"
+
+
+@contextmanager
+def _timed(timings: Dict[str, float], name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = time.perf_counter() - start
+
+
+def _default_workers() -> int:
+    """The number of CPUs this process may run on, which can be fewer than os.cpu_count() on a cluster node."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def _job_dir(output: str, fl_num: int, height_group: int) -> str:
+    return os.path.join(output, f"exp{fl_num}", f"height_group{height_group}")
+
+
+def run_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Produce the heatmap, compare_peak_fe and vertical_compare outputs of one experiment and height group.
+
+    The job is a dictionary with the keys of the run command options (see make_jobs). compare_peak_fe is skipped if the
+    job has no GC file. The figures are rendered with the Agg backend.
+
+    Returns:
+    Dict[str, Any]: The record of the job, with its status, output directory and per-product timings in seconds.
+    """
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from . import auxiliary as aux
+    from . import plot
+    from .dataset import LoadData
+
+    job_dir = _job_dir(job["output"], job["fl_num"], job["height_group"])
+    record = {
+        "fl_num": job["fl_num"],
+        "height_group": job["height_group"],
+        "output": job_dir,
+        "job": job,
+        "pid": os.getpid(),
+        "timings": {},
+    }
+    timings = record["timings"]
+    start = time.perf_counter()
+    try:
+        os.makedirs(job_dir, exist_ok=True)
+        x_min, x_max = job["x_min"], job["x_max"]
+        with _timed(timings, "load"):
+            dataset = LoadData(
+                job["fl_num"],
+                job["height_group"],
+                job["data_info"],
+                cache_dir=job["cache_dir"],
+            )
+            frames = list(dataset.height_group_frame)
+
+        with _timed(timings, "heatmap"):
+            plot.heatmap(
+                dataset,
+                x_min,
+                x_max,
+                export_data=os.path.join(job_dir, f"heatmap.{job['table_format']}"),
+                display_rxn_time=True,
+                export_fig=os.path.join(job_dir, "heatmap.png"),
+            )
+            plt.close("all")
+
+        if job["gc"]:
+            with _timed(timings, "compare_peak_fe"):
+                plot.compare_peak_fe(
+                    dataset,
+                    x_min,
+                    x_max,
+                    job["positions"],
+                    job["gc"],
+                    smoothing_window=job["smoothing_window"],
+                    export_table=os.path.join(
+                        job_dir, f"compare_peak_fe.{job['table_format']}"
+                    ),
+                )
+                plt.savefig(os.path.join(job_dir, "compare_peak_fe.png"))
+                plt.close("all")
+
+        with _timed(timings, "vertical_compare"):
+            scans = job["scans"] or frames
+            plot.vertical_compare(
+                dataset,
+                x_min,
+                x_max,
+                scans,
+                export_table=os.path.join(
+                    job_dir, f"vertical_compare.{job['table_format']}"
+                ),
+            )
+            plt.savefig(os.path.join(job_dir, "vertical_compare.png"))
+            plt.close("all")
+        record["status"] = "done"
+    except Exception:
+        record["status"] = "failed"
+        record["error"] = traceback.format_exc()
+    finally:
+        plt.close("all")
+        # Release the hdf5 handles of this job, the worker may run other experiments next
+        aux.close_files()
+    record["wall_time_s"] = time.perf_counter() - start
+
+    if record["status"] == "done":
+        with open(os.path.join(job_dir, DONE_FILE), "w") as f:
+            json.dump(record, f, indent=2)
+    return record
+
+
+def _count_height_groups(fl_num: int, data_info: str, cache_dir: Optional[str]) -> int:
+    from .dataset import LoadData, group_heights
+
+    dataset = LoadData(fl_num, 0, data_info, cache_dir=cache_dir)
+    height_array = dataset.get_height_array(
+        dataset.fl_start_macro, dataset.fl_end_macro
+    )
+    return len(group_heights(height_array))
+
+
+def make_jobs(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """Build the job list of the run command: one job per experiment number and height group."""
+    experiments = get_registry(args.data_info)
+    fl_nums = args.experiments
+    if fl_nums is None:
+        fl_nums = experiments.numbers
+
+    jobs = []
+    for fl_num in fl_nums:
+        gc = None
+        if "GC file directory" in experiments.columns:
+            gc = experiments.get(fl_num)["GC file directory"]
+            gc = None if pd.isna(gc) else str(gc)
+        if gc is None and args.gc:
+            gc = args.gc.format(fl_num=fl_num)
+        height_groups = args.height_groups
+        if height_groups is None:
+            height_groups = range(
+                _count_height_groups(fl_num, args.data_info, args.cache_dir)
+            )
+        for height_group in height_groups:
+            jobs.append(
+                {
+                    "fl_num": fl_num,
+                    "height_group": int(height_group),
+                    "data_info": os.path.abspath(args.data_info),
+                    "output": os.path.abspath(args.output),
+                    "cache_dir": args.cache_dir,
+                    "x_min": args.x_min,
+                    "x_max": args.x_max,
+                    "positions": args.positions,
+                    "smoothing_window": args.smoothing_window,
+                    "scans": args.scans,
+                    "gc": gc,
+                    "table_format": args.table_format,
+                }
+            )
+    return jobs
+
+
+def run(args: argparse.Namespace) -> int:
+    """Run the jobs of the run command and write the summary. Returns the number of failed jobs."""
+    # Inherited by the worker processes, which never open a window
+    os.environ.setdefault("MPLBACKEND", "Agg")
+    start = time.perf_counter()
+    jobs = make_jobs(args)
+    records = []
+    pending = []
+    for job in jobs:
+        done_path = os.path.join(
+            _job_dir(job["output"], job["fl_num"], job["height_group"]), DONE_FILE
+        )
+        record = None
+        if not args.force and os.path.exists(done_path):
+            with open(done_path) as f:
+                record = json.load(f)
+        # A job that was done with other options is run again
+        if record is not None and record.get("job") == job:
+            record["status"] = "skipped"
+            records.append(record)
+        else:
+            pending.append(job)
+
+    def report(record: Dict[str, Any]) -> None:
+        records.append(record)
+        print(
+            f"[{len(records)}/{len(jobs)}] exp {record['fl_num']} height group "
+            f"{record['height_group']}: {record['status']} ({record['wall_time_s']:.1f} s)",
+            file=sys.stderr,
+        )
+        if record["status"] == "failed":
+            print(record["error"], file=sys.stderr)
+
+    if args.workers <= 1:
+        for job in pending:
+            report(run_job(job))
+    elif sys.version_info >= (3, 11):
+        with ProcessPoolExecutor(
+            max_workers=args.workers, max_tasks_per_child=args.max_tasks_per_child
+        ) as pool:
+            futures = [pool.submit(run_job, job) for job in pending]
+            for future in as_completed(futures):
+                report(future.result())
+    else:
+        # ProcessPoolExecutor replaces its workers only from Python 3.11 on, and then starts them with spawn too
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(
+            args.workers, maxtasksperchild=args.max_tasks_per_child
+        ) as pool:
+            for record in pool.imap_unordered(run_job, pending):
+                report(record)
+
+    records.sort(key=lambda record: (record["fl_num"], record["height_group"]))
+    failed = sum(record["status"] == "failed" for record in records)
+    summary = {
+        "wall_time_s": time.perf_counter() - start,
+        "jobs": len(records),
+        "done": sum(record["status"] == "done" for record in records),
+        "skipped": sum(record["status"] == "skipped" for record in records),
+        "failed": failed,
+        "records": records,
+    }
+    os.makedirs(args.output, exist_ok=True)
+    with open(os.path.join(args.output, SUMMARY_FILE), "w") as f:
+        json.dump(summary, f, indent=2)
+    return failed
+
+
+def repack(args: argparse.Namespace) -> int:
+    from .dataset import LoadData
+    from .repack import repack_experiment
+
+    dataset = LoadData(args.fl_num, 0, args.data_info, cache_dir=args.cache_dir)
+    path = repack_experiment(
+        dataset,
+        fl_analysis=args.output,
+        compression=None if args.compression == "none" else args.compression,
+        chunk_scans=args.chunk_scans,
+        chunk_q=args.chunk_q,
+    )
+    print(path)
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="twaxs", description="Headless processing of T-WAXS experiments."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser(
+        "run",
+        help="Write the heatmap, compare_peak_fe and vertical_compare outputs of many experiments.",
+    )
+    run_parser.add_argument(
+        "data_info", help="The experiment information sheet (Excel, CSV or Parquet)."
+    )
+    run_parser.add_argument("output", help="The output directory.")
+    run_parser.add_argument("--x-min", type=float, required=True)
+    run_parser.add_argument("--x-max", type=float, required=True)
+    run_parser.add_argument(
+        "--experiments",
+        type=int,
+        nargs="+",
+        help="Experimental numbers to process (default: all in the sheet).",
+    )
+    run_parser.add_argument(
+        "--height-groups",
+        type=int,
+        nargs="+",
+        help="Height groups to process (default: all of every experiment).",
+    )
+    run_parser.add_argument(
+        "--positions",
+        type=int,
+        nargs=2,
+        default=[0, 0],
+        help="First and last position averaged by compare_peak_fe.",
+    )
+    run_parser.add_argument("--smoothing-window", type=int)
+    run_parser.add_argument(
+        "--scans",
+        type=int,
+        nargs="+",
+        help="Scans averaged by vertical_compare (default: all scans of the height group).",
+    )
+    run_parser.add_argument(
+        "--gc",
+        help='GC file of the experiments whose sheet row has no "GC file directory", '
+        "with {fl_num} replaced by the experimental number. compare_peak_fe is skipped without one.",
+    )
+    run_parser.add_argument(
+        "--table-format",
+        default="xlsx",
+        choices=sorted(suffix[1:] for suffix in FORMATS),
+        help="Format of the exported tables (default: xlsx).",
+    )
+    run_parser.add_argument("--cache-dir", help="Directory for the scan index cache.")
+    run_parser.add_argument("--workers", type=int, default=_default_workers())
+    run_parser.add_argument(
+        "--max-tasks-per-child",
+        type=int,
+        default=1,
+        help="Jobs run by a worker process before it is replaced.",
+    )
+    run_parser.add_argument(
+        "--force", action="store_true", help="Rerun jobs that are already done."
+    )
+    run_parser.set_defaults(func=run)
+
+    repack_parser = commands.add_parser(
+        "repack", help="Consolidate an experiment into a single analysis hdf5 file."
+    )
+    repack_parser.add_argument(
+        "data_info", help="The experiment information sheet (Excel, CSV or Parquet)."
+    )
+    repack_parser.add_argument("fl_num", type=int, help="The experimental number.")
+    repack_parser.add_argument("-o", "--output", help="The path of the analysis file.")
+    repack_parser.add_argument(
+        "--compression", default="auto", choices=["auto", "blosc", "gzip", "none"]
+    )
+    repack_parser.add_argument("--chunk-scans", type=int, default=16)
+    repack_parser.add_argument("--chunk-q", type=int, default=256)
+    repack_parser.add_argument(
+        "--cache-dir", help="Directory for the scan index cache."
+    )
+    repack_parser.set_defaults(func=repack)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = build_parser().parse_args(argv)
+    sys.exit(1 if args.func(args) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,15 +5,27 @@ Cerntain information specific to experimental files obtaining from a beamtime du
 incoperated here for smooth parsing of the raw data. For other set of experiment, please adjust these conditions
 acordingly.
 """
+
 import pandas as pd
-import h5py
 import numpy as np
+import os
+import asyncio
+import weakref
+import warnings
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, Any, List, Tuple, Optional
-import plotly.graph_objects as go
-from IPython.display import display, clear_output
-from ipywidgets import interactive, SelectionSlider, IntSlider, Checkbox
+from typing import TYPE_CHECKING, Dict, Any, List, Tuple, Optional, Union
 from . import auxiliary as aux
+from . import metadata
+from . import profiling
+from . import repack
+from .heatmap import HeatmapData
+from .registry import ExperimentRegistry, get_registry
+
+if TYPE_CHECKING:
+    from .references import ReferenceLibrary
 
 
 class LoadData:
@@ -24,10 +36,27 @@ class LoadData:
     This class also includes a show_spectrum class function, allowing users to quickly visualize the spectrum.
     """
 
-    def __init__(self, fl_num: int, height_group: int, data_info: Optional[str] = None):
+    def __init__(
+        self,
+        fl_num: int,
+        height_group: int,
+        data_info: Union[None, str, ExperimentRegistry] = None,
+        cache_dir: Optional[str] = None,
+        analysis_file: Optional[str] = None,
+    ):
         self.fl_num = fl_num
         self._height_group = height_group
         self.data_info = data_info
+        self.cache_dir = cache_dir
+        self.analysis_file = analysis_file
+        self._height_array = None
+        self._height_group_frame = None
+        self._intensity_cube = None
+        self._scan_times = None
+        self._q_maps = ([], {})
+        self._peak_fits = ([], {})
+        self._backgrounds = ([], {})
+        self._spectrum_cache = None
         (
             self._fl_integrated,
             self._fl_raw,
@@ -51,35 +80,33 @@ class LoadData:
         """
         Retrieves file details based on the experimental number.
 
-        If data_info is provided, it fetches details from the Excel file, otherwise, it uses the provided input values.
+        If data_info is provided, it fetches details from the experiment sheet, otherwise, it uses the provided input
+        values. data_info is either the path of the sheet (Excel, or CSV/Parquet with the same columns), which is parsed
+        once per process (see the registry module), or an ExperimentRegistry shared by several LoadData objects.
         """
-        if self.data_info:
-            try:
-                df_exp_info = pd.read_excel(self.data_info)
-            except FileNotFoundError:
-                raise Exception(f"Excel file not found: {self.data_info}")
+        if isinstance(self.data_info, ExperimentRegistry) or self.data_info:
+            if isinstance(self.data_info, ExperimentRegistry):
+                experiments = self.data_info
+            else:
+                try:
+                    experiments = get_registry(self.data_info)
+                except FileNotFoundError:
+                    raise Exception(f"Excel file not found: {self.data_info}")
 
-            data_row = df_exp_info[df_exp_info["Experimental number"] == self.fl_num]
-
-            if data_row.empty:
-                raise ValueError(
-                    f"Experimental number {self.fl_num} not found in the data."
-                )
+            data_row = experiments.get(self.fl_num)
 
-            fl_integrated_path = Path(
-                data_row["Integrated file directory"].values[0]
-            ).resolve()
-            fl_raw_path = Path(data_row["Raw file directory"].values[0]).resolve()
+            fl_integrated_path = Path(data_row["Integrated file directory"]).resolve()
+            fl_raw_path = Path(data_row["Raw file directory"]).resolve()
 
-            fl_start_macro = data_row["Macro start number"].values[0]
+            fl_start_macro = data_row["Macro start number"]
             fl_end_macro = (
-                data_row["Macro end number (optional)"].values[0]
-                if not pd.isna(data_row["Macro end number (optional)"].values[0])
+                data_row["Macro end number (optional)"]
+                if not pd.isna(data_row["Macro end number (optional)"])
                 else None
             )
-            condition = data_row["Condition name"].values[0]
-            pos_scan_motor = data_row["Position scanning motor"].values[0]
-            h_group_motor = data_row["Height group motor"].values[0]
+            condition = data_row["Condition name"]
+            pos_scan_motor = data_row["Position scanning motor"]
+            h_group_motor = data_row["Height group motor"]
         else:
             fl_integrated_path = (
                 Path(input_fl_integrated).resolve() if input_fl_integrated else None
@@ -143,34 +170,727 @@ class LoadData:
     def h_group_motor(self) -> str:
         return self._h_group_motor
 
+    @property
+    def scan_index(self) -> metadata.ScanIndex:
+        """The metadata index of the raw file, persisted in cache_dir if one is set."""
+        return metadata.get_scan_index(self._fl_raw, cache_dir=self.cache_dir)
+
+    @property
+    def analysis(self) -> Optional[Tuple[str, str]]:
+        """
+        The path and group of the height group in the analysis file of the experiment (see the repack module), or
+        None if there is no analysis file or it no longer matches the raw and integrated files.
+
+        The analysis file is analysis_file if it was given, otherwise the one at repack.analysis_path. When it is
+        usable, the scan list, time stamps and spectra of the height group are read from it instead of from the raw and
+        integrated files.
+        """
+        fl_analysis = self.analysis_file or repack.analysis_path(
+            self.fl_integrated, self.fl_num
+        )
+        group = repack.find_analysis_group(fl_analysis, self)
+        if group is None:
+            return None
+        return fl_analysis, group
+
     def get_max_frame_index(self) -> int:
-        with h5py.File(self.fl_raw, "r") as f:
-            keys = list(f.keys())
-            frame_indices = [int(key.split(".")[0]) for key in keys if "." in key]
-            return max(frame_indices)
+        return self.scan_index.max_scan()
 
     def get_height_array(self, start: int, num_end: int) -> Dict[int, Any]:
+        index = self.scan_index
         if pd.isna(num_end):
-            end = self.get_max_frame_index()
+            end = index.max_scan()
         else:
             end = int(num_end)
-        dict_height = {}
-        for scan_num in range(start, end + 1):
-            height = aux.get_data(
-                fl=self._fl_raw,
-                dataset_path=f"{scan_num}.1/instrument/positioners/{self.h_group_motor}",
-            )
-            dict_height[scan_num] = height
-        return dict_height
+        scans = np.arange(start, end + 1)
+        heights = index.get(self.h_group_motor, scans)
+        return dict(zip(scans.tolist(), heights.tolist()))
 
     @property
     def height_group_frame(self) -> Dict[int, Any]:
-        height_array = self.get_height_array(self._fl_start_macro, self._fl_end_macro)
-        grouped_height_array = group_heights(height_array)
-        self._height_group_frame = grouped_height_array[self.height_group]
+        if self._height_group_frame is None:
+            analysis = self.analysis
+            if analysis is not None:
+                fl_analysis, group = analysis
+                self._height_group_frame = aux.get_data(
+                    fl_analysis, f"{group}/scan"
+                ).tolist()
+                return self._height_group_frame
+            if self._height_array is None:
+                self._height_array = self.get_height_array(
+                    self._fl_start_macro, self._fl_end_macro
+                )
+            grouped_height_array = group_heights(self._height_array)
+            self._height_group_frame = grouped_height_array[self.height_group]
         return self._height_group_frame
 
-    def show_spectrum(self, xref_list: Optional[List] = None):
+    def invalidate_cache(self) -> None:
+        """
+        Drop the motor heights, height grouping and intensity cube cached on this object.
+
+        The next access re-reads them from the scan index and the integrated file. The scan index and the entries in
+        cache_dir are keyed by the modification time of the files, so they do not need to be removed when the files
+        change.
+        """
+        self._height_array = None
+        self._height_group_frame = None
+        self._intensity_cube = None
+        self._scan_times = None
+        self._q_maps = ([], {})
+        self._peak_fits = ([], {})
+        self._backgrounds = ([], {})
+
+    def get_scan_times(self) -> np.ndarray:
+        """Get the start time (epoch seconds) of every scan of the height group."""
+        frames = list(self.height_group_frame)
+        if self._scan_times is not None and self._scan_times[0] == frames:
+            return self._scan_times[1]
+        analysis = self.analysis
+        if analysis is not None:
+            fl_analysis, group = analysis
+            times = aux.get_data(fl_analysis, f"{group}/time")
+        else:
+            times = self.scan_index.get("start_time", frames)
+        self._scan_times = (frames, times)
+        return times
+
+    def _integrated_scans(self, scans: List[int]) -> List[int]:
+        """Return the leading scans of the list whose integrated spectra are already in the integrated file."""
+        ready = []
+        with aux.get_file_pool().file(self.fl_integrated) as f:
+            for n in scans:
+                if f"{n}.1/p3_integrate/integrated/intensity" not in f:
+                    break
+                ready.append(n)
+        return ready
+
+    def refresh(self) -> List[int]:
+        """
+        Pick up the scans appended to the raw and integrated files since the last access (follow mode).
+
+        This is meant for files that are still being written during a beamtime. Only the scans that are new since the
+        previous call are read: their metadata is added to the scan index, their heights are grouped and, if the
+        intensity cube has been built, their spectra are appended to it. Scans that are in the raw file but not yet in
+        the integrated file are left for a later call. If a new motor height changes the grouping of the scans seen
+        before, the cached intensity cube is dropped and rebuilt on the next access.
+
+        Returns:
+        List[int]: The scan numbers added to the height group of this object, in order.
+        """
+        old_frames = self._height_group_frame or []
+        known = self._height_array or {}
+        index = metadata.get_scan_index(
+            self._fl_raw, cache_dir=self.cache_dir, incremental=True
+        )
+        if pd.isna(self._fl_end_macro):
+            end = index.max_scan()
+        else:
+            end = int(self._fl_end_macro)
+        last = max(known) if known else int(self._fl_start_macro) - 1
+        scans = index.scans
+        candidates = scans[np.searchsorted(scans, last, side="right") :]
+        candidates = candidates[candidates <= end].tolist()
+        ready = self._integrated_scans(candidates)
+        if not ready and self._height_group_frame is not None:
+            return []
+
+        height_array = dict(known)
+        height_array.update(zip(ready, index.get(self.h_group_motor, ready).tolist()))
+        # Early in a run not every height group has been measured yet
+        groups = group_heights(height_array) if height_array else []
+        frames = groups[self.height_group] if self.height_group < len(groups) else []
+        self._height_array = height_array
+        self._height_group_frame = frames
+
+        # The background-subtracted cubes and the peak fits do not cover the new scans
+        self._backgrounds = ([], {})
+        self._peak_fits = ([], {})
+        if frames[: len(old_frames)] != old_frames:
+            self._intensity_cube = None
+            return list(frames)
+        new_frames = frames[len(old_frames) :]
+        if new_frames and self._intensity_cube is not None:
+            _, q, cube = self._intensity_cube
+            if not isinstance(cube, aux.AppendableArray):
+                cube = aux.AppendableArray(cube)
+            cube.append(self._read_intensity_cube(new_frames, q=q)[1])
+            self._intensity_cube = (list(frames), q, cube)
+        return new_frames
+
+    def _cube_cache_paths(self, frames: List[int]) -> Tuple[Path, Path]:
+        """Return the on-disk cache paths of the q axis and the intensity cube for the given frames."""
+        key_parts = (self.fl_num, self.height_group, [int(n) for n in frames])
+        return (
+            aux.cache_path(self.cache_dir, self.fl_integrated, ".q.npy", *key_parts),
+            aux.cache_path(self.cache_dir, self.fl_integrated, ".cube.npy", *key_parts),
+        )
+
+    @profiling.timed("intensity_cube.read")
+    def _read_intensity_cube(
+        self,
+        frames: List[int],
+        cube_path: Optional[Path] = None,
+        q: Optional[np.ndarray] = None,
+        window: slice = slice(None),
+        positions: slice = slice(None),
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Read the integrated spectra of the given frames into a (scan x position x q) array in a single pass.
+
+        Scans with fewer positions than the largest scan are padded with NaN. Spectra are interpolated onto the q axis
+        q if it is given, or onto the one of the first scan if it differs. Only the given positions and q window of the
+        spectra are read from the scans that share this q axis, and the returned cube covers q[window]. If cube_path is
+        given, the cube is written directly into a .npy file at that path instead of being held in memory.
+        """
+        with aux.get_file_pool().file(self.fl_integrated) as f:
+            shapes = [
+                f[f"{n}.1/p3_integrate/integrated/intensity"].shape for n in frames
+            ]
+            dtype = np.result_type(
+                f[f"{frames[0]}.1/p3_integrate/integrated/intensity"].dtype,
+                np.float32,
+            )
+            if q is None:
+                q = f[f"{frames[0]}.1/p3_integrate/integrated/q"][()]
+            q_window = q[window]
+            n_positions = max(len(range(*positions.indices(s[0]))) for s in shapes)
+            shape = (len(frames), n_positions, len(q_window))
+            if cube_path is None:
+                cube = np.full(shape, np.nan, dtype=dtype)
+            else:
+                cube = np.lib.format.open_memmap(
+                    cube_path, mode="w+", dtype=dtype, shape=shape
+                )
+                cube[...] = np.nan
+            for i, n in enumerate(frames):
+                q_n = f[f"{n}.1/p3_integrate/integrated/q"][()]
+                same_q = q_n.shape == q.shape and np.array_equal(q_n, q)
+                intensity = f[f"{n}.1/p3_integrate/integrated/intensity"][
+                    (positions, window) if same_q else positions
+                ]
+                profiling.record_read(
+                    f"{n}.1/p3_integrate/integrated/intensity", intensity.nbytes
+                )
+                profiling.record_read(f"{n}.1/p3_integrate/integrated/q", q_n.nbytes)
+                if not same_q:
+                    intensity = np.array(
+                        [np.interp(q_window, q_n, row) for row in intensity],
+                        dtype=dtype,
+                    )
+                cube[i, : len(intensity)] = intensity
+        if cube_path is not None:
+            cube.flush()
+        return q, cube
+
+    def _background_frames(self, reference: Any) -> List[int]:
+        """Return the scans of the height group that make up a background reference (see get_background)."""
+        frames = list(self.height_group_frame)
+        if isinstance(reference, str) and reference == "first":
+            return frames[:1]
+        if isinstance(reference, (int, np.integer)):
+            if reference < 1:
+                raise ValueError("The number of background scans must be positive.")
+            return frames[:reference]
+        if isinstance(reference, (tuple, list)) and len(reference) == 2:
+            first, last = reference
+            selected = [n for n in frames if first <= n <= last]
+            if not selected:
+                raise ValueError(
+                    f"No scan of height group {self.height_group} in the background range {reference}."
+                )
+            return selected
+        raise ValueError(f"Unknown background reference: {reference}")
+
+    def get_background(self, reference: Any = "first") -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Get a background reference of the height group: the mean spectrum of a set of scans for every position.
+
+        The reference is computed once and kept on the object. Only the reference scans are read, unless the intensity
+        cube is already in memory.
+
+        Parameters:
+        reference: "first" for the first scan of the height group, an integer K for the mean of the first K scans, or
+        a (first, last) pair of scan numbers for the mean of the scans of the height group in that range.
+
+        Returns:
+        Tuple[np.ndarray, np.ndarray]: The q axis of the intensity cube and the (position x q) background. Positions
+        that do not exist in any reference scan are NaN.
+        """
+        frames = list(self.height_group_frame)
+        key = tuple(reference) if isinstance(reference, list) else reference
+        if self._backgrounds[0] != frames:
+            self._backgrounds = (frames, {})
+        if key in self._backgrounds[1]:
+            return self._backgrounds[1][key]
+
+        background_frames = self._background_frames(reference)
+        rows = [frames.index(n) for n in background_frames]
+        analysis = self.analysis
+        if self._intensity_cube is not None and self._intensity_cube[0] == frames:
+            q, cube = self.get_intensity_cube()
+            block = cube[rows]
+        elif analysis is not None:
+            fl_analysis, group = analysis
+            q = aux.get_data(fl_analysis, f"{group}/q")
+            block = aux.get_data(
+                fl_analysis, f"{group}/intensity", selection=np.array(rows)
+            )
+        else:
+            q = aux.get_data(
+                self.fl_integrated, f"{frames[0]}.1/p3_integrate/integrated/q"
+            )
+            _, block = self._read_intensity_cube(background_frames, q=q)
+        with warnings.catch_warnings():
+            # Positions that do not exist in any reference scan give empty means
+            warnings.simplefilter("ignore", RuntimeWarning)
+            background = np.nanmean(block, axis=0)
+
+        self._backgrounds[1][key] = (q, background)
+        return q, background
+
+    def _subtract_background(
+        self, cube: np.ndarray, reference: Any, window: slice = slice(None)
+    ) -> np.ndarray:
+        """Subtract a background reference from a (scan x position x q) cube, or from its q window."""
+        _, background = self.get_background(reference)
+        background = background[: cube.shape[1], window]
+        subtracted = cube.astype(np.result_type(cube.dtype, background.dtype))
+        subtracted[:, : len(background)] -= background
+        return subtracted
+
+    def get_intensity_cube(
+        self, mmap: bool = False, background: Any = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Get the q axis and the (scan x position x q) intensity cube of the height group.
+
+        The cube is read from the analysis file if there is one (see the analysis property), otherwise from the
+        integrated file, once and kept on the object. If the object was created with a cache_dir and has no analysis
+        file, the cube is also stored there as .npy files keyed by the modification time of the integrated file, so
+        that it is reused by later sessions as long as the file does not change.
+
+        Parameters:
+        mmap (bool): If True, the cube is memory-mapped from the cache file instead of being loaded into memory. This
+        requires a cache_dir, and is ignored when the cube is read from the analysis file.
+        background (optional): A background reference (see get_background) to subtract from every scan. The
+        subtracted cube is kept on the object next to the cube itself.
+
+        Returns:
+        Tuple[np.ndarray, np.ndarray]: The q axis and the intensity cube. Positions that do not exist in a scan are
+        NaN.
+        """
+        if background is not None:
+            q, cube = self.get_intensity_cube(mmap=mmap)
+            frames = list(self.height_group_frame)
+            if self._backgrounds[0] != frames:
+                self._backgrounds = (frames, {})
+            key = (
+                "subtracted",
+                tuple(background) if isinstance(background, list) else background,
+            )
+            if key not in self._backgrounds[1]:
+                self._backgrounds[1][key] = self._subtract_background(cube, background)
+            return q, self._backgrounds[1][key]
+
+        frames = list(self.height_group_frame)
+        if self._intensity_cube is not None and self._intensity_cube[0] == frames:
+            _, q, cube = self._intensity_cube
+            if isinstance(cube, aux.AppendableArray):
+                cube = cube.view
+            return q, cube
+        if mmap and self.cache_dir is None:
+            raise ValueError(
+                "A cache_dir is required for a memory-mapped intensity cube."
+            )
+
+        analysis = self.analysis
+        if analysis is not None:
+            fl_analysis, group = analysis
+            q = aux.get_data(fl_analysis, f"{group}/q")
+            cube = aux.get_data(fl_analysis, f"{group}/intensity")
+        elif self.cache_dir is None:
+            q, cube = self._read_intensity_cube(frames)
+        else:
+            q_path, cube_path = self._cube_cache_paths(frames)
+            if not (q_path.exists() and cube_path.exists()):
+                os.makedirs(self.cache_dir, exist_ok=True)
+                tmp_path = cube_path.with_name(
+                    f"{cube_path.stem}.{os.getpid()}.tmp.npy"
+                )
+                q, cube = self._read_intensity_cube(frames, cube_path=tmp_path)
+                del cube
+                np.save(q_path, q)
+                os.replace(tmp_path, cube_path)
+            q = np.load(q_path)
+            cube = np.load(cube_path, mmap_mode="r" if mmap else None)
+
+        self._intensity_cube = (frames, q, cube)
+        return q, cube
+
+    def get_window_cube(
+        self, min_range: float, max_range: float, background: Any = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Get the part of the intensity cube within a q range.
+
+        With an analysis file, only the q window is read from it unless the cube is already in memory. Otherwise the
+        cube is built once (see get_intensity_cube), memory-mapped from its cache file if the object was created with a
+        cache_dir, and every window is taken from it, so that re-plotting another q range does not read the integrated
+        file again.
+
+        Parameters:
+        min_range (float): Minimum q value of the range (inclusive).
+        max_range (float): Maximum q value of the range (inclusive).
+        background (optional): A background reference (see get_background) to subtract from the spectra.
+
+        Returns:
+        Tuple[np.ndarray, np.ndarray]: The q values within the range and the (scan x position x q) cube.
+        """
+        frames = list(self.height_group_frame)
+        in_memory = (
+            self._intensity_cube is not None and self._intensity_cube[0] == frames
+        )
+        analysis = self.analysis
+        if not in_memory and analysis is not None:
+            fl_analysis, group = analysis
+            q = aux.get_data(fl_analysis, f"{group}/q")
+            window = aux.get_q_window(q, min_range, max_range)
+            cube = aux.get_data(
+                fl_analysis, f"{group}/intensity", selection=np.s_[:, :, window]
+            )
+        else:
+            q, cube = self.get_intensity_cube(mmap=self.cache_dir is not None)
+            window = aux.get_q_window(q, min_range, max_range)
+            # Only the window of a memory-mapped cube is read from the cache file
+            cube = np.asarray(cube[:, :, window])
+        if background is not None:
+            cube = self._subtract_background(cube, background, window)
+        return q[window], cube
+
+    def peak_height_map(
+        self, min_range: float, max_range: float, background: Any = None
+    ) -> np.ndarray:
+        """
+        Get the maximum peak height within a q range for every scan and position of the height group.
+
+        Parameters:
+        min_range (float): Minimum q value of the range.
+        max_range (float): Maximum q value of the range.
+        background (optional): A background reference (see get_background) to subtract from the spectra first.
+
+        Returns:
+        np.ndarray: A (scan x position) array of peak heights. Positions that do not exist in a scan, or any cell if
+        the q range contains no data point, are NaN.
+        """
+        q, cube = self.get_window_cube(min_range, max_range, background=background)
+        stats = aux.find_peak_stats(q, cube, (min_range, max_range), stats=("max",))
+        return stats["max"]
+
+    def get_peak_fits(
+        self,
+        min_range: float,
+        max_range: float,
+        model: str = "pseudo_voigt",
+        positions: Optional[List[int]] = None,
+        background: Any = None,
+        n_workers: Optional[int] = None,
+    ) -> Dict[str, np.ndarray]:
+        """
+        Fit a single peak with a linear background in a q range for every scan and position of the height group.
+
+        The fits are computed with fitting.fit_peaks, kept on the object and, if the object was created with a
+        cache_dir, stored there keyed by the modification time of the source file.
+
+        Parameters:
+        min_range (float): Minimum q value of the range.
+        max_range (float): Maximum q value of the range.
+        model (str): "gaussian", "lorentzian" or "pseudo_voigt".
+        positions (list of int, optional): The positions to fit. All positions by default.
+        background (optional): A background reference (see get_background) to subtract from the spectra first.
+        n_workers (int, optional): Number of processes to spread the positions over.
+
+        Returns:
+        Dict[str, np.ndarray]: (scan x position) arrays of the fitted parameters and derived values, see
+        fitting.fit_peaks.
+        """
+        from . import fitting
+
+        frames = list(self.height_group_frame)
+        key = (
+            "fit",
+            min_range,
+            max_range,
+            model,
+            None if positions is None else tuple(positions),
+            tuple(background) if isinstance(background, list) else background,
+        )
+        if self._peak_fits[0] != frames:
+            self._peak_fits = (frames, {})
+        if key in self._peak_fits[1]:
+            return self._peak_fits[1][key]
+
+        fit_path = None
+        if self.cache_dir is not None:
+            analysis = self.analysis
+            source = analysis[0] if analysis is not None else self.fl_integrated
+            fit_path = aux.cache_path(self.cache_dir, source, ".fit.npz", frames, *key)
+        if fit_path is not None and fit_path.exists():
+            with np.load(fit_path) as data:
+                fits = {name: data[name] for name in data.files}
+        else:
+            q, cube = self.get_window_cube(min_range, max_range, background=background)
+            fits = fitting.fit_peaks(
+                q, cube, model=model, positions=positions, n_workers=n_workers
+            )
+            if fit_path is not None:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                tmp_path = fit_path.with_name(f"{fit_path.stem}.{os.getpid()}.tmp.npz")
+                np.savez(tmp_path, **fits)
+                os.replace(tmp_path, fit_path)
+
+        self._peak_fits[1][key] = fits
+        return fits
+
+    def heatmap_data(
+        self,
+        min_range: float,
+        max_range: float,
+        background: Any = None,
+        peak_stat: str = "max",
+        model: str = "pseudo_voigt",
+    ) -> HeatmapData:
+        """
+        Get the (scan x position) matrix of a peak statistic within a q range, with its axes.
+
+        Parameters:
+        min_range (float): Minimum q value of the range.
+        max_range (float): Maximum q value of the range.
+        background (optional): A background reference (see get_background) to subtract from the spectra first.
+        peak_stat (str): "max" for the maximum peak height (see peak_height_map), or a parameter of a peak fitted in
+        the q range, e.g. "height", "center", "fwhm" or "area" (see get_peak_fits).
+        model (str): The peak model fitted if peak_stat is not "max".
+
+        Returns:
+        HeatmapData: The matrix with the scan numbers, scan times and the distance between positions.
+        """
+        if peak_stat == "max":
+            values = self.peak_height_map(min_range, max_range, background=background)
+            label = "Maximum peak height"
+        else:
+            fits = self.get_peak_fits(
+                min_range, max_range, model, background=background
+            )
+            values = fits[peak_stat]
+            label = f"Fitted peak {peak_stat}"
+        return HeatmapData(
+            values,
+            self.height_group_frame,
+            times=self.get_scan_times(),
+            dataset=self,
+            label=label,
+            q_range=(min_range, max_range),
+        )
+
+    def match_phases(
+        self,
+        references: Union[str, "ReferenceLibrary"],
+        q_min: Optional[float] = None,
+        q_max: Optional[float] = None,
+        threshold: float = 10,
+        wavelength: Optional[float] = None,
+        tolerance: float = 0.01,
+        min_score: float = 0.5,
+        background: Any = None,
+        n_workers: Optional[int] = None,
+    ) -> Dict[str, np.ndarray]:
+        """
+        Match every spectrum of the height group against a library of reference patterns.
+
+        Parameters:
+        references (str or ReferenceLibrary): A folder of reference pattern files, read with
+        references.get_reference_library into the cache_dir of the object, or a library.
+        q_min (float, optional): Minimum q value of the spectra to match.
+        q_max (float, optional): Maximum q value of the spectra to match.
+        threshold (float): The minimum relative intensity (%) of the reference peaks to match.
+        wavelength (float, optional): The wavelength the 2θ angles of the references refer to.
+        tolerance (float): The largest distance in q between a reference peak and a detected peak that matches it.
+        min_score (float): The score from which a phase is taken as present.
+        background (optional): A background reference (see get_background) to subtract from the spectra first.
+        n_workers (int, optional): Number of threads to spread the scans over.
+
+        Returns:
+        Dict[str, np.ndarray]: The (scan x position x pattern) "score" and "present" arrays and the "n_peaks" of every
+        pattern, see phases.match_phases, and the "names" of the patterns.
+        """
+        from . import phases
+        from .references import get_reference_library
+
+        library = references
+        if isinstance(references, (str, os.PathLike)):
+            library = get_reference_library(references, cache_dir=self.cache_dir)
+        q, cube = self.get_window_cube(q_min, q_max, background=background)
+        matches = phases.match_phases(
+            q,
+            cube,
+            library,
+            threshold=threshold,
+            wavelength=wavelength,
+            tolerance=tolerance,
+            min_score=min_score,
+            n_workers=n_workers,
+        )
+        matches["names"] = np.array(library.names)
+        return matches
+
+    def get_q_map(
+        self,
+        position_range: Union[int, List[int]],
+        q_min: Optional[float] = None,
+        q_max: Optional[float] = None,
+        max_scans: int = 1000,
+        max_q: int = 2000,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Get the (scan x q) map of the spectra of the height group, averaged over a range of positions.
+
+        The map is reduced to at most max_scans x max_q samples with aux.minmax_decimate, so that a large experiment
+        can be plotted at screen resolution. Maps are kept on the object and, if the object was created with a
+        cache_dir, stored there keyed by the modification time of the source file.
+
+        Parameters:
+        position_range (int or list of int): A position, or the first and last positions to average.
+        q_min (float, optional): Minimum q value of the map.
+        q_max (float, optional): Maximum q value of the map.
+        max_scans (int): Maximum number of rows (scans) of the map.
+        max_q (int): Maximum number of columns (q values) of the map.
+
+        Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: The row coordinates as (fractional) indices into
+        height_group_frame, the q values of the columns and the map. Cells without data are NaN.
+        """
+        if isinstance(position_range, int):
+            position_range = [position_range]
+        first, last = int(position_range[0]), int(position_range[-1])
+        frames = list(self.height_group_frame)
+        key = (first, last, q_min, q_max, max_scans, max_q)
+        if self._q_maps[0] != frames:
+            self._q_maps = (frames, {})
+        if key in self._q_maps[1]:
+            return self._q_maps[1][key]
+
+        analysis = self.analysis
+        map_path = None
+        if self.cache_dir is not None:
+            source = analysis[0] if analysis is not None else self.fl_integrated
+            map_path = aux.cache_path(self.cache_dir, source, ".qmap.npz", frames, *key)
+        if map_path is not None and map_path.exists():
+            with np.load(map_path) as data:
+                q_map = (data["rows"], data["q"], data["z"])
+        else:
+            if analysis is not None:
+                fl_analysis, group = analysis
+                q = aux.get_data(fl_analysis, f"{group}/q")
+                window = aux.get_q_window(q, q_min, q_max)
+                block = aux.get_data(
+                    fl_analysis,
+                    f"{group}/intensity",
+                    selection=(slice(None), slice(first, last + 1), window),
+                )
+            elif self._intensity_cube is not None and self._intensity_cube[0] == frames:
+                q, cube = self.get_intensity_cube()
+                window = aux.get_q_window(q, q_min, q_max)
+                block = cube[:, first : last + 1, window]
+            elif self.cache_dir is not None and all(
+                path.exists() for path in self._cube_cache_paths(frames)
+            ):
+                q, cube = self.get_intensity_cube(mmap=True)
+                window = aux.get_q_window(q, q_min, q_max)
+                block = np.asarray(cube[:, first : last + 1, window])
+            else:
+                # Only the positions and the q window of the map are read, scan by scan
+                q = aux.get_data(
+                    self.fl_integrated, f"{frames[0]}.1/p3_integrate/integrated/q"
+                )
+                window = aux.get_q_window(q, q_min, q_max)
+                _, block = self._read_intensity_cube(
+                    frames, q=q, window=window, positions=slice(first, last + 1)
+                )
+            with warnings.catch_warnings():
+                # Positions that do not exist in any scan give empty means
+                warnings.simplefilter("ignore", RuntimeWarning)
+                z = np.nanmean(block, axis=1)
+            rows = np.arange(len(frames), dtype=np.float64)
+            rows, z = aux.minmax_decimate(rows, z, max_scans, axis=0)
+            q, z = aux.minmax_decimate(q[window], z, max_q, axis=1)
+            q_map = (rows, q, z)
+            if map_path is not None:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                tmp_path = map_path.with_name(f"{map_path.stem}.{os.getpid()}.tmp.npz")
+                np.savez(tmp_path, rows=rows, q=q, z=z)
+                os.replace(tmp_path, map_path)
+
+        self._q_maps[1][key] = q_map
+        return q_map
+
+    def read_spectrum(
+        self, scan_num: int, position: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Read the q axis and the spectrum of one scan and position.
+
+        The spectrum is read from the analysis file if there is one (see the analysis property), otherwise only its row
+        is read from the integrated file.
+        """
+        analysis = self.analysis
+        if analysis is not None:
+            fl_analysis, group = analysis
+            row = list(self.height_group_frame).index(scan_num)
+            q = aux.get_data(fl_analysis, f"{group}/q")
+            y = aux.get_data(
+                fl_analysis, f"{group}/intensity", selection=(row, position)
+            )
+            return q, y
+        q = aux.get_data(
+            fl=self._fl_integrated,
+            dataset_path=f"{scan_num}.1/p3_integrate/integrated/q",
+        )
+        y = aux.get_data(
+            fl=self._fl_integrated,
+            dataset_path=f"{scan_num}.1/p3_integrate/integrated/intensity",
+            selection=position,
+        )
+        return q, y
+
+    def show_spectrum(
+        self,
+        xref_list: Optional[List] = None,
+        max_points: int = 2000,
+        prefetch: int = 5,
+        debounce: float = 0.05,
+        background: Any = "first",
+    ):
+        """
+        Show an interactive viewer of the spectra of the height group, with sliders for the scan and the position.
+
+        Only a decimated version of the visible q range (see aux.lttb_decimate) is sent to the browser, and the plot is
+        redrawn with WebGL. Spectra are kept in a small cache, the neighbouring scans of the displayed one are read
+        ahead in a background thread, and slider events that arrive within debounce seconds of each other are merged
+        into a single redraw on the event loop of the kernel. The background thread of the previous viewer of this
+        object is stopped.
+
+        Parameters:
+        xref_list (list, optional): Reference patterns to overlay, as (q positions, color, label) tuples.
+        max_points (int): Maximum number of points of the displayed spectrum.
+        prefetch (int): Number of scans before and after the displayed one to read ahead.
+        debounce (float): Delay in seconds before a slider change is drawn.
+        background: The background reference subtracted when "Background Subtraction" is checked (see
+        get_background). It is computed once and kept on the object.
+        """
+        # The widget stack is only needed here, so the rest of the module imports without it
+        import plotly.graph_objects as go
+        from IPython.display import display
+        from ipywidgets import SelectionSlider, IntSlider, Checkbox, VBox
+
         # Function to draw vertical bars and legend labels
         def ybar_plotly(fig, x, label, thick=0.02, alpha=0.25, color="green"):
             fig.add_shape(
@@ -224,9 +944,9 @@ class LoadData:
             ),
         )
 
-        # Add a primary trace for the data
+        # Add a primary trace for the data, drawn with WebGL
         fig.add_trace(
-            go.Scatter(
+            go.Scattergl(
                 x=[],
                 y=[],
                 mode="lines",
@@ -254,51 +974,143 @@ class LoadData:
 
         display(fig)
 
-        # Function to update the plot with new data
-        def plot_data(
-            n: int, position: int, bg_substract: bool, log_scale: bool
-        ) -> None:
-            x = aux.get_data(
-                fl=self._fl_integrated, dataset_path=f"{n}.1/p3_integrate/integrated/q"
-            )
-            y_0 = aux.get_data(
-                fl=self._fl_integrated,
-                dataset_path=f"{self.height_group_frame[0]}.1/p3_integrate/integrated/intensity",
-            )[position]
-            y_n = aux.get_data(
-                fl=self._fl_integrated,
-                dataset_path=f"{n}.1/p3_integrate/integrated/intensity",
-            )[position]
+        frames = list(self.height_group_frame)
+        if self._spectrum_cache is not None:
+            self._spectrum_cache.close()
+        spectra = _SpectrumCache(self, max_size=4 * prefetch + 8)
+        self._spectrum_cache = spectra
+        state = {"handle": None, "x_range": None}
+        try:
+            # The kernel runs an asyncio loop, and redraws scheduled on it run in the kernel thread
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
 
-            y = y_n - y_0 if bg_substract else y_n
+        def draw() -> None:
+            n = scan_slider.value
+            position = position_slider.value
+            x, y = spectra.get(n, position)
+            if bg_checkbox.value:
+                x_0, y_0 = self.get_background(background)
+                y_0 = (
+                    y_0[position] if position < len(y_0) else np.full(len(x_0), np.nan)
+                )
+                if not np.array_equal(x_0, x):
+                    y_0 = np.interp(x, x_0, y_0)
+                y = y - y_0
+            if state["x_range"] is not None:
+                window = aux.get_q_window(x, *state["x_range"])
+                x, y = x[window], y[window]
+            x, y = aux.lttb_decimate(x, y, max_points)
 
             # Update the data in the existing figure
-            fig.data[0].x = x
-            fig.data[0].y = y
-            fig.update_yaxes(type="log" if log_scale else "linear")
-            clear_output(wait=True)
+            with fig.batch_update():
+                fig.data[0].x = x
+                fig.data[0].y = y
+                fig.update_yaxes(type="log" if log_checkbox.value else "linear")
+
+            i = frames.index(n)
+            neighbours = frames[max(i - prefetch, 0) : i + prefetch + 1]
+            spectra.prefetch(neighbours, position)
 
+        def schedule(*_: Any) -> None:
+            if loop is None:
+                draw()
+                return
+            # Merge bursts of slider events into one redraw
+            if state["handle"] is not None:
+                state["handle"].cancel()
+            state["handle"] = loop.call_later(debounce, draw)
+
+        def zoom(layout: Any, x_range: Any, autorange: Any) -> None:
+            # Resetting the axes turns autorange back on, which shows the whole q range again
+            if autorange or x_range is None:
+                state["x_range"] = None
+            else:
+                state["x_range"] = tuple(sorted(x_range))
+            schedule()
+
+        # Only the shapes of the intensity datasets are read to find the number of positions
         max_positions = 0
-        for n in self.height_group_frame:
-            Y = aux.get_data(
+        for n in frames:
+            n_positions = aux.get_shape(
                 fl=self._fl_integrated,
                 dataset_path=f"{n}.1/p3_integrate/integrated/intensity",
-            )
-            max_positions = max(max_positions, len(Y))
+            )[0]
+            max_positions = max(max_positions, n_positions)
 
         # Create interactive sliders and checkbox
-        interactive_plot = interactive(
-            plot_data,
-            n=SelectionSlider(
-                options=self.height_group_frame, description="Scan number"
-            ),
-            position=IntSlider(
-                min=0, max=max_positions - 1, step=1, description="Position"
-            ),
-            bg_substract=Checkbox(value=False, description="Background Subtraction"),
-            log_scale=Checkbox(value=False, description="Log Scale Y"),
+        scan_slider = SelectionSlider(options=frames, description="Scan number")
+        position_slider = IntSlider(
+            min=0, max=max_positions - 1, step=1, description="Position"
         )
-        display(interactive_plot)
+        bg_checkbox = Checkbox(value=False, description="Background Subtraction")
+        log_checkbox = Checkbox(value=False, description="Log Scale Y")
+        for widget in (scan_slider, position_slider, bg_checkbox, log_checkbox):
+            widget.observe(schedule, names="value")
+        fig.layout.xaxis.on_change(zoom, "range", "autorange")
+        display(VBox([scan_slider, position_slider, bg_checkbox, log_checkbox]))
+        draw()
+
+
+class _SpectrumCache:
+    """
+    A small least-recently-used cache of the spectra shown by LoadData.show_spectrum, filled ahead of time by a
+    background thread.
+    """
+
+    def __init__(self, dataset: LoadData, max_size: int = 32):
+        self.dataset = dataset
+        self.max_size = max_size
+        self._spectra: "OrderedDict[Tuple[int, int], Tuple[np.ndarray, np.ndarray]]" = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._queued: set = set()
+        self._closed = False
+        # The thread is also stopped when a viewer is dropped without close
+        weakref.finalize(self, self._executor.shutdown, wait=False)
+
+    def close(self) -> None:
+        """Stop the read-ahead thread. Spectra that are not cached are still read when they are asked for."""
+        self._closed = True
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def get(self, scan_num: int, position: int) -> Tuple[np.ndarray, np.ndarray]:
+        key = (scan_num, position)
+        with self._lock:
+            if key in self._spectra:
+                self._spectra.move_to_end(key)
+                return self._spectra[key]
+        spectrum = self.dataset.read_spectrum(scan_num, position)
+        with self._lock:
+            self._spectra[key] = spectrum
+            while len(self._spectra) > self.max_size:
+                self._spectra.popitem(last=False)
+        return spectrum
+
+    def prefetch(self, scans: List[int], position: int) -> None:
+        """Read the spectra of the given scans in the background thread, if they are not cached yet."""
+        if self._closed:
+            return
+        for scan_num in scans:
+            key = (scan_num, position)
+            with self._lock:
+                if key in self._spectra or key in self._queued:
+                    continue
+                self._queued.add(key)
+            self._executor.submit(self._fetch, key)
+
+    def _fetch(self, key: Tuple[int, int]) -> None:
+        try:
+            self.get(*key)
+        except Exception:
+            # A failed read ahead is retried in the foreground when the spectrum is shown
+            pass
+        finally:
+            with self._lock:
+                self._queued.discard(key)
 
 
 def group_heights(h_array: Dict[int, int]) -> Dict[int, int]:
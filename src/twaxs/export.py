@@ -0,0 +1,261 @@
+"""This module writes the tables and maps exported by the plotting functions, in a format chosen by file extension.
+
+- ".xlsx": Excel, for small tables that are opened by hand. Writing through openpyxl is slow and memory hungry, so
+  a warning is issued for tables longer than EXCEL_WARN_ROWS rows, and tables that do not fit in a sheet are refused.
+- ".csv": CSV, written chunk_rows rows at a time.
+- ".parquet": Parquet, written as one row group per chunk_rows rows (requires pyarrow).
+- ".feather" or ".arrow": Feather (Arrow IPC), written in chunks of chunk_rows rows (requires pyarrow).
+- ".h5" or ".hdf5": HDF5, one chunked dataset per column in the "table" group, in the order of the "columns"
+  attribute of the group.
+- ".npz": NumPy, one array per column and the column names in the "columns" array.
+
+Maps such as heatmaps are written as a 2D matrix with its row and column axes (see write_matrix) rather than as a long
+table with one row per cell.
+"""
+
+import os
+import warnings
+import numpy as np
+import pandas as pd
+from typing import Any, Dict, Optional
+from . import profiling
+
+FORMATS = {
+    ".xlsx": "excel",
+    ".csv": "csv",
+    ".parquet": "parquet",
+    ".feather": "feather",
+    ".arrow": "feather",
+    ".h5": "hdf5",
+    ".hdf5": "hdf5",
+    ".npz": "npz",
+}
+# A sheet holds 1048576 rows including the header, and openpyxl needs minutes and gigabytes long before that
+EXCEL_MAX_ROWS = 1_048_575
+EXCEL_WARN_ROWS = 100_000
+CHUNK_ROWS = 100_000
+
+
+def table_format(path: str) -> str:
+    """Return the format of an export path from its extension, see FORMATS."""
+    suffix = os.path.splitext(str(path))[1].lower()
+    try:
+        return FORMATS[suffix]
+    except KeyError:
+        raise ValueError(
+            f"Unknown export format {suffix!r} of {path}, expected one of {sorted(FORMATS)}"
+        ) from None
+
+
+def _import_pyarrow() -> Any:
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError(
+            "The pyarrow package is required to write Parquet and Feather files."
+        ) from None
+    return pyarrow
+
+
+def _write_excel(df: pd.DataFrame, path: str) -> None:
+    if len(df) > EXCEL_MAX_ROWS:
+        raise ValueError(
+            f"The table has {len(df)} rows, more than an Excel sheet holds. "
+            "Export it to a .parquet, .feather, .h5, .npz or .csv file instead."
+        )
+    if len(df) > EXCEL_WARN_ROWS:
+        warnings.warn(
+            f"Writing {len(df)} rows to Excel is slow, a .parquet, .feather, .h5, .npz or .csv file is much faster.",
+            stacklevel=3,
+        )
+    df.to_excel(path, index=False)
+
+
+def _write_csv(df: pd.DataFrame, path: str, chunk_rows: int) -> None:
+    with open(path, "w", newline="") as f:
+        for start in range(0, max(len(df), 1), chunk_rows):
+            df.iloc[start : start + chunk_rows].to_csv(
+                f, index=False, header=start == 0
+            )
+
+
+def _write_parquet(df: pd.DataFrame, path: str, chunk_rows: int) -> None:
+    pa = _import_pyarrow()
+    import pyarrow.parquet as pq
+
+    df = df.rename(columns=str)
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    with pq.ParquetWriter(path, schema) as writer:
+        for start in range(0, max(len(df), 1), chunk_rows):
+            chunk = df.iloc[start : start + chunk_rows]
+            writer.write_table(
+                pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+            )
+
+
+def _write_feather(df: pd.DataFrame, path: str, chunk_rows: int) -> None:
+    _import_pyarrow()
+    import pyarrow.feather as feather
+
+    feather.write_feather(
+        df.rename(columns=str).reset_index(drop=True), path, chunksize=chunk_rows
+    )
+
+
+def _column_array(values: pd.Series) -> np.ndarray:
+    values = values.to_numpy()
+    if values.dtype.kind in "OS":
+        return values.astype(str)
+    return values
+
+
+def _write_hdf5(df: pd.DataFrame, path: str, chunk_rows: int) -> None:
+    import h5py
+
+    with h5py.File(path, "w") as f:
+        group = f.create_group("table")
+        group.attrs["columns"] = [str(name) for name in df.columns]
+        for k, name in enumerate(df.columns):
+            values = _column_array(df[name])
+            if values.dtype.kind == "U":
+                values = values.astype(object)
+            dtype = h5py.string_dtype() if values.dtype == object else values.dtype
+            column = group.create_dataset(
+                str(k),
+                shape=values.shape,
+                dtype=dtype,
+                chunks=(min(chunk_rows, len(values)),) if len(values) else None,
+            )
+            for start in range(0, len(values), chunk_rows):
+                column[start : start + chunk_rows] = values[start : start + chunk_rows]
+
+
+def _write_npz(df: pd.DataFrame, path: str) -> None:
+    arrays = {str(k): _column_array(df[name]) for k, name in enumerate(df.columns)}
+    np.savez(path, columns=np.array([str(name) for name in df.columns]), **arrays)
+
+
+def write_table(df: pd.DataFrame, path: str, chunk_rows: int = CHUNK_ROWS) -> str:
+    """
+    Write a table in the format given by the extension of path, without its index.
+
+    Parameters:
+    df (pd.DataFrame): The table.
+    path (str): The output path, see FORMATS for the extensions.
+    chunk_rows (int): Number of rows converted and written at a time by the CSV, Parquet, Feather and HDF5 writers.
+
+    Returns:
+    str: The path.
+    """
+    fmt = table_format(path)
+    with profiling.stage("export"):
+        if fmt == "excel":
+            _write_excel(df, path)
+        elif fmt == "csv":
+            _write_csv(df, path, chunk_rows)
+        elif fmt == "parquet":
+            _write_parquet(df, path, chunk_rows)
+        elif fmt == "feather":
+            _write_feather(df, path, chunk_rows)
+        elif fmt == "hdf5":
+            _write_hdf5(df, path, chunk_rows)
+        else:
+            _write_npz(df, path)
+    return path
+
+
+def read_table(path: str) -> pd.DataFrame:
+    """Read a table written by write_table."""
+    fmt = table_format(path)
+    if fmt == "excel":
+        return pd.read_excel(path)
+    if fmt == "csv":
+        return pd.read_csv(path)
+    if fmt == "parquet":
+        return pd.read_parquet(path)
+    if fmt == "feather":
+        return pd.read_feather(path)
+    if fmt == "hdf5":
+        import h5py
+
+        with h5py.File(path, "r") as f:
+            group = f["table"]
+            names = list(group.attrs["columns"])
+            columns = {}
+            for k, name in enumerate(names):
+                values = group[str(k)]
+                if h5py.check_string_dtype(values.dtype) is not None:
+                    values = values.asstr()
+                columns[name] = values[()]
+        return pd.DataFrame(columns)
+    with np.load(path) as data:
+        names = [str(name) for name in data["columns"]]
+        return pd.DataFrame({name: data[str(k)] for k, name in enumerate(names)})
+
+
+def write_matrix(
+    path: str,
+    values: np.ndarray,
+    rows: np.ndarray,
+    columns: np.ndarray,
+    row_label: str,
+    column_label: str,
+    label: str,
+    attrs: Optional[Dict[str, Any]] = None,
+    chunk_rows: int = CHUNK_ROWS,
+) -> str:
+    """
+    Write a 2D map with its axes in the format given by the extension of path.
+
+    HDF5 and NPZ files hold the arrays "values" (rows x columns), "rows" and "columns"; the labels and attrs are
+    attributes of the HDF5 root group and scalar arrays of the NPZ file. The other formats hold a wide table: a first
+    column with the row axis, named row_label, followed by one column per value of the column axis.
+
+    Parameters:
+    path (str): The output path, see FORMATS for the extensions.
+    values (numpy array): The (rows x columns) matrix.
+    rows (numpy array): The row axis, e.g. the scan numbers or times.
+    columns (numpy array): The column axis, e.g. the positions or q values.
+    row_label (str): The name of the row axis.
+    column_label (str): The name of the column axis.
+    label (str): The name of the values.
+    attrs (dict, optional): Additional scalar metadata stored with HDF5 and NPZ files, e.g. the q range.
+    chunk_rows (int): Number of rows written at a time.
+
+    Returns:
+    str: The path.
+    """
+    fmt = table_format(path)
+    values = np.asarray(values)
+    meta = {"row_label": row_label, "column_label": column_label, "label": label}
+    meta.update(attrs or {})
+    if fmt == "hdf5":
+        import h5py
+
+        with profiling.stage("export"), h5py.File(path, "w") as f:
+            dataset = f.create_dataset(
+                "values",
+                shape=values.shape,
+                dtype=values.dtype,
+                chunks=(max(1, min(chunk_rows, len(values))), values.shape[1] or 1),
+            )
+            for start in range(0, len(values), chunk_rows):
+                dataset[start : start + chunk_rows] = values[start : start + chunk_rows]
+            f["rows"] = np.asarray(rows)
+            f["columns"] = np.asarray(columns)
+            for name, value in meta.items():
+                f.attrs[name] = value
+        return path
+    if fmt == "npz":
+        with profiling.stage("export"):
+            np.savez(
+                path,
+                values=values,
+                rows=np.asarray(rows),
+                columns=np.asarray(columns),
+                **{name: np.asarray(value) for name, value in meta.items()},
+            )
+        return path
+    df = pd.DataFrame(values, columns=columns)
+    df.insert(0, row_label, rows)
+    return write_table(df, path, chunk_rows=chunk_rows)
@@ -0,0 +1,121 @@
+"""This module contains the loader of the Faradaic efficiencies measured by gas chromatography (GC) during an experiment.
+
+The GC file has the sample time (epoch seconds) in its first column and a block of Faradaic efficiencies starting at the
+"fe" column, with the product names in the first row, their units in the second row and the data from the third row
+on. The block ends at the next column with a header. The file is an Excel workbook, or a CSV or Parquet file with the
+same layout; a CSV or Parquet file without an "fe" column is read as an already parsed table with a "time" column and
+one column per product.
+
+A file is parsed once per process and kept until it changes, so that plotting several height groups or positions of an
+experiment against its GC data does not re-read the workbook every time.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from typing import Optional
+from . import auxiliary as aux
+from .registry import read_sheet
+
+
+def parse_fe(frame: pd.DataFrame) -> pd.DataFrame:
+    """
+    Extract the Faradaic efficiencies from a GC sheet as read by pandas.
+
+    Parameters:
+    frame (pd.DataFrame): The sheet, with the column headers of its first row.
+
+    Returns:
+    pd.DataFrame: A "time" column, one float column per product named after the first row of the "fe" block, and an
+    "Overall" column with their sum.
+    """
+    columns = [str(name) for name in frame.columns]
+    if "fe" not in columns:
+        raise ValueError('The GC file has no "fe" column.')
+    start = columns.index("fe")
+    end = next(
+        (
+            k
+            for k in range(start + 1, len(columns))
+            if columns[k].split(":")[0] != "Unnamed"
+        ),
+        len(columns),
+    )
+    names = frame.iloc[0, start:end].tolist()
+    block = frame.iloc[2:, start:end].apply(pd.to_numeric, errors="coerce")
+    block.columns = names
+    df_fe = block.reset_index(drop=True).astype(float)
+    df_fe["Overall"] = df_fe.sum(axis=1)
+    time = pd.to_numeric(frame["Unnamed: 0"].iloc[2:], errors="coerce")
+    df_fe.insert(0, "time", time.to_numpy(dtype=float))
+    return df_fe
+
+
+def _parse_file(path: str) -> pd.DataFrame:
+    frame = read_sheet(path)
+    if os.path.splitext(path)[1].lower() in (".csv", ".parquet") and "fe" not in [
+        str(name) for name in frame.columns
+    ]:
+        if "time" not in frame.columns:
+            raise ValueError(
+                f'The GC file {path} has neither a "fe" nor a "time" column.'
+            )
+        df_fe = frame.apply(pd.to_numeric, errors="coerce").astype(float)
+        if "Overall" not in df_fe.columns:
+            df_fe["Overall"] = df_fe.drop(columns="time").sum(axis=1)
+        return df_fe
+    return parse_fe(frame)
+
+
+_FE_CACHE = aux.FileCache()
+
+
+def load_fe(path: str) -> pd.DataFrame:
+    """
+    Load the Faradaic efficiencies of a GC file, parsed once per process (see auxiliary.FileCache).
+
+    Every call returns a copy, which the caller may modify.
+
+    Parameters:
+    path (str): The Excel, CSV (.csv) or Parquet (.parquet) GC file.
+
+    Returns:
+    pd.DataFrame: A "time" column (epoch seconds), one column per product and an "Overall" column, see parse_fe.
+    """
+    return _FE_CACHE.get(path, _parse_file).copy()
+
+
+def align_fe(
+    times: np.ndarray,
+    df_fe: pd.DataFrame,
+    direction: str = "nearest",
+    tolerance: Optional[float] = None,
+) -> pd.DataFrame:
+    """
+    Align GC samples to X-ray scan times with a single as-of join.
+
+    Parameters:
+    times (numpy array): The scan times (epoch seconds), in any order.
+    df_fe (pd.DataFrame): The Faradaic efficiencies, see load_fe.
+    direction (str): "nearest" for the GC sample closest in time, "backward" for the last sample before the scan or
+    "forward" for the first sample after it.
+    tolerance (float, optional): The largest time difference in seconds between a scan and its GC sample. Scans
+    without a GC sample within the tolerance get NaN.
+
+    Returns:
+    pd.DataFrame: One row per scan, in the order of times, with the scan "time", the "fe_time" of its GC sample and
+    the Faradaic efficiency columns of that sample.
+    """
+    scans = pd.DataFrame({"time": np.asarray(times, dtype=float)})
+    scans["order"] = np.arange(len(scans))
+    samples = df_fe.dropna(subset=["time"]).sort_values("time")
+    samples = samples.assign(fe_time=samples["time"])
+    aligned = pd.merge_asof(
+        scans.sort_values("time"),
+        samples,
+        on="time",
+        direction=direction,
+        tolerance=tolerance,
+    )
+    aligned = aligned.sort_values("order").drop(columns="order")
+    return aligned.reset_index(drop=True)
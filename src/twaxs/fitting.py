@@ -0,0 +1,271 @@
+"""This module contains peak fitting of the spectra of a height group.
+
+A single peak on a linear background is fitted in a q window of every spectrum of a (scan x position x q) cube, see
+LoadData.get_window_cube. Three peak shapes are available, all parametrized by their height, center and full width at
+half maximum (fwhm):
+
+- "gaussian": height * exp(-4 ln(2) (q - center)^2 / fwhm^2),
+- "lorentzian": height / (1 + 4 (q - center)^2 / fwhm^2),
+- "pseudo_voigt": eta * lorentzian + (1 - eta) * gaussian, with the mixing parameter eta in [0, 1].
+
+The background is slope * (q - q_mid) + offset, where q_mid is the middle of the q window, so that offset is the
+background under the middle of the window. The spectra of one position are fitted scan after scan, every fit starting
+from the solution of the previous scan, which is close to it during a slowly changing experiment and converges in a few
+iterations. The positions are independent and can be spread over a process pool.
+"""
+
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+MODELS: Dict[str, Tuple[str, ...]] = {
+    "gaussian": ("height", "center", "fwhm"),
+    "lorentzian": ("height", "center", "fwhm"),
+    "pseudo_voigt": ("height", "center", "fwhm", "eta"),
+}
+BACKGROUND_PARAMS = ("slope", "offset")
+
+_GAUSSIAN_FACTOR = 4 * np.log(2)
+
+
+def _check_model(model: str) -> Tuple[str, ...]:
+    try:
+        return MODELS[model] + BACKGROUND_PARAMS
+    except KeyError:
+        raise ValueError(
+            f"Unknown peak model: {model}, expected one of {sorted(MODELS)}"
+        ) from None
+
+
+def gaussian(q: np.ndarray, height: float, center: float, fwhm: float) -> np.ndarray:
+    """A Gaussian peak of the given height and full width at half maximum."""
+    return height * np.exp(-_GAUSSIAN_FACTOR * ((q - center) / fwhm) ** 2)
+
+
+def lorentzian(q: np.ndarray, height: float, center: float, fwhm: float) -> np.ndarray:
+    """A Lorentzian peak of the given height and full width at half maximum."""
+    return height / (1 + 4 * ((q - center) / fwhm) ** 2)
+
+
+def pseudo_voigt(
+    q: np.ndarray, height: float, center: float, fwhm: float, eta: float
+) -> np.ndarray:
+    """A pseudo-Voigt peak: the mix eta * lorentzian + (1 - eta) * gaussian of the same height and width."""
+    return eta * lorentzian(q, height, center, fwhm) + (1 - eta) * gaussian(
+        q, height, center, fwhm
+    )
+
+
+_PROFILES = {
+    "gaussian": gaussian,
+    "lorentzian": lorentzian,
+    "pseudo_voigt": pseudo_voigt,
+}
+
+
+def evaluate(q: np.ndarray, params: Sequence[float], model: str) -> np.ndarray:
+    """
+    Evaluate a fitted peak with its linear background.
+
+    Parameters:
+    q (numpy array): The q values, the background is relative to the middle of their range.
+    params (sequence of float): The parameters in the order of MODELS[model] followed by slope and offset.
+    model (str): The peak model.
+
+    Returns:
+    np.ndarray: The peak and background at q.
+    """
+    q = np.asarray(q, dtype=float)
+    n_peak = len(MODELS[model])
+    slope, offset = params[n_peak], params[n_peak + 1]
+    q_mid = 0.5 * (q.min() + q.max())
+    return _PROFILES[model](q, *params[:n_peak]) + slope * (q - q_mid) + offset
+
+
+def peak_area(params: Dict[str, np.ndarray], model: str) -> np.ndarray:
+    """The integral of the fitted peaks over q, without the background."""
+    gaussian_area = (
+        params["height"] * params["fwhm"] * np.sqrt(np.pi / _GAUSSIAN_FACTOR)
+    )
+    lorentzian_area = params["height"] * params["fwhm"] * np.pi / 2
+    if model == "gaussian":
+        return gaussian_area
+    if model == "lorentzian":
+        return lorentzian_area
+    return params["eta"] * lorentzian_area + (1 - params["eta"]) * gaussian_area
+
+
+def _bounds(q: np.ndarray, model: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Keep the peak inside the window, positive and at least one q step wide."""
+    step = np.min(np.abs(np.diff(q))) if len(q) > 1 else 0.0
+    span = q.max() - q.min()
+    lower = [0.0, q.min(), step]
+    upper = [np.inf, q.max(), 2 * span]
+    if model == "pseudo_voigt":
+        lower.append(0.0)
+        upper.append(1.0)
+    lower += [-np.inf, -np.inf]
+    upper += [np.inf, np.inf]
+    return np.array(lower), np.array(upper)
+
+
+def _initial_guess(q: np.ndarray, y: np.ndarray, model: str) -> np.ndarray:
+    """
+    Estimate the parameters of a spectrum without a previous fit.
+
+    The background is the line through the mean of the first and last few points of the window, and the peak is the
+    largest value above it, with a width taken from the number of points above half of that value.
+    """
+    n_edge = max(1, len(q) // 10)
+    q_lo, q_hi = q[:n_edge].mean(), q[-n_edge:].mean()
+    y_lo, y_hi = y[:n_edge].mean(), y[-n_edge:].mean()
+    slope = (y_hi - y_lo) / (q_hi - q_lo) if q_hi != q_lo else 0.0
+    q_mid = 0.5 * (q.min() + q.max())
+    offset = y_lo + slope * (q_mid - q_lo)
+    residual = y - (slope * (q - q_mid) + offset)
+
+    i_max = int(np.argmax(residual))
+    height = max(residual[i_max], 0.0)
+    step = np.abs(np.diff(q)).mean() if len(q) > 1 else 0.0
+    fwhm = max(np.count_nonzero(residual > height / 2), 1) * step
+    params = [height, q[i_max], fwhm]
+    if model == "pseudo_voigt":
+        params.append(0.5)
+    return np.array(params + [slope, offset])
+
+
+def fit_spectrum(
+    q: np.ndarray,
+    y: np.ndarray,
+    model: str = "pseudo_voigt",
+    p0: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, bool, float]:
+    """
+    Fit a single peak with a linear background to one spectrum.
+
+    Parameters:
+    q (numpy array): The q values of the window.
+    y (numpy array): The intensities at q. NaN values are ignored.
+    model (str): "gaussian", "lorentzian" or "pseudo_voigt".
+    p0 (numpy array, optional): The starting parameters, e.g. the fit of the previous scan. Estimated from the spectrum
+    by default.
+
+    Returns:
+    Tuple[np.ndarray, bool, float]: The parameters in the order of MODELS[model] followed by slope and offset, whether
+    the fit converged, and the root mean square of its residuals. A spectrum with too few finite points gives NaN
+    parameters.
+    """
+    from scipy.optimize import least_squares
+
+    names = _check_model(model)
+    q = np.asarray(q, dtype=float)
+    y = np.asarray(y, dtype=float)
+    finite = np.isfinite(y)
+    if np.count_nonzero(finite) <= len(names):
+        return np.full(len(names), np.nan), False, np.nan
+    q_mid = 0.5 * (q.min() + q.max())
+    q, y = q[finite], y[finite]
+
+    lower, upper = _bounds(q, model)
+    if p0 is None or not np.all(np.isfinite(p0)):
+        p0 = _initial_guess(q, y, model)
+    p0 = np.clip(p0, lower, upper)
+    # least_squares needs a starting point strictly inside finite bounds
+    inner = np.isfinite(lower) & np.isfinite(upper) & (upper > lower)
+    margin = 1e-9 * (upper[inner] - lower[inner])
+    p0[inner] = np.clip(p0[inner], lower[inner] + margin, upper[inner] - margin)
+
+    profile = _PROFILES[model]
+    n_peak = len(MODELS[model])
+
+    def residuals(params: np.ndarray) -> np.ndarray:
+        background = params[n_peak] * (q - q_mid) + params[n_peak + 1]
+        return profile(q, *params[:n_peak]) + background - y
+
+    result = least_squares(
+        residuals, p0, bounds=(lower, upper), method="trf", x_scale="jac"
+    )
+    rms = float(np.sqrt(np.mean(result.fun**2)))
+    return result.x, bool(result.success), rms
+
+
+def _fit_series(
+    q: np.ndarray, spectra: np.ndarray, model: str
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Fit the spectra of one position scan after scan, starting every fit from the last converged one.
+
+    A module-level function so that it can be sent to worker processes.
+    """
+    n_params = len(_check_model(model))
+    params = np.full((len(spectra), n_params), np.nan)
+    success = np.zeros(len(spectra), dtype=bool)
+    rms = np.full(len(spectra), np.nan)
+    previous = None
+    for i, y in enumerate(spectra):
+        params[i], success[i], rms[i] = fit_spectrum(q, y, model, p0=previous)
+        if not success[i] and previous is not None:
+            # The peak moved too far from the previous fit, start again from an estimate
+            params[i], success[i], rms[i] = fit_spectrum(q, y, model)
+        if success[i]:
+            previous = params[i]
+    return params, success, rms
+
+
+def fit_peaks(
+    q: np.ndarray,
+    cube: np.ndarray,
+    model: str = "pseudo_voigt",
+    positions: Optional[List[int]] = None,
+    n_workers: Optional[int] = None,
+) -> Dict[str, np.ndarray]:
+    """
+    Fit a single peak with a linear background to every spectrum of a (scan x position x q) cube.
+
+    Parameters:
+    q (numpy array): The q values of the window, see LoadData.get_window_cube.
+    cube (numpy array): The (scan x position x q) intensities in the window.
+    model (str): "gaussian", "lorentzian" or "pseudo_voigt".
+    positions (list of int, optional): The positions to fit. All positions by default.
+    n_workers (int, optional): Number of processes to spread the positions over. By default the positions are fitted
+    in the calling process.
+
+    Returns:
+    Dict[str, np.ndarray]: (scan x position) arrays of every parameter of the model ("height", "center", "fwhm", "eta"
+    for pseudo_voigt, "slope" and "offset"), of the integrated peak "area", of "success" (whether the fit converged)
+    and of "rms" (root mean square of the residuals). Spectra that cannot be fitted, e.g. padded positions, give NaN.
+    """
+    names = _check_model(model)
+    q = np.asarray(q, dtype=float)
+    cube = np.asarray(cube)
+    if positions is None:
+        positions = range(cube.shape[1])
+    positions = [int(pos) for pos in positions]
+    series = [np.ascontiguousarray(cube[:, pos]) for pos in positions]
+
+    if n_workers is None or n_workers <= 1:
+        fits = [_fit_series(q, spectra, model) for spectra in series]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            fits = list(
+                pool.map(
+                    _fit_series,
+                    [q] * len(series),
+                    series,
+                    [model] * len(series),
+                )
+            )
+
+    n_scans = cube.shape[0]
+    params = np.stack([fit[0] for fit in fits], axis=1).reshape(
+        n_scans, len(positions), len(names)
+    )
+    results = {name: params[..., k] for k, name in enumerate(names)}
+    results["area"] = peak_area(results, model)
+    results["success"] = np.stack([fit[1] for fit in fits], axis=1).reshape(
+        n_scans, len(positions)
+    )
+    results["rms"] = np.stack([fit[2] for fit in fits], axis=1).reshape(
+        n_scans, len(positions)
+    )
+    return results
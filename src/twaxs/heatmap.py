@@ -0,0 +1,147 @@
+"""This module contains the data behind a peak heatmap: a (scan x position) matrix with its axes.
+
+A HeatmapData object is built once by LoadData.heatmap_data and is then drawn by plot.heatmap and written out by its
+export_data option (see HeatmapData.export), so both use the same matrix, the same reaction time axis and the same
+distance scaling.
+"""
+
+import numpy as np
+import pandas as pd
+from typing import Any, List, Optional, Sequence, Tuple
+from . import auxiliary as aux
+from . import export
+
+
+class HeatmapData:
+    """
+    A (scan x position) matrix of a peak statistic with its scan and position axes.
+
+    Positions that do not exist in a scan are NaN. The distance between two positions (in micrometer, see
+    auxiliary.get_height_diff) is only looked up when a distance axis is asked for, unless position_step is given.
+
+    Parameters:
+    values (numpy array): The (scan x position) matrix.
+    scans (sequence of int): The scan number of every row.
+    times (numpy array, optional): The start time (epoch seconds) of every row, required for the reaction time axis.
+    position_step (float, optional): The distance between two positions in micrometer.
+    dataset (LoadData, optional): The dataset to look up position_step from if it is not given.
+    label (str): The name of the statistic, e.g. "Maximum peak height".
+    q_range (tuple, optional): The (min, max) q range the statistic was taken over.
+    """
+
+    def __init__(
+        self,
+        values: np.ndarray,
+        scans: Sequence[int],
+        times: Optional[np.ndarray] = None,
+        position_step: Optional[float] = None,
+        dataset: Any = None,
+        label: str = "Maximum peak height",
+        q_range: Optional[Tuple[float, float]] = None,
+    ):
+        self.values = np.asarray(values)
+        self.scans = np.asarray(scans)
+        if self.values.ndim != 2 or len(self.scans) != len(self.values):
+            raise ValueError(
+                f"Expected a (scan x position) matrix with {len(self.scans)} rows, got shape {self.values.shape}."
+            )
+        self.times = None if times is None else np.asarray(times, dtype=float)
+        self._position_step = position_step
+        self._dataset = dataset
+        self.label = label
+        self.q_range = q_range
+
+    @property
+    def n_scans(self) -> int:
+        return self.values.shape[0]
+
+    @property
+    def n_positions(self) -> int:
+        return self.values.shape[1]
+
+    @property
+    def position_step(self) -> float:
+        """The distance between two positions in micrometer."""
+        if self._position_step is None:
+            if self._dataset is None:
+                raise ValueError("The distance between positions is not known.")
+            self._position_step = aux.get_height_diff(self._dataset)
+        return self._position_step
+
+    def position_scale(self, plot_distance: bool = False) -> float:
+        """The length of one position on the position axis: position_step for a distance axis, 1 otherwise."""
+        return self.position_step if plot_distance else 1
+
+    def scan_axis(self, display_rxn_time: bool = False) -> Tuple[np.ndarray, str]:
+        """Return the reaction time in minutes since the first scan, or the scan numbers, with the axis label."""
+        if display_rxn_time:
+            if self.times is None:
+                raise ValueError("The scan times are not known.")
+            return (self.times - self.times[0]) / 60, "Time (min)"
+        return self.scans, "Scan number"
+
+    def position_axis(self, plot_distance: bool = False) -> Tuple[np.ndarray, str]:
+        """Return the position numbers, or their distance from the first position in micrometer, with the axis label."""
+        positions = np.arange(self.n_positions, dtype=float)
+        if plot_distance:
+            return positions * self.position_step, "Distance (μm)"
+        return positions, "Position"
+
+    def extent(
+        self, display_rxn_time: bool = False, plot_distance: bool = False
+    ) -> List[float]:
+        """The imshow extent of the transposed matrix: scans along x and positions along y."""
+        scan_values, _ = self.scan_axis(display_rxn_time)
+        return [
+            scan_values.min(),
+            scan_values.max(),
+            0,
+            self.n_positions * self.position_scale(plot_distance),
+        ]
+
+    def to_frame(
+        self, display_rxn_time: bool = False, plot_distance: bool = False
+    ) -> pd.DataFrame:
+        """
+        Return the matrix as a long table with one row per (scan, position) cell, scan after scan.
+
+        The columns are the scan axis, the position axis and the statistic, named by their labels.
+        """
+        scan_values, scan_label = self.scan_axis(display_rxn_time)
+        position_values, position_label = self.position_axis(plot_distance)
+        return pd.DataFrame(
+            {
+                scan_label: np.repeat(scan_values, self.n_positions),
+                position_label: np.tile(position_values, self.n_scans),
+                self.label: self.values.ravel(),
+            }
+        )
+
+    def export(
+        self, path: str, display_rxn_time: bool = False, plot_distance: bool = False
+    ) -> str:
+        """
+        Write the heatmap in the format given by the extension of path (see the export module).
+
+        Excel files hold the long table of to_frame, as opened by hand. The other formats hold the matrix with the scan
+        axis as rows and the position axis as columns (see export.write_matrix).
+        """
+        if export.table_format(path) == "excel":
+            return export.write_table(
+                self.to_frame(display_rxn_time, plot_distance), path
+            )
+        scan_values, scan_label = self.scan_axis(display_rxn_time)
+        position_values, position_label = self.position_axis(plot_distance)
+        attrs = {}
+        if self.q_range is not None:
+            attrs["q_min"], attrs["q_max"] = self.q_range
+        return export.write_matrix(
+            path,
+            self.values,
+            scan_values,
+            position_values,
+            scan_label,
+            position_label,
+            self.label,
+            attrs=attrs,
+        )
@@ -0,0 +1,286 @@
+"""This module contains the scan metadata index of a raw hdf5 file.
+
+The index is built by walking the raw file once and holds one row per scan with the scan number, the start time and
+the value of every positioner, so that the scan table, motor heights and time stamps do not need to be read from the
+raw file scan by scan.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+from . import auxiliary as aux
+from . import profiling
+
+
+class ScanIndex:
+    """
+    Columnar table of the metadata of every scan in a raw hdf5 file.
+
+    The table has the columns "scan" (scan number), "start_time" (epoch seconds) and, for every positioner, the
+    columns "<motor>" (its value if it is a scalar, NaN otherwise), "<motor>.length" (number of points, 1 for a scalar),
+    "<motor>.first" and "<motor>.last" (first and last point of the trajectory).
+    """
+
+    def __init__(self, columns: Dict[str, np.ndarray]):
+        self.columns = columns
+        self._rows = {int(scan): i for i, scan in enumerate(columns["scan"])}
+
+    def __len__(self) -> int:
+        return len(self.columns["scan"])
+
+    @property
+    def scans(self) -> np.ndarray:
+        return self.columns["scan"]
+
+    @property
+    def motors(self) -> List[str]:
+        return [name for name in self.columns if f"{name}.length" in self.columns]
+
+    def max_scan(self) -> int:
+        return int(self.scans.max())
+
+    def rows(self, scans: Union[int, Sequence[int]]) -> np.ndarray:
+        """Return the row numbers of the given scan numbers, raising a KeyError for a scan that is not indexed."""
+        try:
+            return np.array([self._rows[int(n)] for n in np.atleast_1d(scans)], int)
+        except KeyError as e:
+            raise KeyError(f"Scan {e.args[0]} not found in the scan index.") from None
+
+    def get(self, column: str, scans: Optional[Sequence[int]] = None) -> np.ndarray:
+        """
+        Get a column of the index, for every scan or only for the given scan numbers.
+
+        Parameters:
+        column (str): The column name, e.g. "start_time", "h1tz" or "pp01.length".
+        scans (sequence of int, optional): Scan numbers to return the values for, in this order.
+
+        Returns:
+        np.ndarray: The values of the column.
+        """
+        if column not in self.columns:
+            raise KeyError(f"Column {column} not found in the scan index.")
+        values = self.columns[column]
+        if scans is None:
+            return values
+        return values[self.rows(scans)]
+
+    def extend(self, other: "ScanIndex") -> "ScanIndex":
+        """
+        Return a new index with the rows of other appended.
+
+        Columns that exist in only one of the indices are filled with NaN (0 for the length columns) in the other.
+        """
+        columns = {}
+        names = list(self.columns) + [c for c in other.columns if c not in self.columns]
+        for name in names:
+            parts = []
+            for index in (self, other):
+                if name in index.columns:
+                    parts.append(index.columns[name])
+                else:
+                    fill = 0 if name.endswith(".length") else np.nan
+                    parts.append(np.full(len(index), fill))
+            columns[name] = np.concatenate(parts)
+        return ScanIndex(columns)
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(self.columns)
+
+    def save(self, path: str) -> None:
+        """Save the index as a .npz file, or as a Parquet file if path ends with .parquet."""
+        path = str(path)
+        if path.endswith(".parquet"):
+            self.to_frame().to_parquet(path, index=False)
+        else:
+            with open(path, "wb") as f:
+                np.savez(f, **self.columns)
+
+    @classmethod
+    def load(cls, path: str) -> "ScanIndex":
+        """Load an index saved with save."""
+        path = str(path)
+        if path.endswith(".parquet"):
+            df = pd.read_parquet(path)
+            return cls({name: df[name].to_numpy() for name in df.columns})
+        with np.load(path) as data:
+            return cls({name: data[name] for name in data.files})
+
+
+# ISO 8601 time stamps with an explicit UTC offset, as written by the beamline
+_ISO_WITH_OFFSET = r"^\d{4}-\d{2}-\d{2}[T ][\d:.,]+(?:Z|[+-]\d{2}(?::?\d{2})?)$"
+
+
+@profiling.timed("time_parsing")
+def _parse_start_times(timestamps: List[Optional[str]]) -> np.ndarray:
+    """
+    Convert start_time strings to epoch seconds; missing values become NaN.
+
+    ISO 8601 time stamps with a UTC offset are parsed together with pandas. Any other format, including time stamps
+    without an offset, which dateutil reads as local time, is parsed one by one with dateutil.
+    """
+    epoch = np.full(len(timestamps), np.nan)
+    values = pd.Series(timestamps, dtype=object)
+    present = values.map(bool, na_action="ignore").fillna(False).to_numpy(bool)
+    iso = present & values.str.match(_ISO_WITH_OFFSET).fillna(False).to_numpy(bool)
+    if iso.any():
+        parsed = pd.to_datetime(
+            values[iso], format="ISO8601", utc=True, errors="coerce"
+        )
+        valid = parsed.notna().to_numpy()
+        # Whole microseconds are exactly representable, so the result is the same as datetime.timestamp
+        microseconds = (parsed[valid] - pd.Timestamp(0, tz="UTC")) // pd.Timedelta(
+            1, "us"
+        )
+        rows = np.flatnonzero(iso)
+        epoch[rows[valid]] = microseconds.to_numpy(np.int64) / 1e6
+        iso[rows[~valid]] = False
+
+    remaining = np.flatnonzero(present & ~iso)
+    if len(remaining):
+        from dateutil.parser import parse
+
+        for i in remaining:
+            epoch[i] = parse(timestamps[i]).timestamp()
+    return epoch
+
+
+@profiling.timed("scan_index.build")
+def build_scan_index(fl_raw: str, after_scan: Optional[int] = None) -> ScanIndex:
+    """
+    Walk a raw hdf5 file once and collect the metadata of every "N.1" scan group into a ScanIndex.
+
+    Array positioners are not read in full; only their length and their first and last points are.
+
+    Parameters:
+    fl_raw (str): The file path of the raw hdf5 file.
+    after_scan (int, optional): Only index the scans with a number larger than this one.
+
+    Returns:
+    ScanIndex: The index, sorted by scan number.
+    """
+    scans = []
+    timestamps = []
+    motor_values: Dict[str, Dict[str, List[float]]] = {}
+    with aux.get_file_pool().file(fl_raw) as f:
+        scan_keys = sorted(
+            (int(key.split(".")[0]), key)
+            for key in f.keys()
+            if key.endswith(".1") and key.split(".")[0].isdigit()
+        )
+        if after_scan is not None:
+            scan_keys = [(n, key) for n, key in scan_keys if n > after_scan]
+        for row, (scan_num, key) in enumerate(scan_keys):
+            group = f[key]
+            scans.append(scan_num)
+            timestamp = group["start_time"][()] if "start_time" in group else None
+            if timestamp is not None:
+                profiling.record_read(f"{key}/start_time", len(timestamp))
+            if isinstance(timestamp, bytes):
+                timestamp = timestamp.decode("utf-8")
+            timestamps.append(timestamp)
+
+            positioners = group.get("instrument/positioners", {})
+            for motor, ds in positioners.items():
+                if not hasattr(ds, "shape") or ds.dtype.kind not in "biuf":
+                    continue
+                profiling.record_read(
+                    f"{key}/instrument/positioners/{motor}", 2 * ds.dtype.itemsize
+                )
+                if ds.shape == ():
+                    first = last = float(ds[()])
+                    value, length = first, 1
+                else:
+                    length = ds.shape[0]
+                    first = float(ds[0]) if length else np.nan
+                    last = float(ds[-1]) if length else np.nan
+                    value = np.nan
+                if motor not in motor_values:
+                    motor_values[motor] = {
+                        "": [np.nan] * row,
+                        ".length": [0] * row,
+                        ".first": [np.nan] * row,
+                        ".last": [np.nan] * row,
+                    }
+                columns = motor_values[motor]
+                columns[""].append(value)
+                columns[".length"].append(length)
+                columns[".first"].append(first)
+                columns[".last"].append(last)
+            # Motors that are missing in this scan get an empty entry
+            for columns in motor_values.values():
+                if len(columns[""]) == row:
+                    columns[""].append(np.nan)
+                    columns[".length"].append(0)
+                    columns[".first"].append(np.nan)
+                    columns[".last"].append(np.nan)
+
+    index_columns = {
+        "scan": np.array(scans, dtype=np.int64),
+        "start_time": _parse_start_times(timestamps),
+    }
+    for motor, columns in motor_values.items():
+        for suffix, values in columns.items():
+            dtype = np.int64 if suffix == ".length" else np.float64
+            index_columns[f"{motor}{suffix}"] = np.array(values, dtype=dtype)
+    return ScanIndex(index_columns)
+
+
+_INDEX_CACHE = aux.FileCache()
+
+
+def get_scan_index(
+    fl_raw: str,
+    cache_dir: Optional[str] = None,
+    index_format: str = "npz",
+    incremental: bool = False,
+) -> ScanIndex:
+    """
+    Get the scan index of a raw hdf5 file.
+
+    The index is kept in memory for the lifetime of the process and rebuilt when the file changes (see
+    auxiliary.FileCache). If cache_dir is given, the index is also persisted there and reused by later sessions; the
+    index persisted by this process for the previous state of the file is then removed.
+
+    Parameters:
+    fl_raw (str): The file path of the raw hdf5 file.
+    cache_dir (str, optional): Directory to persist the index in.
+    index_format (str): "npz" or "parquet" (requires pyarrow), the format of the persisted index.
+    incremental (bool): If True and the file changed since it was last indexed, only the scans appended since then are
+    read and added to the index. This is meant for files that are still being written, where scans are only ever
+    appended.
+
+    Returns:
+    ScanIndex: The index of the file.
+    """
+    if index_format not in ("npz", "parquet"):
+        raise ValueError(f"Unknown index format: {index_format}")
+    # The index of the previous state of the file, with the path it was persisted to
+    previous = _INDEX_CACHE.previous(fl_raw)
+
+    def load(key: str) -> Tuple[ScanIndex, Optional[Path]]:
+        index_path = None
+        if cache_dir is not None:
+            index_path = aux.cache_path(cache_dir, key, f".scanindex.{index_format}")
+        if index_path is not None and index_path.exists():
+            return ScanIndex.load(index_path), index_path
+        if incremental and previous is not None and len(previous[0]):
+            index = previous[0].extend(
+                build_scan_index(key, after_scan=previous[0].max_scan())
+            )
+        else:
+            index = build_scan_index(key)
+        if index_path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = index_path.with_name(
+                f"{index_path.stem}.{os.getpid()}.tmp{index_path.suffix}"
+            )
+            index.save(tmp_path)
+            os.replace(tmp_path, index_path)
+            # The index of the previous state of the file is stale, and a file that is followed changes at every poll
+            if previous is not None and previous[1] not in (None, index_path):
+                previous[1].unlink(missing_ok=True)
+        return index, index_path
+
+    return _INDEX_CACHE.get(fl_raw, load)[0]
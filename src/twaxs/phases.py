@@ -0,0 +1,198 @@
+"""This module matches the spectra of a height group against a library of reference patterns to identify phases.
+
+The peaks of every (scan, position) spectrum are detected at once over the whole (scan x position x q) cube: a peak is
+a local maximum of the smoothed spectrum that rises above the local background by more than snr times the local noise
+(see detect_peaks). The number of detected peaks up to every q bin is then accumulated along q, so whether a
+spectrum has a peak within tolerance of a reference peak is a difference of two entries of that cumulative sum at
+indices found by np.searchsorted, for all spectra and all reference peaks at once.
+
+The score of a reference pattern in a spectrum is the fraction of the intensity of its peaks within the q range of the
+data that were found, and the phase is taken as present if its score is at least min_score. The scans are processed in
+blocks, which bounds the memory of the (scan x position x reference peak) intermediate and can be spread over threads.
+"""
+
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+from .references import ReferenceLibrary
+
+
+def _window_bins(q: np.ndarray, width: float) -> int:
+    """The odd number of q bins that covers a width in q, at least 3."""
+    step = np.abs(q[-1] - q[0]) / max(len(q) - 1, 1)
+    if not step:
+        return 3
+    return 2 * max(int(round(width / (2 * step))), 1) + 1
+
+
+def detect_peaks(
+    q: np.ndarray,
+    spectra: np.ndarray,
+    smoothing: int = 5,
+    background_width: float = 0.1,
+    snr: float = 5.0,
+) -> np.ndarray:
+    """
+    Detect the peaks of many spectra at once.
+
+    The spectra are smoothed with a moving average of smoothing q bins. A peak is a local maximum of the smoothed
+    spectrum that rises above the local background, the minimum of the smoothed spectrum within background_width, by
+    more than snr times the local noise. The noise is the standard deviation of the spectrum, estimated from the median
+    absolute difference of neighbouring q bins within blocks of three times background_width. The few differences
+    across the peaks do not move the median, and the blocks follow the q-dependent noise of counting statistics.
+
+    Parameters:
+    q (numpy array): The sorted q values shared by all spectra.
+    spectra (numpy array): Intensities of shape (..., len(q)), e.g. (scan, position, q).
+    smoothing (int): The number of q bins of the moving average, at least 3 and less than the width of the peaks.
+    background_width (float): The width in q of the window of the local background. It should be a few times the width
+    of the peaks.
+    snr (float): How many times the local noise a peak must rise above the local background.
+
+    Returns:
+    np.ndarray: A boolean array of the shape of spectra, True at the q bins of the peaks. Spectra that are NaN (padded
+    positions) have no peaks.
+    """
+    from scipy.ndimage import minimum_filter1d, uniform_filter1d
+
+    if smoothing < 3:
+        raise ValueError(
+            f"smoothing must be at least 3 q bins to tell peaks from noise, got {smoothing}."
+        )
+    q = np.asarray(q)
+    y = np.asarray(spectra, dtype=np.float32)
+    smoothed = uniform_filter1d(y, smoothing, axis=-1, mode="nearest")
+
+    peaks = np.zeros(y.shape, dtype=bool)
+    center = smoothed[..., 1:-1]
+    peaks[..., 1:-1] = (center > smoothed[..., :-2]) & (center >= smoothed[..., 2:])
+    background = minimum_filter1d(
+        smoothed, _window_bins(q, background_width), axis=-1, mode="nearest"
+    )
+    # The difference of two bins with independent Gaussian noise has sqrt(2) times its standard deviation, and the
+    # median absolute value of a Gaussian is 1 / 1.4826 times its standard deviation
+    steps = np.abs(np.diff(y, axis=-1))
+    block = _window_bins(q, 3 * background_width)
+    noise = np.empty(y.shape, dtype=np.float32)
+    for start in range(0, y.shape[-1], block):
+        # The last block is shifted back to a full block of differences
+        first = max(min(start, steps.shape[-1] - block), 0)
+        median = np.median(steps[..., first : first + block], axis=-1)
+        noise[..., start : start + block] = (1.4826 / np.sqrt(2) * median)[..., None]
+    with np.errstate(invalid="ignore"):
+        peaks &= smoothed - background > snr * noise
+    return peaks
+
+
+def _reference_peaks(
+    q: np.ndarray,
+    library: ReferenceLibrary,
+    threshold: float,
+    wavelength: Optional[float],
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """The reference peaks within the q range of the data and the weight of every peak in the score of its pattern."""
+    pattern_ids, q_ref, intensity = library.peaks(threshold, wavelength)
+    inside = (q_ref >= q.min()) & (q_ref <= q.max())
+    pattern_ids, q_ref, intensity = (
+        pattern_ids[inside],
+        q_ref[inside],
+        intensity[inside],
+    )
+    total = np.bincount(pattern_ids, weights=intensity, minlength=len(library))
+    weights = np.zeros((len(q_ref), len(library)), dtype=np.float32)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        weights[np.arange(len(q_ref)), pattern_ids] = intensity / total[pattern_ids]
+    n_peaks = np.bincount(pattern_ids, minlength=len(library))
+    return q_ref, weights, n_peaks
+
+
+def _score_block(
+    q: np.ndarray,
+    block: np.ndarray,
+    idx_lo: np.ndarray,
+    idx_hi: np.ndarray,
+    weights: np.ndarray,
+    smoothing: int,
+    background_width: float,
+    snr: float,
+) -> np.ndarray:
+    """Score every reference pattern in a (scan x position x q) block of spectra."""
+    peaks = detect_peaks(q, block, smoothing, background_width, snr)
+    counts = np.zeros(peaks.shape[:-1] + (peaks.shape[-1] + 1,), dtype=np.int32)
+    np.cumsum(peaks, axis=-1, out=counts[..., 1:])
+    found = counts[..., idx_hi] > counts[..., idx_lo]
+    scores = found.astype(np.float32) @ weights
+    # Positions that do not exist in a scan
+    scores[np.all(np.isnan(block), axis=-1)] = np.nan
+    return scores
+
+
+def match_phases(
+    q: np.ndarray,
+    cube: np.ndarray,
+    library: ReferenceLibrary,
+    threshold: float = 10,
+    wavelength: Optional[float] = None,
+    tolerance: float = 0.01,
+    min_score: float = 0.5,
+    smoothing: int = 5,
+    background_width: float = 0.1,
+    snr: float = 5.0,
+    block_scans: int = 64,
+    n_workers: Optional[int] = None,
+) -> Dict[str, np.ndarray]:
+    """
+    Match every spectrum of a (scan x position x q) cube against all patterns of a reference library.
+
+    Parameters:
+    q (numpy array): The sorted q values of the cube.
+    cube (numpy array): The (scan x position x q) intensities, see LoadData.get_window_cube.
+    library (ReferenceLibrary): The reference patterns, see references.get_reference_library.
+    threshold (float): The minimum relative intensity (%) of the reference peaks to match.
+    wavelength (float, optional): The wavelength the 2θ angles of the references refer to, see ReferenceLibrary.peaks.
+    tolerance (float): The largest distance in q between a reference peak and a detected peak that matches it.
+    min_score (float): The score from which a phase is taken as present.
+    smoothing (int): See detect_peaks.
+    background_width (float): See detect_peaks.
+    snr (float): See detect_peaks.
+    block_scans (int): Number of scans processed at a time.
+    n_workers (int, optional): Number of threads to spread the blocks over. By default the blocks are processed in the
+    calling thread.
+
+    Returns:
+    Dict[str, np.ndarray]: "score", a (scan x position x pattern) array of the fraction of the reference intensity in
+    the q range that was found; "present", score >= min_score; and "n_peaks", the number of peaks of every pattern in
+    the q range. Patterns without any peak in the q range, and positions that do not exist in a scan, have a NaN score and
+    are never present.
+    """
+    q = np.asarray(q, dtype=float)
+    cube = np.asarray(cube)
+    if len(q) > 1 and q[0] > q[-1]:
+        q = q[::-1]
+        cube = cube[..., ::-1]
+    q_ref, weights, n_peaks = _reference_peaks(q, library, threshold, wavelength)
+    idx_lo = np.searchsorted(q, q_ref - tolerance, side="left")
+    idx_hi = np.searchsorted(q, q_ref + tolerance, side="right")
+
+    starts = range(0, cube.shape[0], block_scans)
+
+    def score(start: int) -> np.ndarray:
+        block = cube[start : start + block_scans]
+        return _score_block(
+            q, block, idx_lo, idx_hi, weights, smoothing, background_width, snr
+        )
+
+    if n_workers is None or n_workers <= 1:
+        blocks = [score(start) for start in starts]
+    else:
+        with ThreadPoolExecutor(max_workers=n_workers) as pool:
+            blocks = list(pool.map(score, starts))
+
+    if blocks:
+        scores = np.concatenate(blocks, axis=0)
+    else:
+        scores = np.zeros(cube.shape[:2] + (len(library),), dtype=np.float32)
+    scores[..., n_peaks == 0] = np.nan
+    with np.errstate(invalid="ignore"):
+        present = scores >= min_score
+    return {"score": scores, "present": present, "n_peaks": n_peaks}
@@ -1,14 +1,20 @@
 """This module contain functions that used to visualized the analyzed data."""
 
+import abc
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.ticker as ticker
-from typing import List, Dict, Any, Union
+from typing import List, Dict, Any, Union, Optional, Tuple
 from . import auxiliary as aux
+from . import export
+from . import faradaic
+from . import profiling
 from .dataset import LoadData
+from .heatmap import HeatmapData
 
 
+@profiling.timed("plot.heatmap")
 def heatmap(
     dataset: LoadData,
     min_range: float,
@@ -17,8 +23,11 @@ def heatmap(
     display_rxn_time: bool = False,
     export_fig: str = None,
     plot_distance: bool = False,
-    lower_limit: float = None,  
-    upper_limit: float = None,  
+    lower_limit: float = None,
+    upper_limit: float = None,
+    background: Any = None,
+    peak_stat: str = "max",
+    model: str = "pseudo_voigt",
 ) -> None:
     """
     Plots a heatmap based on the intensity of peaks as a function of the q range and scan number.
@@ -26,102 +35,170 @@ def heatmap(
     :param dataset: Dataset object of the associated experiment.
     :param min_range: Minimum range of q values.
     :param max_range: Maximum range of q values.
-    :param export_data: Whether or not to export data in Excel format.
+    :param export_data: If the path is given, export the heatmap data in the format of its extension (.xlsx, .csv,
+        .parquet, .feather, .h5 or .npz, see the export module). Excel files hold one row per cell, the other formats
+        the matrix with its axes.
     :param display_rxn_time: If True, display reaction time. If False, display scan number.
     :param export_fig: If the path is given, export graph to the specified path.
     :param plot_distance: If True, plot the heatmap in real distance rather than in arbitrary position.
     :param lower_limit: Minimum intensity value to display in the heatmap.
     :param upper_limit: Maximum intensity value to display in the heatmap.
+    :param background: If given, a background reference subtracted from the spectra first: "first" (first scan), K
+        (mean of the first K scans) or a (first, last) scan number range, see LoadData.get_background.
+    :param peak_stat: "max" for the maximum peak height, or a parameter of a peak fitted in the q range ("height",
+        "center", "fwhm", "area", ...), see LoadData.get_peak_fits.
+    :param model: The peak model fitted if peak_stat is not "max": "gaussian", "lorentzian" or "pseudo_voigt".
     """
-    max_positions = 0
-    height_group_frame = dataset.height_group_frame
-    fl_num = dataset.fl_num
-    height_group = dataset.height_group
-    integrated_data = dataset.fl_integrated
-    for x_val in height_group_frame:
-        Y = aux.get_data(
-            fl=integrated_data,
-            dataset_path=f"{x_val}.1/p3_integrate/integrated/intensity",
-        )
-        max_positions = max(max_positions, len(Y))
-
-    x = np.linspace(0, max_positions - 1, max_positions)
-    if display_rxn_time:
-        array_timestamp = [
-            aux.get_scan_time(fl=dataset.fl_raw, scan_num=f) for f in height_group_frame
-        ]
-        array_rxn_time = [(t - array_timestamp[0]) / 60 for t in array_timestamp]
-        y = np.array(array_rxn_time)
-    else:
-        y = np.array(height_group_frame)
-    x, y = np.meshgrid(x, y)
-    z = np.empty_like(x)
-
-    for i, y_val in enumerate(height_group_frame):
-        X = aux.get_data(
-            fl=integrated_data, dataset_path=f"{y_val}.1/p3_integrate/integrated/q"
-        )
-        Y = aux.get_data(
-            fl=integrated_data,
-            dataset_path=f"{y_val}.1/p3_integrate/integrated/intensity",
-        )
-
-        for j, x_val in enumerate(x[i]):
-            if 0 <= x_val < len(Y):
-                z[i, j] = aux.find_peak_height(
-                    X=X, Y=Y[int(x_val)], x_min=min_range, x_max=max_range
-                )
-            else:
-                z[i, j] = np.nan
-    if plot_distance:
-        distance_multiplier = aux.get_height_diff(dataset)
-    else:
-        distance_multiplier = 1
+    data = dataset.heatmap_data(
+        min_range, max_range, background=background, peak_stat=peak_stat, model=model
+    )
+    scale = data.position_scale(plot_distance)
     plt.imshow(
-        z.T,
-        extent=[y.min(), y.max(), 0, max_positions * distance_multiplier],
+        data.values.T,
+        extent=data.extent(display_rxn_time, plot_distance),
         origin="lower",
         aspect="auto",
         cmap="RdYlBu",
         interpolation="nearest",
-        vmin=lower_limit, 
-        vmax=upper_limit,  
+        vmin=lower_limit,
+        vmax=upper_limit,
     )
 
-    plt.colorbar(label="Maximum peak height")
-    if display_rxn_time:
-        x_label = "Time (min)"
-    else:
-        x_label = "Scan number"
+    plt.colorbar(label=data.label)
+    _, x_label = data.scan_axis(display_rxn_time)
+    _, y_label = data.position_axis(plot_distance)
     plt.xlabel(x_label)
-    if plot_distance:
-        y_label = "Distance (μm)"
-    else:
-        y_label = "Position"
     plt.ylabel(y_label)
     plt.title(
-        f"Exp: {fl_num}, height group: {height_group}, q range = [{min_range:.4f},{max_range:.4f}]",
+        f"Exp: {dataset.fl_num}, height group: {dataset.height_group}, q range = [{min_range:.4f},{max_range:.4f}]",
         size=11,
     )
     ax = plt.gca()
     ax.minorticks_on()
-    y_ticks = np.linspace(0, max_positions * distance_multiplier, 11)
+    y_ticks = np.linspace(0, data.n_positions * scale, 11)
     ax.set_yticks(y_ticks)
     ax.yaxis.set_major_locator(ticker.FixedLocator(y_ticks))
-    if export_fig:
-        plt.savefig(export_fig)
-    plt.show()
+    with profiling.stage("render"):
+        if export_fig:
+            plt.savefig(export_fig)
+        plt.show()
     if export_data:
-        data = {
-            x_label: y.flatten(),
-            y_label: x.flatten() * distance_multiplier,
-            "Maximum peak height": z.flatten(),
-        }
-        df = pd.DataFrame(data)
-        df.to_excel(export_data, index=False)
+        data.export(export_data, display_rxn_time, plot_distance)
 
 
+@profiling.timed("plot.waterfall")
+def waterfall(
+    dataset: LoadData,
+    position_range: Union[int, List[int]],
+    q_min: float = None,
+    q_max: float = None,
+    display_rxn_time: bool = False,
+    log_scale: bool = False,
+    lower_limit: float = None,
+    upper_limit: float = None,
+    max_scans: int = 1000,
+    max_q: int = 2000,
+    backend: str = "matplotlib",
+    export_fig: str = None,
+    export_data: str = None,
+) -> None:
+    """
+    Plots the full diffractograms of the height group as a (scan x q) map, averaged over a position range.
+
+    Unlike heatmap, which reduces every spectrum to one peak height, this shows every q value, so phase changes appear
+    as lines starting or ending during the experiment. Large maps are min/max downsampled to max_scans x max_q samples
+    before plotting (see LoadData.get_q_map).
+
+    :param dataset: Dataset object of the associated experiment.
+    :param position_range: A position, or the first and last positions to average.
+    :param q_min: Minimum q value of the map.
+    :param q_max: Maximum q value of the map.
+    :param display_rxn_time: If True, display reaction time. If False, display scan number.
+    :param log_scale: If True, use a logarithmic color scale.
+    :param lower_limit: Minimum intensity value to display.
+    :param upper_limit: Maximum intensity value to display.
+    :param max_scans: Maximum number of scans (rows) to plot.
+    :param max_q: Maximum number of q values (columns) to plot.
+    :param backend: "matplotlib" or "plotly" (interactive zoom).
+    :param export_fig: If the path is given, export graph to the specified path (an HTML file with plotly).
+    :param export_data: If the path is given, export the plotted map, one row per scan and one column per q value, in
+        the format of its extension (see the export module).
+    """
+    if backend not in ("matplotlib", "plotly"):
+        raise ValueError(f"Unknown backend: {backend}")
+    rows, q, z = dataset.get_q_map(
+        position_range, q_min, q_max, max_scans=max_scans, max_q=max_q
+    )
+    frame_index = np.arange(len(dataset.height_group_frame))
+    if display_rxn_time:
+        array_timestamp = dataset.get_scan_times()
+        y = np.interp(rows, frame_index, (array_timestamp - array_timestamp[0]) / 60)
+        y_label = "Time (min)"
+    else:
+        y = np.interp(rows, frame_index, dataset.height_group_frame)
+        y_label = "Scan number"
+    title = f"Exp: {dataset.fl_num}, height group: {dataset.height_group}, pos. = {position_range}"
+
+    if backend == "plotly":
+        import plotly.graph_objects as go
+
+        z_plot = np.log10(z) if log_scale else z
+        fig = go.Figure(
+            go.Heatmap(
+                x=q,
+                y=y,
+                z=z_plot,
+                zmin=None if lower_limit is None or log_scale else lower_limit,
+                zmax=None if upper_limit is None or log_scale else upper_limit,
+                colorscale="Viridis",
+                colorbar=dict(title="log10 intensity" if log_scale else "Intensity"),
+            )
+        )
+        fig.update_layout(title=title, xaxis_title="q", yaxis_title=y_label)
+        with profiling.stage("render"):
+            if export_fig:
+                fig.write_html(export_fig)
+            fig.show()
+    else:
+        from matplotlib.colors import LogNorm
+
+        norm = None
+        if log_scale:
+            norm = LogNorm(vmin=lower_limit, vmax=upper_limit)
+        fig, ax = plt.subplots()
+        mesh = ax.pcolormesh(
+            q,
+            y,
+            z,
+            shading="nearest",
+            cmap="viridis",
+            norm=norm,
+            vmin=None if log_scale else lower_limit,
+            vmax=None if log_scale else upper_limit,
+        )
+        fig.colorbar(mesh, label="Intensity")
+        ax.minorticks_on()
+        ax.set_xlabel("q")
+        ax.set_ylabel(y_label)
+        ax.set_title(title, size=11)
+        with profiling.stage("render"):
+            if export_fig:
+                plt.savefig(export_fig)
+            plt.show()
+
+    if export_data:
+        export.write_matrix(
+            export_data,
+            z,
+            y,
+            q,
+            y_label,
+            "q",
+            "Intensity",
+        )
+
 
+@profiling.timed("plot.compare_peak_fe")
 def compare_peak_fe(
     dataset: LoadData,
     x_min: float,
@@ -138,12 +215,27 @@ def compare_peak_fe(
     axis_x_min: Union[bool, int] = False,
     axis_x_max: Union[bool, int] = False,
     export_table: Union[bool, str] = False,
+    n_workers: Optional[int] = None,
+    background: Any = None,
+    peak_stat: str = "max",
+    model: str = "pseudo_voigt",
+    align_fe: bool = False,
 ) -> None:
     """
     Function to plot the X-ray intensity and the Faradaic efficiency for H2 and C2H4 (for Cu) or CO (For Ag).
 
     This function also includes a built-in smoothing function for the X-ray data and the ability to export the X-ray
-    data and the FE into an excel file.
+    data and the FE into a table (Excel, CSV, Parquet, ..., see the export module). The peak heights of all positions in
+    position_range are extracted in a single pass over the scans, optionally spread over n_workers threads. If
+    background is given, that background reference ("first", K or a (first, last) scan number range, see
+    LoadData.get_background) is subtracted from the spectra.
+
+    With peak_stat other than "max", a peak of the given model ("gaussian", "lorentzian" or "pseudo_voigt") is fitted
+    in the q range instead and the average of that fit parameter ("height", "center", "fwhm", "area", ...) is plotted,
+    see LoadData.get_peak_fits. The fits are not smoothed.
+
+    The exported table holds the X-ray and GC series side by side. With align_fe, it has one row per scan instead, with
+    the Faradaic efficiencies of the GC sample closest in time to the scan (see faradaic.align_fe).
     """
     fl_num = int(dataset.fl_num)
     height_group = dataset.height_group
@@ -151,20 +243,42 @@ def compare_peak_fe(
     if isinstance(position_range, int):
         position_range = [position_range]
 
-    # Collect data for all positions
-    dfs_xray = []
-    for pos in range(position_range[0], position_range[-1] + 1):
-        dfs_xray.append(
-            aux.get_peak_height_time(
-                dataset, x_min, x_max, pos, smoothing_window, n_pol
-            )
+    # Collect data for all positions in a single pass over the scans
+    positions = list(range(position_range[0], position_range[-1] + 1))
+    if peak_stat == "max":
+        df_xray = aux.get_peak_height_time_multi(
+            dataset,
+            x_min,
+            x_max,
+            positions,
+            smoothing_window,
+            n_pol,
+            n_workers=n_workers,
+            background=background,
+        )
+        xray_label = "peak height"
+        y_label = "Intensity"
+    else:
+        fits = dataset.get_peak_fits(
+            x_min,
+            x_max,
+            model,
+            positions=positions,
+            background=background,
+            n_workers=n_workers,
         )
+        df_xray = pd.DataFrame(fits[peak_stat], columns=positions)
+        df_xray.insert(0, "time", dataset.get_scan_times())
+        xray_label = f"fitted peak {peak_stat}"
+        y_label = f"Fitted peak {peak_stat}"
 
     # Average the data
-    avg_df_xray = dfs_xray[0].copy()
-    for df in dfs_xray[1:]:
-        avg_df_xray["peak height"] += df["peak height"]
-    avg_df_xray["peak height"] /= len(dfs_xray)
+    avg_df_xray = pd.DataFrame(
+        {
+            "time": df_xray["time"],
+            "peak height": df_xray[positions].to_numpy().mean(axis=1),
+        }
+    )
 
     df_fe = aux.get_fe(path_gc_excel)
     x_0 = df_fe["time"][0]
@@ -176,14 +290,14 @@ def compare_peak_fe(
     ax1.minorticks_on()
     ax1.tick_params(axis="y", which="both", colors=y1_axis_color)
     ax1.set_xlabel("Time (min)")
-    ax1.set_ylabel("Intensity", color=y1_axis_color)
+    ax1.set_ylabel(y_label, color=y1_axis_color)
     ax1.tick_params(axis="y", colors=y1_axis_color)
     ax1.spines["left"].set_color(y1_axis_color)
     ax1.plot(
         (avg_df_xray["time"] - x_0) / 60,
         avg_df_xray["peak height"],
         color=y1_axis_color,
-        label="Average X-ray peak height",
+        label=f"Average X-ray {xray_label}",
     )
     if axis_y_min is not False and axis_y_max is not False:
         ax1.set_ylim(axis_y_min, axis_y_max)
@@ -213,28 +327,35 @@ def compare_peak_fe(
 
     # Export the table for further plotting
     if export_table is not False:
-        len_xray = len(avg_df_xray)
-        len_fe = len(df_fe)
-
-        max_len = max(len_xray, len_fe)
-
-        if len_xray < max_len:
-            avg_df_xray = avg_df_xray.reindex(range(max_len))
-        if len_fe < max_len:
-            df_fe = df_fe.reindex(range(max_len))
-
+        if align_fe:
+            # One row per scan, with the GC sample closest in time
+            df_fe = faradaic.align_fe(avg_df_xray["time"].to_numpy(), df_fe)
+            time_adjusted = (df_fe["fe_time"] - x_0) / 60
+        else:
+            len_xray = len(avg_df_xray)
+            len_fe = len(df_fe)
+
+            max_len = max(len_xray, len_fe)
+
+            if len_xray < max_len:
+                avg_df_xray = avg_df_xray.reindex(range(max_len))
+            if len_fe < max_len:
+                df_fe = df_fe.reindex(range(max_len))
+
+        export_label = "peak intensity" if peak_stat == "max" else xray_label
         df_export = pd.DataFrame(
             {
                 "X-ray time/min": (avg_df_xray["time"] - x_0) / 60,
-                "Average X-ray peak intensity": avg_df_xray["peak height"],
+                f"Average X-ray {export_label}": avg_df_xray["peak height"],
                 "FE_time/min": time_adjusted,
                 "FE_H2 / %": df_fe["H2"] * 100,
             }
         )
         df_export[f"FE_{compare_product} / %"] = df_fe[compare_product] * 100
-        df_export.to_excel(export_table, index=False)
+        export.write_table(df_export, export_table)
 
 
+@profiling.timed("plot.peak_span")
 def peak_span(
     dataset: LoadData,
     x_min: float,
@@ -250,8 +371,8 @@ def peak_span(
     :param x_min: minimum q-range of the plotting window.
     :param x_max: maximum q-range of the plotting window.
     :param position: position of the scan.
-    :param n_plot: number of plot to be overlayed. :export_table: if given, a path to export an Excel file containing
-        peak information.
+    :param n_plot: number of plot to be overlayed. :export_table: if given, a path to export the peak information to,
+        in the format of its extension (see the export module).
     """
 
     def select_frames(frame_list: List[int], n: int) -> List[int]:
@@ -302,12 +423,10 @@ def peak_span(
     ax.minorticks_on()
     df_export = pd.DataFrame()
     for frame in selected_frames:
-        df_frame = aux.export_spectrum(data=dataset, scan_num=frame, position=position)
-        idx = [
-            i
-            for i in range(0, len(df_frame))
-            if df_frame["q"][i] > x_min and df_frame["q"][i] < x_max
-        ]
+        df_frame = aux.export_spectrum(
+            data=dataset, scan_num=frame, position=position, x_min=x_min, x_max=x_max
+        )
+        idx = df_frame.index[(df_frame["q"] > x_min) & (df_frame["q"] < x_max)]
         plt.plot(
             df_frame["q"][idx],
             df_frame["count"][idx],
@@ -325,9 +444,10 @@ def peak_span(
     plt.ylabel("count")
 
     if export_table is not False:
-        df_export.to_excel(export_table, index=False)
+        export.write_table(df_export, export_table)
 
 
+@profiling.timed("plot.vertical_compare")
 def vertical_compare(
     dataset: LoadData,
     x_min: float,
@@ -343,7 +463,8 @@ def vertical_compare(
     :param x_min: Minimum q-value for the selection window.
     :param x_max: Maximum q-value for the selection window.
     :param scan_number: Scan number(s) to be included in the plot (can be a single value or a list).
-    :param export_table: If provided, path to export an Excel file containing the plotted data.
+    :param export_table: If provided, path to export the plotted data to, in the format of its extension (see the
+        export module).
     """
     # Convert single scan number to a list if it's not already a list
     if isinstance(scan_number, int):
@@ -355,17 +476,22 @@ def vertical_compare(
     # Loop through each scan number
     for scan in scan_number:
         # Retrieve the intensity data for the given scan number
+        X = aux.get_data(
+            fl=dataset.fl_integrated, dataset_path=f"{scan}.1/p3_integrate/integrated/q"
+        )
+        # Only the q window of all positions is read
+        window = aux.get_q_window(X, x_min, x_max)
         Y = aux.get_data(
             fl=dataset.fl_integrated,
             dataset_path=f"{scan}.1/p3_integrate/integrated/intensity",
-        )
-        X = aux.get_data(
-            fl=dataset.fl_integrated, dataset_path=f"{scan}.1/p3_integrate/integrated/q"
+            selection=np.s_[:, window],
         )
 
         # Find the peak height for each position within the q-range
-        for pos in range(len(Y)):
-            peak_height = aux.find_peak_height(X=X, Y=Y[pos], x_min=x_min, x_max=x_max)
+        peak_heights = aux.find_peak_stats(
+            X[window], Y, (x_min, x_max), stats=("max",)
+        )["max"]
+        for pos, peak_height in enumerate(peak_heights):
             if pos in peak_heights_dict:
                 peak_heights_dict[pos].append(peak_height)
             else:
@@ -391,11 +517,227 @@ def vertical_compare(
     plt.title(
         f"Exp: {dataset.fl_num}, height group: {dataset.height_group},peak range=[{x_min},{x_max}], scan_num = {scan_number}"
     )
-    plt.show()
+    with profiling.stage("render"):
+        plt.show()
 
     # Export the data to an Excel file if requested
     if export_table:
         df_export = pd.DataFrame(
             {"Position": positions, "Average Peak Height": avg_peak_heights}
         )
-        df_export.to_excel(export_table, index=False)
+        export.write_table(df_export, export_table)
+
+
+class _LivePlot(abc.ABC):
+    """Base class of the plots that follow an experiment while its files are still being written."""
+
+    def __init__(self, dataset: LoadData, x_min: float, x_max: float):
+        self.dataset = dataset
+        self.x_min = x_min
+        self.x_max = x_max
+        self._frames: List[int] = []
+        self._times = aux.AppendableArray()
+        self._values = aux.AppendableArray()
+
+    def _read_new_scans(
+        self, positions: Optional[List[int]] = None
+    ) -> Tuple[List[int], bool]:
+        """
+        Refresh the dataset and append the peak heights and times of the new scans.
+
+        Returns the new scan numbers and whether the whole series was rebuilt.
+        """
+        try:
+            return self._append_new_scans(positions)
+        finally:
+            # Do not hold the files open between updates, so the writer is not blocked
+            aux.close_files(self.dataset.fl_raw)
+            aux.close_files(self.dataset.fl_integrated)
+
+    def _append_new_scans(
+        self, positions: Optional[List[int]]
+    ) -> Tuple[List[int], bool]:
+        self.dataset.refresh()
+        frames = list(self.dataset.height_group_frame)
+        # Several live plots can share a dataset, so the scans already drawn are tracked per plot
+        rebuilt = frames[: len(self._frames)] != self._frames
+        if rebuilt:
+            self._frames = []
+            self._times = aux.AppendableArray()
+            self._values = aux.AppendableArray()
+        new_frames = frames[len(self._frames) :]
+        if not new_frames:
+            return [], False
+        self._frames = frames
+        q, cube = self.dataset.get_intensity_cube()
+        cube_new = cube[-len(new_frames) :]
+        if positions is not None:
+            # Positions that do not exist (yet) are NaN, as in compare_peak_fe
+            positions = np.asarray(positions, dtype=int)
+            inside = positions < cube_new.shape[1]
+            selected = np.full(
+                (len(cube_new), len(positions), cube_new.shape[2]),
+                np.nan,
+                dtype=np.result_type(cube_new.dtype, np.float32),
+            )
+            selected[:, inside] = cube_new[:, positions[inside]]
+            cube_new = selected
+        peak_heights = aux.find_peak_stats(
+            q, cube_new, (self.x_min, self.x_max), stats=("max",)
+        )["max"]
+        self._values.append(peak_heights)
+        self._times.append(self.dataset.scan_index.get("start_time", new_frames))
+        return new_frames, rebuilt
+
+    @abc.abstractmethod
+    def update(self) -> List[int]:
+        """Add the scans measured since the previous update to the plot and return their scan numbers."""
+
+    def follow(self, interval: float = 60, max_updates: Optional[int] = None) -> None:
+        """
+        Update the plot every interval seconds until max_updates updates were made or the loop is interrupted.
+
+        :param interval: Time between two updates in seconds.
+        :param max_updates: Number of updates after which to stop. If None, follow until interrupted.
+        """
+        n_updates = 0
+        try:
+            while max_updates is None or n_updates < max_updates:
+                plt.pause(interval)
+                self.update()
+                n_updates += 1
+        except KeyboardInterrupt:
+            pass
+
+
+class LiveHeatmap(_LivePlot):
+    """
+    A peak height heatmap, as drawn by heatmap, that follows an experiment during a beamtime.
+
+    Every update picks up the scans appended to the raw and integrated files since the previous update through
+    LoadData.refresh and only computes the peak heights of those scans. The rows of the scans seen before are kept.
+    The data drawn by the last update is available as a HeatmapData object in the data attribute.
+
+    :param dataset: Dataset object of the associated experiment.
+    :param min_range: Minimum range of q values.
+    :param max_range: Maximum range of q values.
+    :param display_rxn_time: If True, display reaction time. If False, display scan number.
+    :param lower_limit: Minimum intensity value to display in the heatmap.
+    :param upper_limit: Maximum intensity value to display in the heatmap.
+    """
+
+    def __init__(
+        self,
+        dataset: LoadData,
+        min_range: float,
+        max_range: float,
+        display_rxn_time: bool = False,
+        lower_limit: float = None,
+        upper_limit: float = None,
+    ):
+        super().__init__(dataset, min_range, max_range)
+        self.display_rxn_time = display_rxn_time
+        self._scans = aux.AppendableArray()
+        self.data: Optional[HeatmapData] = None
+        self._clim = (lower_limit, upper_limit)
+        self.fig, self.ax = plt.subplots()
+        self.image = self.ax.imshow(
+            np.full((1, 1), np.nan),
+            origin="lower",
+            aspect="auto",
+            cmap="RdYlBu",
+            interpolation="nearest",
+            vmin=lower_limit,
+            vmax=upper_limit,
+        )
+        self.fig.colorbar(self.image, label="Maximum peak height")
+        self.ax.set_xlabel("Time (min)" if display_rxn_time else "Scan number")
+        self.ax.set_ylabel("Position")
+        self.ax.set_title(
+            f"Exp: {dataset.fl_num}, height group: {dataset.height_group}, "
+            f"q range = [{min_range:.4f},{max_range:.4f}]",
+            size=11,
+        )
+        self.ax.minorticks_on()
+        self.update()
+
+    def update(self) -> List[int]:
+        new_frames, rebuilt = self._read_new_scans()
+        if not new_frames:
+            return []
+        if rebuilt:
+            self._scans = aux.AppendableArray()
+        self._scans.append(np.asarray(new_frames, dtype=float))
+
+        self.data = HeatmapData(
+            self._values.view,
+            self._scans.view,
+            times=self._times.view,
+            dataset=self.dataset,
+            q_range=(self.x_min, self.x_max),
+        )
+        z = self.data.values
+        y, _ = self.data.scan_axis(self.display_rxn_time)
+        self.image.set_data(z.T)
+        self.image.set_extent(self.data.extent(self.display_rxn_time))
+        lower_limit, upper_limit = self._clim
+        if lower_limit is None or upper_limit is None:
+            z_min, z_max = np.nanmin(z), np.nanmax(z)
+            self.image.set_clim(
+                z_min if lower_limit is None else lower_limit,
+                z_max if upper_limit is None else upper_limit,
+            )
+        self.ax.set_xlim(y.min(), y.max())
+        self.ax.set_ylim(0, z.shape[1])
+        self.fig.canvas.draw_idle()
+        return new_frames
+
+
+class LivePeakTime(_LivePlot):
+    """
+    The peak height averaged over a range of positions as a function of time, following an experiment during a
+    beamtime.
+
+    Every update only computes the peak heights of the scans appended since the previous update.
+
+    :param dataset: Dataset object of the associated experiment.
+    :param x_min: Minimum q-value of the peak window.
+    :param x_max: Maximum q-value of the peak window.
+    :param position_range: A position, or the first and last position of a range of positions to average over.
+    """
+
+    def __init__(
+        self,
+        dataset: LoadData,
+        x_min: float,
+        x_max: float,
+        position_range: Union[int, List[int]],
+    ):
+        super().__init__(dataset, x_min, x_max)
+        if isinstance(position_range, int):
+            position_range = [position_range]
+        self.positions = list(range(position_range[0], position_range[-1] + 1))
+        self.fig, self.ax = plt.subplots()
+        (self.line,) = self.ax.plot(
+            [], [], color="royalblue", label="Average X-ray peak height"
+        )
+        self.ax.minorticks_on()
+        self.ax.set_xlabel("Time (min)")
+        self.ax.set_ylabel("Intensity")
+        self.ax.legend(loc=2)
+        self.ax.set_title(
+            f"Exp: {dataset.fl_num}, height group: {dataset.height_group},"
+            f"peak range=[{x_min},{x_max}], pos. = {position_range}"
+        )
+        self.update()
+
+    def update(self) -> List[int]:
+        new_frames, _ = self._read_new_scans(self.positions)
+        if not new_frames:
+            return []
+        times = self._times.view
+        self.line.set_data((times - times[0]) / 60, self._values.view.mean(axis=1))
+        self.ax.relim()
+        self.ax.autoscale_view()
+        self.fig.canvas.draw_idle()
+        return new_frames
@@ -0,0 +1,242 @@
+"""This module contains the opt-in instrumentation of the hot paths of the package.
+
+While a profiler is active, the hdf5 layer counts file opens, bytes read and datasets touched, and the analysis and
+plotting functions time their stages. A profiler is activated with the profile context manager:
+
+    with profiling.profile(chrome_trace="trace.json") as prof:
+        plot.heatmap(dataset, 1.9, 2.1)
+    prof.report()
+
+or for a whole process by setting the environment variable TWAXS_PROFILE to the path of a JSON report, which is written
+at exit (TWAXS_PROFILE_TRACE optionally gives the path of a Chrome trace). Worker processes started by the profiled
+process write their own report next to it, with their process id in the file name (e.g. report.1234.json). When no
+profiler is active, every hook returns after a single global lookup.
+"""
+
+import os
+import json
+import time
+import atexit
+import threading
+import functools
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+_ACTIVE: Optional["Profiler"] = None
+
+
+class Profiler:
+    """Collects hdf5 counters, stage timings and trace events."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._stop: Optional[float] = None
+        self.h5_opens: Dict[str, int] = {}
+        self.bytes_read = 0
+        self.datasets_read = 0
+        self.datasets: Dict[str, int] = {}
+        self.stages: Dict[str, List[float]] = {}
+        self.events: List[Dict[str, Any]] = []
+
+    def add_open(self, fl: str) -> None:
+        with self._lock:
+            self.h5_opens[fl] = self.h5_opens.get(fl, 0) + 1
+
+    def add_read(self, dataset_path: str, nbytes: int) -> None:
+        with self._lock:
+            self.bytes_read += int(nbytes)
+            self.datasets_read += 1
+            self.datasets[dataset_path] = self.datasets.get(dataset_path, 0) + 1
+
+    def add_stage(self, name: str, start: float, end: float) -> None:
+        with self._lock:
+            timing = self.stages.setdefault(name, [0, 0.0])
+            timing[0] += 1
+            timing[1] += end - start
+            self.events.append(
+                {
+                    "name": name,
+                    "ph": "X",
+                    "ts": (start - self._start) * 1e6,
+                    "dur": (end - start) * 1e6,
+                    "pid": os.getpid(),
+                    "tid": threading.get_ident(),
+                }
+            )
+
+    def report(self) -> Dict[str, Any]:
+        """
+        Get the collected measurements as a JSON-serializable dictionary.
+
+        Stage times are inclusive: a stage that runs inside another one is counted in both.
+        """
+        end = self._stop if self._stop is not None else time.perf_counter()
+        with self._lock:
+            return {
+                "wall_time_s": end - self._start,
+                "h5": {
+                    "opens": sum(self.h5_opens.values()),
+                    "opens_by_file": dict(self.h5_opens),
+                    "bytes_read": self.bytes_read,
+                    "datasets_read": self.datasets_read,
+                    "unique_datasets": len(self.datasets),
+                },
+                "stages": {
+                    name: {
+                        "calls": calls,
+                        "total_s": total,
+                        "mean_s": total / calls,
+                    }
+                    for name, (calls, total) in sorted(
+                        self.stages.items(), key=lambda item: -item[1][1]
+                    )
+                },
+            }
+
+    def write_report(self, path: str) -> None:
+        """Write the report as JSON."""
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+    def write_chrome_trace(self, path: str) -> None:
+        """Write the stage timings in the Chrome trace event format (chrome://tracing, Perfetto)."""
+        with self._lock:
+            events = list(self.events)
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+class _Stage:
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler: Profiler, name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.profiler.add_stage(self.name, self.start, time.perf_counter())
+
+
+class _NoStage:
+    __slots__ = ()
+
+    def __enter__(self) -> None:
+        pass
+
+    def __exit__(self, *exc_info: Any) -> None:
+        pass
+
+
+_NO_STAGE = _NoStage()
+
+
+def stage(name: str) -> Any:
+    """Return a context manager that times the enclosed block as the stage name if a profiler is active."""
+    if _ACTIVE is None:
+        return _NO_STAGE
+    return _Stage(_ACTIVE, name)
+
+
+def timed(name: str) -> Callable:
+    """Decorator that times every call of the decorated function as the stage name if a profiler is active."""
+
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if _ACTIVE is None:
+                return func(*args, **kwargs)
+            with _Stage(_ACTIVE, name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def record_open(fl: str) -> None:
+    """Count the opening of the hdf5 file fl."""
+    if _ACTIVE is not None:
+        _ACTIVE.add_open(fl)
+
+
+def record_read(dataset_path: str, nbytes: int) -> None:
+    """Count a read of nbytes bytes from the hdf5 dataset dataset_path."""
+    if _ACTIVE is not None:
+        _ACTIVE.add_read(dataset_path, nbytes)
+
+
+def get_profiler() -> Optional[Profiler]:
+    """Return the active profiler, or None if profiling is disabled."""
+    return _ACTIVE
+
+
+@contextmanager
+def profile(
+    report: Optional[str] = None, chrome_trace: Optional[str] = None
+) -> Iterator[Profiler]:
+    """
+    Profile the enclosed block.
+
+    Parameters:
+    report (str, optional): Path to write the JSON report to when the block exits.
+    chrome_trace (str, optional): Path to write a Chrome trace of the stages to when the block exits.
+
+    Returns:
+    Profiler: The profiler, whose report method gives the measurements as a dictionary.
+    """
+    global _ACTIVE
+    previous = _ACTIVE
+    profiler = Profiler()
+    _ACTIVE = profiler
+    try:
+        yield profiler
+    finally:
+        profiler._stop = time.perf_counter()
+        _ACTIVE = previous
+        if report:
+            profiler.write_report(report)
+        if chrome_trace:
+            profiler.write_chrome_trace(chrome_trace)
+
+
+def _process_path(path: str) -> str:
+    """The path of the report of this process: path itself in the profiled process, with the pid in its children."""
+    if os.environ.get("TWAXS_PROFILE_PID") == str(os.getpid()):
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{os.getpid()}{ext}"
+
+
+def _profile_from_environment(forked: bool = False) -> None:
+    global _ACTIVE
+    report = os.environ.get("TWAXS_PROFILE")
+    if not report:
+        return
+    # Inherited by the worker processes, which write their reports to their own files
+    os.environ.setdefault("TWAXS_PROFILE_PID", str(os.getpid()))
+    profiler = Profiler()
+    _ACTIVE = profiler
+    chrome_trace = os.environ.get("TWAXS_PROFILE_TRACE")
+
+    def write() -> None:
+        profiler._stop = time.perf_counter()
+        profiler.write_report(_process_path(report))
+        if chrome_trace:
+            profiler.write_chrome_trace(_process_path(chrome_trace))
+
+    from multiprocessing.util import Finalize, register_after_fork
+
+    if forked:
+        # Forked workers leave with os._exit, which skips atexit but runs the multiprocessing finalizers
+        Finalize(None, write, exitpriority=0)
+    else:
+        atexit.register(write)
+    # A forked worker starts its own profiler instead of the copy of the measurements of its parent
+    register_after_fork(profiler, lambda _: _profile_from_environment(forked=True))
+
+
+_profile_from_environment()
@@ -0,0 +1,244 @@
+"""This module contains the library of reference diffraction patterns used to identify phases.
+
+A reference folder holds one Excel file per pattern (e.g. exported from ICSD or COD) with the columns "2θ [°]" and
+"I [%]". The patterns of a folder are read into a single ReferenceLibrary, which keeps the 2θ angles and intensities of
+all patterns in flat arrays indexed by pattern. The q positions are computed from the angles when they are asked for,
+so the intensity threshold and the wavelength of the references can be changed without reading the files again.
+
+The library of a folder is kept for the lifetime of the process and, if a cache_dir is given, stored there as a single
+.npz file. Only the files that were added or changed since (by modification time and size) are read again.
+"""
+
+import os
+import hashlib
+import threading
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+from . import auxiliary as aux
+from . import profiling
+
+LIBRARY_FORMAT = 1
+# The Cu K alpha wavelength (Angstrom) that the 2θ values of the reference files refer to
+DEFAULT_WAVELENGTH = 1.5406
+
+
+def read_reference_file(path: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Read the 2θ angles (degree) and relative intensities (%) of a reference pattern file."""
+    with profiling.stage("read_excel"):
+        df_xray = pd.read_excel(path)
+    two_theta = pd.to_numeric(df_xray["2θ [°]"], errors="coerce").to_numpy(float)
+    intensity = pd.to_numeric(df_xray["I [%]"], errors="coerce").to_numpy(float)
+    return two_theta, intensity
+
+
+class ReferenceLibrary:
+    """
+    The reference patterns of a folder, stored as flat arrays.
+
+    The peaks of pattern i are two_theta[offsets[i]:offsets[i + 1]] and intensity[offsets[i]:offsets[i + 1]], and
+    wavelength[i] is the wavelength its 2θ angles refer to.
+    """
+
+    def __init__(
+        self,
+        names: Sequence[str],
+        offsets: np.ndarray,
+        two_theta: np.ndarray,
+        intensity: np.ndarray,
+        wavelength: Optional[np.ndarray] = None,
+        signatures: Optional[np.ndarray] = None,
+    ):
+        self.names = list(names)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.two_theta = np.asarray(two_theta, dtype=float)
+        self.intensity = np.asarray(intensity, dtype=float)
+        if wavelength is None:
+            wavelength = np.full(len(self.names), DEFAULT_WAVELENGTH)
+        self.wavelength = np.asarray(wavelength, dtype=float)
+        if signatures is None:
+            signatures = np.zeros((len(self.names), 2), dtype=np.int64)
+        self.signatures = np.asarray(signatures, dtype=np.int64).reshape(-1, 2)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @property
+    def pattern_ids(self) -> np.ndarray:
+        """The pattern number of every peak of the flat arrays."""
+        return np.repeat(np.arange(len(self)), np.diff(self.offsets))
+
+    def index(self, name: str) -> int:
+        """Return the number of the pattern of a file name, without its extension."""
+        try:
+            return self.names.index(name)
+        except ValueError:
+            raise KeyError(
+                f"Reference pattern {name} not found in the library."
+            ) from None
+
+    def peaks(
+        self, threshold: float = 10, wavelength: Optional[float] = None
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Get the peaks of all patterns with an intensity of at least threshold.
+
+        Parameters:
+        threshold (float): The minimum relative intensity (%) of a peak.
+        wavelength (float, optional): The wavelength the 2θ angles of all patterns refer to. Defaults to the wavelength
+        of every pattern.
+
+        Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: The pattern number, q position and relative intensity of every peak,
+        ordered by pattern and, within a pattern, as in its file.
+        """
+        selected = self.intensity >= threshold
+        pattern_ids = self.pattern_ids[selected]
+        if wavelength is None:
+            wavelength = self.wavelength[pattern_ids]
+        q = aux.twotheta2q(self.two_theta[selected], wavelength)
+        return pattern_ids, q, self.intensity[selected]
+
+    def patterns(
+        self, threshold: float = 10, wavelength: Optional[float] = None
+    ) -> List[np.ndarray]:
+        """Get the q positions of the peaks with an intensity of at least threshold, one array per pattern."""
+        pattern_ids, q, _ = self.peaks(threshold, wavelength)
+        bounds = np.searchsorted(pattern_ids, np.arange(len(self) + 1))
+        return [q[bounds[i] : bounds[i + 1]] for i in range(len(self))]
+
+    def save(self, path: str) -> None:
+        """Write the library to a .npz file."""
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(
+            tmp_path,
+            format=LIBRARY_FORMAT,
+            names=np.array(self.names, dtype=str),
+            offsets=self.offsets,
+            two_theta=self.two_theta,
+            intensity=self.intensity,
+            wavelength=self.wavelength,
+            signatures=self.signatures,
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["ReferenceLibrary"]:
+        """Read a library written by save, or return None if the file is of another format."""
+        with np.load(path) as data:
+            if "format" not in data.files or int(data["format"]) != LIBRARY_FORMAT:
+                return None
+            return cls(
+                [str(name) for name in data["names"]],
+                data["offsets"],
+                data["two_theta"],
+                data["intensity"],
+                data["wavelength"],
+                data["signatures"],
+            )
+
+
+def _library_path(cache_dir: str, folder: str) -> Path:
+    digest = hashlib.sha1(folder.encode("utf-8")).hexdigest()[:16]
+    return Path(cache_dir) / f"{Path(folder).name}_{digest}.refs.npz"
+
+
+def _build_library(
+    folder: str, files: List[str], previous: Optional[ReferenceLibrary]
+) -> ReferenceLibrary:
+    """Build the library of files, taking the patterns of the unchanged files from the previous library."""
+    reused: Dict[str, tuple] = {}
+    if previous is not None:
+        for i, name in enumerate(previous.names):
+            start, stop = previous.offsets[i], previous.offsets[i + 1]
+            reused[name] = (
+                tuple(previous.signatures[i]),
+                previous.two_theta[start:stop],
+                previous.intensity[start:stop],
+            )
+
+    names, signatures, two_theta, intensity = [], [], [], []
+    for file in files:
+        path = os.path.join(folder, file)
+        name = os.path.splitext(file)[0]
+        signature = aux.file_signature(path)
+        if name in reused and reused[name][0] == signature:
+            _, pattern_two_theta, pattern_intensity = reused[name]
+        else:
+            pattern_two_theta, pattern_intensity = read_reference_file(path)
+        names.append(name)
+        signatures.append(signature)
+        two_theta.append(pattern_two_theta)
+        intensity.append(pattern_intensity)
+
+    offsets = np.zeros(len(names) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(values) for values in two_theta])
+    return ReferenceLibrary(
+        names,
+        offsets,
+        np.concatenate(two_theta) if two_theta else np.empty(0),
+        np.concatenate(intensity) if intensity else np.empty(0),
+        signatures=np.array(signatures, dtype=np.int64).reshape(-1, 2),
+    )
+
+
+def _is_current(
+    library: Optional[ReferenceLibrary], names: List[str], signatures: np.ndarray
+) -> bool:
+    """Whether a library holds exactly the given files, unchanged."""
+    return (
+        library is not None
+        and library.names == names
+        and np.array_equal(library.signatures, signatures)
+    )
+
+
+_LIBRARY_CACHE: Dict[str, ReferenceLibrary] = {}
+_LIBRARY_LOCK = threading.Lock()
+
+
+def get_reference_library(
+    folder: str, cache_dir: Optional[str] = None
+) -> ReferenceLibrary:
+    """
+    Get the library of the reference pattern files (.xlsx) of a folder, in the order of their file names.
+
+    The files are read once and the library is kept for the lifetime of the process, and stored in cache_dir if it is
+    given. Files that were added or changed since are read again, and removed files are dropped.
+
+    Parameters:
+    folder (str): The folder of the reference pattern files.
+    cache_dir (str, optional): A directory to store the library in, so that other processes do not read the files.
+
+    Returns:
+    ReferenceLibrary: The library.
+    """
+    folder = os.path.abspath(folder)
+    files = sorted(file for file in os.listdir(folder) if file.endswith(".xlsx"))
+    names = [os.path.splitext(file)[0] for file in files]
+    signatures = np.array(
+        [aux.file_signature(os.path.join(folder, file)) for file in files],
+        dtype=np.int64,
+    ).reshape(-1, 2)
+
+    with _LIBRARY_LOCK:
+        library = _LIBRARY_CACHE.get(folder)
+    library_path = None
+    stored = None
+    if cache_dir is not None:
+        library_path = _library_path(cache_dir, folder)
+        if library_path.exists():
+            stored = ReferenceLibrary.load(library_path)
+        if library is None:
+            library = stored
+
+    if not _is_current(library, names, signatures):
+        library = _build_library(folder, files, library)
+    # The file is also written when the library was built by an earlier call without cache_dir
+    if library_path is not None and not _is_current(stored, names, signatures):
+        os.makedirs(cache_dir, exist_ok=True)
+        library.save(library_path)
+    with _LIBRARY_LOCK:
+        _LIBRARY_CACHE[folder] = library
+    return library
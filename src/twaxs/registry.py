@@ -0,0 +1,95 @@
+"""This module contains the registry of experiments read from an experiment information sheet.
+
+The sheet has one row per experiment with the columns read by LoadData.get_fl_detail ("Experimental number",
+"Integrated file directory", "Raw file directory", ...). It is parsed once per process and kept until the file changes,
+so that creating LoadData objects for many experiments and height groups does not re-read the workbook every time.
+"""
+
+import os
+import pandas as pd
+from typing import Any, Dict, Iterator, List, Optional
+from . import auxiliary as aux
+from . import profiling
+
+
+def read_sheet(path: str) -> pd.DataFrame:
+    """Read a sheet from a CSV (.csv) or Parquet (.parquet) file, or from an Excel file for any other extension."""
+    path = str(path)
+    suffix = os.path.splitext(path)[1].lower()
+    with profiling.stage("read_excel"):
+        if suffix == ".csv":
+            return pd.read_csv(path)
+        if suffix == ".parquet":
+            return pd.read_parquet(path)
+        return pd.read_excel(path)
+
+
+class ExperimentRegistry:
+    """
+    The rows of an experiment information sheet, indexed by "Experimental number".
+
+    If an experimental number appears more than once, the first row is used, as LoadData.get_fl_detail did.
+    """
+
+    def __init__(self, frame: pd.DataFrame, path: Optional[str] = None):
+        self.frame = frame
+        self.path = path
+        self._columns = {name: frame[name].to_numpy() for name in frame.columns}
+        self._rows: Dict[int, int] = {}
+        for i, fl_num in enumerate(self._columns["Experimental number"]):
+            if not pd.isna(fl_num):
+                self._rows.setdefault(int(fl_num), i)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, fl_num: int) -> bool:
+        return int(fl_num) in self._rows
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._rows)
+
+    @property
+    def numbers(self) -> List[int]:
+        """The experimental numbers in the order of the sheet."""
+        return list(self._rows)
+
+    @property
+    def columns(self) -> List[str]:
+        return list(self._columns)
+
+    def get(self, fl_num: int) -> Dict[str, Any]:
+        """
+        Get the row of an experiment as a dictionary of column name to value.
+
+        Raises:
+        ValueError: If the experimental number is not in the sheet.
+        """
+        try:
+            i = self._rows[int(fl_num)]
+        except KeyError:
+            raise ValueError(
+                f"Experimental number {fl_num} not found in the data."
+            ) from None
+        return {name: values[i] for name, values in self._columns.items()}
+
+    @classmethod
+    def from_file(cls, path: str) -> "ExperimentRegistry":
+        """Read a sheet from an Excel file, or from a CSV or Parquet file with the same columns."""
+        return cls(read_sheet(path), str(path))
+
+
+_REGISTRY_CACHE = aux.FileCache()
+
+
+def get_registry(path: str) -> ExperimentRegistry:
+    """
+    Get the registry of an experiment information sheet, parsed once per process (see auxiliary.FileCache).
+
+    Parameters:
+    path (str): The path of the Excel, CSV (.csv) or Parquet (.parquet) file.
+
+    Returns:
+    ExperimentRegistry: The registry of the sheet.
+    """
+    return _REGISTRY_CACHE.get(path, ExperimentRegistry.from_file)
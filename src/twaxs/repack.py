@@ -0,0 +1,200 @@
+"""This module consolidates an experiment into a single analysis hdf5 file.
+
+The integrated files written at the beamline hold one group per scan, so reading one position or one q window of all
+scans of a height group touches every group of the file. The analysis file holds, for every height group of the
+experiment:
+
+- "height_group/<g>/intensity": a contiguous (scan x position x q) dataset, chunked along the scans and q and
+  compressed, so that a q window is read without decompressing the whole spectra,
+- "height_group/<g>/q": the q axis,
+- "height_group/<g>/scan", "height_group/<g>/time" and "height_group/<g>/height": the scan numbers, start times (epoch
+  seconds) and motor heights of the scans.
+
+The attributes of the root group record the source files, their modification times and sizes, the macro range and the
+motors, so that LoadData only uses an analysis file that still matches its experiment. The file is written next to the
+integrated file (see analysis_path), where LoadData finds it without further arguments. It is written with:
+
+    twaxs repack info.xlsx 1
+"""
+
+import os
+import numpy as np
+from typing import Any, Dict, Optional
+from . import auxiliary as aux
+from . import profiling
+
+ANALYSIS_FORMAT = 1
+
+
+def analysis_path(fl_integrated: str, fl_num: int) -> str:
+    """Return the default path of the analysis file of an experiment, next to its integrated file."""
+    root, _ = os.path.splitext(os.path.abspath(fl_integrated))
+    return f"{root}_exp{fl_num}_analysis.h5"
+
+
+def _resolve_compression(compression: Optional[str]) -> Optional[str]:
+    """Resolve "auto" to "blosc" if hdf5plugin is installed and to "gzip" otherwise."""
+    if compression != "auto":
+        return compression
+    try:
+        import hdf5plugin  # noqa: F401
+
+        return "blosc"
+    except ImportError:
+        return "gzip"
+
+
+def _compression_options(compression: Optional[str]) -> Dict[str, Any]:
+    """Return the h5py create_dataset options of a codec: "blosc" (LZ4 in Blosc, requires hdf5plugin) or "gzip"."""
+    if compression == "blosc":
+        try:
+            import hdf5plugin
+        except ImportError:
+            raise ImportError(
+                "The hdf5plugin package is required for Blosc compression."
+            ) from None
+        return dict(
+            hdf5plugin.Blosc(cname="lz4", clevel=5, shuffle=hdf5plugin.Blosc.SHUFFLE)
+        )
+    if compression == "gzip":
+        return dict(compression="gzip", compression_opts=1, shuffle=True)
+    if compression is None:
+        return {}
+    raise ValueError(f"Unknown compression: {compression}")
+
+
+def _experiment_attrs(dataset: "LoadData") -> Dict[str, Any]:
+    """The attributes an analysis file must have to belong to the experiment of dataset."""
+    return {
+        "fl_integrated": os.path.abspath(dataset.fl_integrated),
+        "fl_raw": os.path.abspath(dataset.fl_raw),
+        "start_macro": int(dataset.fl_start_macro),
+        "end_macro": (
+            -1
+            if dataset.fl_end_macro is None or np.isnan(dataset.fl_end_macro)
+            else int(dataset.fl_end_macro)
+        ),
+        "pos_scan_motor": str(dataset.pos_scan_motor),
+        "h_group_motor": str(dataset.h_group_motor),
+    }
+
+
+def find_analysis_group(fl_analysis: str, dataset: "LoadData") -> Optional[str]:
+    """
+    Return the group of the height group of dataset in an analysis file, or None if the file cannot be used.
+
+    The file cannot be used if it does not exist, was written for another experiment, or if the raw or integrated
+    file changed since it was written, e.g. because scans were appended during a beamtime.
+    """
+    if not os.path.exists(fl_analysis):
+        return None
+    group = f"height_group/{dataset.height_group}"
+    with aux.get_file_pool().file(fl_analysis) as f:
+        attrs = dict(f.attrs)
+        if attrs.get("format") != ANALYSIS_FORMAT or group not in f:
+            return None
+    for name, value in _experiment_attrs(dataset).items():
+        if name not in attrs or attrs[name] != value:
+            return None
+    for name in ("fl_integrated", "fl_raw"):
+        if not np.array_equal(
+            attrs[f"{name}.signature"], aux.file_signature(attrs[name])
+        ):
+            return None
+    if attrs.get("compression") == "blosc":
+        # Registers the Blosc filter with HDF5
+        try:
+            import hdf5plugin  # noqa: F401
+        except ImportError:
+            return None
+    return group
+
+
+@profiling.timed("repack")
+def repack_experiment(
+    dataset: "LoadData",
+    fl_analysis: Optional[str] = None,
+    compression: Optional[str] = "auto",
+    chunk_scans: int = 16,
+    chunk_q: int = 256,
+) -> str:
+    """
+    Write the analysis file of the experiment of dataset, with all of its height groups.
+
+    Spectra are read and written chunk_scans scans at a time, so the experiment never has to fit in memory. Spectra on
+    a different q axis are interpolated onto the one of the first scan of their height group, and scans with fewer
+    positions are padded with NaN, as in LoadData.get_intensity_cube.
+
+    Parameters:
+    dataset (LoadData): Any height group of the experiment.
+    fl_analysis (str, optional): The path of the analysis file. Defaults to analysis_path of the experiment.
+    compression (str, optional): "blosc" (LZ4 in Blosc, requires hdf5plugin), "gzip" (level 1), None, or "auto" for
+    Blosc if hdf5plugin is installed and gzip otherwise.
+    chunk_scans (int): Number of scans per chunk of the intensity datasets.
+    chunk_q (int): Number of q bins per chunk of the intensity datasets.
+
+    Returns:
+    str: The path of the analysis file.
+    """
+    import h5py
+    from .dataset import group_heights
+
+    if fl_analysis is None:
+        fl_analysis = analysis_path(dataset.fl_integrated, dataset.fl_num)
+    compression = _resolve_compression(compression)
+    options = _compression_options(compression)
+    attrs = _experiment_attrs(dataset)
+    signatures = {
+        name: np.array(aux.file_signature(attrs[name]), dtype=np.int64)
+        for name in ("fl_integrated", "fl_raw")
+    }
+
+    height_array = dataset.get_height_array(
+        dataset.fl_start_macro, dataset.fl_end_macro
+    )
+    index = dataset.scan_index
+    tmp_path = f"{fl_analysis}.{os.getpid()}.tmp"
+    with h5py.File(tmp_path, "w") as f:
+        for group_num, frames in enumerate(group_heights(height_array)):
+            group = f.create_group(f"height_group/{group_num}")
+
+            n_positions = max(
+                aux.get_shape(
+                    dataset.fl_integrated, f"{n}.1/p3_integrate/integrated/intensity"
+                )[0]
+                for n in frames
+            )
+            q = aux.get_data(
+                dataset.fl_integrated, f"{frames[0]}.1/p3_integrate/integrated/q"
+            )
+            group["q"] = q
+            group["scan"] = np.asarray(frames, dtype=np.int64)
+            group["time"] = index.get("start_time", frames)
+            group["height"] = index.get(dataset.h_group_motor, frames)
+            shape = (len(frames), n_positions, len(q))
+            chunks = (min(chunk_scans, len(frames)), 1, min(chunk_q, len(q)))
+            intensity = None
+            for start in range(0, len(frames), chunk_scans):
+                batch = frames[start : start + chunk_scans]
+                _, block = dataset._read_intensity_cube(batch, q=q)
+                if intensity is None:
+                    intensity = group.create_dataset(
+                        "intensity",
+                        shape=shape,
+                        dtype=block.dtype,
+                        chunks=chunks,
+                        fillvalue=np.nan,
+                        **options,
+                    )
+                with profiling.stage("repack.write"):
+                    intensity[start : start + len(batch), : block.shape[1]] = block
+
+        f.attrs["format"] = ANALYSIS_FORMAT
+        f.attrs["compression"] = str(compression)
+        for name, value in attrs.items():
+            f.attrs[name] = value
+        for name, signature in signatures.items():
+            f.attrs[f"{name}.signature"] = signature
+    aux.close_files(fl_analysis)
+    os.replace(tmp_path, fl_analysis)
+    return fl_analysis
@@ -0,0 +1,133 @@
+"""This module writes synthetic experiment files in the layout of the ESRF ID31 beamline files read by the dataset module.
+
+The files can be used to try out the package, and they are used by the benchmark suite, without sharing beamtime data.
+A synthetic experiment consists of:
+
+- a raw hdf5 file with one "N.1" group per scan holding "start_time" and "instrument/positioners/<motor>",
+- an integrated hdf5 file with "N.1/p3_integrate/integrated/q" and "N.1/p3_integrate/integrated/intensity",
+- the experiment information Excel file read by LoadData.get_fl_detail,
+- a GC Excel file in the layout read by auxiliary.get_fe.
+"""
+
+import os
+import datetime
+import h5py
+import numpy as np
+import pandas as pd
+from typing import Dict, Sequence
+
+
+def write_synthetic_experiment(
+    directory: str,
+    n_scans: int = 100,
+    n_positions: int = 20,
+    n_q: int = 1000,
+    n_height_groups: int = 4,
+    fl_num: int = 1,
+    scan_interval: float = 30.0,
+    ragged: bool = False,
+    peaks: Sequence[float] = (2.0, 2.9, 3.4),
+    pos_scan_motor: str = "pp01",
+    h_group_motor: str = "h1tz",
+    seed: int = 0,
+) -> Dict[str, str]:
+    """
+    Write a synthetic experiment into a directory.
+
+    The scans cycle through n_height_groups motor heights. Every spectrum holds Gaussian peaks at the given q values on
+    a decaying background with Poisson-like noise; the height of the peaks changes with time and position, and the
+    peaks slowly shift, so the heatmap and peak-time plots show some structure.
+
+    Parameters:
+    directory (str): Directory to write the files into. It is created if needed.
+    n_scans (int): Number of scans.
+    n_positions (int): Number of positions per scan.
+    n_q (int): Number of q bins per spectrum.
+    n_height_groups (int): Number of distinct motor heights the scans cycle through.
+    fl_num (int): Experimental number written into the experiment information file.
+    scan_interval (float): Time between the start of two scans in seconds.
+    ragged (bool): If True, every fifth scan has two positions less, as happens when a scan is aborted.
+    peaks (sequence of float): q positions of the peaks.
+    pos_scan_motor (str): Name of the position scanning motor.
+    h_group_motor (str): Name of the height group motor.
+    seed (int): Seed of the random number generator.
+
+    Returns:
+    Dict[str, str]: The paths of the "raw", "integrated", "data_info" and "gc" files.
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = {
+        "raw": os.path.join(directory, f"exp{fl_num}_raw.h5"),
+        "integrated": os.path.join(directory, f"exp{fl_num}_integrated.h5"),
+        "data_info": os.path.join(directory, f"exp{fl_num}_info.xlsx"),
+        "gc": os.path.join(directory, f"exp{fl_num}_gc.xlsx"),
+    }
+    rng = np.random.default_rng(seed)
+    q = np.linspace(0.5, 6.0, n_q)
+    heights = 1.0 + 0.2 * np.arange(n_height_groups)
+    start = datetime.datetime(2023, 9, 14, 10, 0, 0, tzinfo=datetime.timezone.utc)
+    background = 50 * np.exp(-q / 2)
+
+    with h5py.File(paths["raw"], "w") as f_raw, h5py.File(
+        paths["integrated"], "w"
+    ) as f_integrated:
+        for scan_num in range(1, n_scans + 1):
+            progress = (scan_num - 1) / max(n_scans - 1, 1)
+            n_pos = n_positions
+            if ragged and scan_num % 5 == 0:
+                n_pos = max(n_positions - 2, 1)
+
+            scan = f_raw.create_group(f"{scan_num}.1")
+            timestamp = start + datetime.timedelta(
+                seconds=(scan_num - 1) * scan_interval
+            )
+            scan["start_time"] = timestamp.isoformat().encode("utf-8")
+            positioners = scan.create_group("instrument/positioners")
+            # A small jitter on the height checks that the grouping rounds the motor readback
+            positioners[h_group_motor] = heights[(scan_num - 1) % n_height_groups] + (
+                rng.uniform(-2e-4, 2e-4)
+            )
+            positioners[pos_scan_motor] = np.linspace(0.0, 0.01 * n_pos, n_pos)
+
+            position_profile = np.linspace(0.5, 1.5, n_pos)[:, None]
+            intensity = np.repeat(background[None, :], n_pos, axis=0)
+            for k, q_peak in enumerate(peaks):
+                amplitude = 100 * (1 + (k + 1) * progress) * position_profile
+                center = q_peak - 0.02 * progress
+                intensity = intensity + amplitude * np.exp(
+                    -((q[None, :] - center) ** 2) / (2 * 0.01**2)
+                )
+            intensity = intensity + rng.normal(0, np.sqrt(intensity))
+            integrated = f_integrated.create_group(
+                f"{scan_num}.1/p3_integrate/integrated"
+            )
+            integrated["q"] = q
+            integrated["intensity"] = intensity.astype(np.float32)
+
+    pd.DataFrame(
+        {
+            "Experimental number": [fl_num],
+            "Integrated file directory": [os.path.abspath(paths["integrated"])],
+            "Raw file directory": [os.path.abspath(paths["raw"])],
+            "Macro start number": [1],
+            "Macro end number (optional)": [np.nan],
+            "Condition name": ["synthetic"],
+            "Position scanning motor": [pos_scan_motor],
+            "Height group motor": [h_group_motor],
+        }
+    ).to_excel(paths["data_info"], index=False)
+
+    # The GC file has the sample time in the first column and a block of Faradaic efficiencies starting at the "fe"
+    # column, with the product names in the first row and the data starting at the third row.
+    n_gc = max(int(n_scans * scan_interval / 600), 2)
+    gc_time = start.timestamp() + 600 * np.arange(n_gc)
+    fe_h2 = 0.2 + 0.1 * np.linspace(0, 1, n_gc)
+    fe_c2h4 = 0.4 - 0.1 * np.linspace(0, 1, n_gc)
+    fe_co = np.full(n_gc, 0.1)
+    rows = [[None, None, "H2", "C2H4", "CO", None], [None, None, "-", "-", "-", None]]
+    for i in range(n_gc):
+        rows.append([gc_time[i], None, fe_h2[i], fe_c2h4[i], fe_co[i], None])
+    pd.DataFrame(rows, columns=[None, "sample", "fe", None, None, "comment"]).to_excel(
+        paths["gc"], index=False
+    )
+    return paths
@@ -0,0 +1,46 @@
+import h5py
+import numpy as np
+from twaxs import auxiliary as aux
+from twaxs.dataset import LoadData
+from twaxs.synthetic import write_synthetic_experiment
+
+N_SCANS = 24
+
+
+def _truncate(path, n_scans):
+    with h5py.File(path, "a") as f:
+        for scan_num in range(n_scans + 1, N_SCANS + 1):
+            del f[f"{scan_num}.1"]
+
+
+def _append(source, destination, n_scans):
+    # The beamline writes the file while it is read, which h5py does not allow within one process
+    aux.close_files(destination)
+    with h5py.File(source, "r") as src, h5py.File(destination, "a") as dst:
+        for scan_num in range(n_scans + 1, N_SCANS + 1):
+            src.copy(f"{scan_num}.1", dst)
+
+
+def test_background_cube_follows_refresh(tmp_path):
+    kwargs = dict(n_scans=N_SCANS, n_positions=6, n_q=200, n_height_groups=2)
+    full = write_synthetic_experiment(str(tmp_path / "full"), **kwargs)
+    live = write_synthetic_experiment(str(tmp_path / "live"), **kwargs)
+    for name in ("raw", "integrated"):
+        _truncate(live[name], N_SCANS // 2)
+
+    dataset = LoadData(1, 0, live["data_info"])
+    _, cube = dataset.get_intensity_cube(background="first")
+    assert cube.shape[0] == len(dataset.height_group_frame)
+
+    for name in ("raw", "integrated"):
+        _append(full[name], live[name], N_SCANS // 2)
+    assert dataset.refresh()
+
+    reference = LoadData(1, 0, full["data_info"])
+    assert dataset.height_group_frame == reference.height_group_frame
+    q, cube = dataset.get_intensity_cube(background="first")
+    q_ref, cube_ref = reference.get_intensity_cube(background="first")
+    np.testing.assert_allclose(q, q_ref)
+    np.testing.assert_allclose(cube, cube_ref, equal_nan=True)
+    heights = dataset.peak_height_map(1.9, 2.1, background="first")
+    assert heights.shape == (len(reference.height_group_frame), 6)
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+from twaxs import phases
+from twaxs.references import DEFAULT_WAVELENGTH, ReferenceLibrary
+
+Q = np.linspace(0.5, 6.0, 2000)
+CENTERS = np.array([2.0, 2.9, 3.4])
+HEIGHTS = np.array([100.0, 60.0, 40.0])
+
+
+def _two_theta(q):
+    return np.degrees(2 * np.arcsin(q * DEFAULT_WAVELENGTH / (4 * np.pi)))
+
+
+def _spectra(n, with_peaks, seed=0):
+    """Spectra on the background of the synthetic experiments, with Poisson-like noise."""
+    rng = np.random.default_rng(seed)
+    clean = np.tile(50 * np.exp(-Q / 2), (n, 1))
+    if with_peaks:
+        scale = rng.uniform(0.5, 1.0, (n, 1, 1))
+        profiles = np.exp(-((Q - CENTERS[:, None]) ** 2) / (2 * 0.01**2))
+        clean += (scale * HEIGHTS[:, None] * profiles).sum(axis=1)
+    return clean + rng.normal(0, np.sqrt(clean))
+
+
+def _library():
+    two_theta = _two_theta(np.concatenate([CENTERS, [2.0, 4.5], [1.5, 5.0]]))
+    intensity = np.array([100, 60, 40, 50, 100, 100, 100])
+    return ReferenceLibrary(
+        ["match", "partial", "absent"], [0, 3, 5, 7], two_theta, intensity
+    )
+
+
+def test_detect_peaks_finds_known_peaks():
+    peaks = phases.detect_peaks(Q, _spectra(100, with_peaks=True))
+    for center in CENTERS:
+        near = np.abs(Q - center) <= 0.01
+        assert peaks[:, near].any(axis=-1).mean() > 0.9
+    far = np.abs(Q[:, None] - CENTERS).min(axis=1) > 0.05
+    assert peaks[:, far].sum() <= 5
+
+    assert not phases.detect_peaks(Q, _spectra(100, with_peaks=False)).any()
+
+
+def test_detect_peaks_next_to_strong_peak():
+    rng = np.random.default_rng(2)
+    clean = np.tile(50 * np.exp(-Q / 2), (100, 1))
+    for center, height in ((2.0, 3000), (2.1, 40)):
+        clean += height * np.exp(-((Q - center) ** 2) / (2 * 0.01**2))
+    peaks = phases.detect_peaks(Q, clean + rng.normal(0, np.sqrt(clean)))
+    # The strong peak must not raise the noise estimate around it
+    assert peaks[:, np.abs(Q - 2.1) <= 0.01].any(axis=-1).all()
+
+
+def test_detect_peaks_requires_smoothing():
+    with pytest.raises(ValueError):
+        phases.detect_peaks(Q, _spectra(1, with_peaks=True), smoothing=1)
+
+
+def test_match_phases_scores():
+    cube = np.stack([_spectra(50, True), _spectra(50, False, seed=1)], axis=1)
+    matches = phases.match_phases(Q, cube, _library())
+    score = matches["score"]
+    assert score.shape == (50, 2, 3)
+    assert score[:, 0, 0].mean() > 0.95
+    assert matches["present"][:, 0, 0].all()
+    np.testing.assert_allclose(score[:, 0, 1], 1 / 3, atol=1e-6)
+    assert not matches["present"][:, 0, 2].any()
+    assert not matches["present"][:, 1].any()